@@ -0,0 +1,74 @@
+import argparse
+import json
+import sys
+from time import time
+
+from main import prepare_topology
+
+sys.path.append("./pox/")
+from pox.ext.jelly_analytics import (bisection_bandwidth, link_loads, load_summary, path_diversity,
+                                     path_length_distribution)
+from pox.ext.jelly_paths import SwitchGraph
+from pox.ext.jelly_topology import load_topology
+
+
+def analyze(topo, algorithm, k, sources=None, pairs=None, trials=4, workers=1, seed=0):
+    """
+    Every whole-topology statistic of one topology, as a JSON-friendly dict.
+    """
+    graph = SwitchGraph.from_topo(topo)
+    report = {'switches': graph.n, 'servers': topo['n_hosts'], 'links': graph.n_edges // 2,
+              'topology_seed': topo.get('seed'), 'seed': seed}
+
+    start = time()
+    lengths, unreachable = path_length_distribution(graph, sources, seed)
+    pairs_seen = sum(lengths.values())
+    report['path_lengths'] = lengths
+    report['mean_path_length'] = float(sum(h * c for h, c in lengths.items())) / max(1, pairs_seen)
+    report['unreachable_pairs'] = unreachable
+    report['shortest_path_diversity'] = path_diversity(graph, sources, k, seed)
+    sys.stdout.write("Path lengths and diversity in %.2fs\n" % (time() - start))
+
+    start = time()
+    report['bisection'] = bisection_bandwidth(graph, topo['n_hosts'], trials, seed)
+    sys.stdout.write("Bisection in %.2fs\n" % (time() - start))
+
+    start = time()
+    report['link_load'] = load_summary(link_loads(graph, algorithm, k, pairs, workers=workers, seed=seed))
+    sys.stdout.write("Link loads under %s in %.2fs\n" % (algorithm, time() - start))
+    return report
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Path length, path diversity, bisection and link load statistics of a Jellyfish topology.")
+    parser.add_argument('--servers', help='Number of servers', default=686, type=int)
+    parser.add_argument('--switches', help='Number of switches', default=245, type=int)
+    parser.add_argument('--ports', help='Number of ports per switch', default=14, type=int)
+    parser.add_argument('--seed', help='Topology and sampling seed', default=0, type=int)
+    parser.add_argument('--topology', help='Analyze this saved topology instead of generating one', default=None)
+    parser.add_argument('--results', help='Directory for generated topologies', default='results')
+    parser.add_argument('--algo', help='Routing the link loads are computed under', default='kshort', choices=['kshort', 'ecmp'])
+    parser.add_argument('--k', help='Number of paths per switch pair', default=8, type=int)
+    parser.add_argument('--sources', help='BFS from this many random switches instead of all of them', default=None, type=int)
+    parser.add_argument('--pairs', help='Route this many random switch pairs for link loads instead of all of them', default=None, type=int)
+    parser.add_argument('--trials', help='Starting cuts refined when estimating the bisection', default=4, type=int)
+    parser.add_argument('--workers', help='Number of processes used to compute paths', default=1, type=int)
+    parser.add_argument('--output', help='JSON report path', default='analysis.json')
+    args = parser.parse_args()
+
+    topo_path = args.topology
+    if topo_path is None:
+        spec = {'servers': args.servers, 'switches': args.switches, 'ports': args.ports}
+        topo_path = prepare_topology(args.results, spec, args.seed)
+    topo = load_topology(topo_path)
+
+    report = analyze(topo, args.algo, args.k, args.sources, args.pairs, args.trials, args.workers, args.seed)
+    sys.stdout.write("Mean path length %.3f hops, bisection %d links (%.2f per server, Bollobas bound %.2f), busiest link %.1f pairs (mean %.1f)\n" % (
+        report['mean_path_length'], report['bisection']['links'], report['bisection']['links_per_server'],
+        report['bisection']['lower_bound_links_per_server'],
+        report['link_load']['max'], report['link_load']['mean']))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    sys.stdout.write("Saved results to %s\n" % args.output)
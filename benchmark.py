@@ -0,0 +1,214 @@
+import argparse
+import csv
+import json
+import random
+import resource
+import sys
+import traceback
+from multiprocessing import Process, Queue
+from Queue import Empty
+from time import time
+
+from experiments import config_key, experiment_matrix
+from main import permutation_traffic, summarize
+from topology import generate_topology
+
+sys.path.append("./pox/")
+from pox.ext.jelly_paths import LinkIncidence, PathStore, SwitchGraph
+
+
+STAGES = ['generate', 'paths', 'link_counts', 'summarize']
+
+# permutations counted per config, enough that link counting isn't all
+# fixed overhead
+BENCH_PERMUTATIONS = 256
+
+# stage timings closer than this to the baseline are noise, not regressions
+MIN_DIFF_SECONDS = 0.05
+
+
+def parse_size(spec):
+    servers, switches, ports = [int(x) for x in spec.split(':')]
+    return {'servers': servers, 'switches': switches, 'ports': ports}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_benchmark(config, workers=1):
+    """
+    Times each pipeline stage of one config.
+    """
+    seconds = {}
+    spec = config['topology']
+
+    start = time()
+    topo = generate_topology(n_servers=spec['servers'], n_switches=spec['switches'], n_ports=spec['ports'],
+                             seed=config['seed'])
+    graph = SwitchGraph.from_topo(topo)
+    seconds['generate'] = time() - start
+
+    start = time()
+    store = PathStore.compute(topo, config['algo'], config['k'], workers)
+    seconds['paths'] = time() - start
+
+    rng = random.Random(config['seed'])
+    traffic = [permutation_traffic(topo, rng) for _ in range(BENCH_PERMUTATIONS)]
+    start = time()
+    counts = LinkIncidence(store, graph).batch_link_counts(traffic)
+    seconds['link_counts'] = time() - start
+
+    start = time()
+    for row in counts:
+        summarize(graph.link_paths(row))
+    seconds['summarize'] = time() - start
+
+    return {
+        'config': config,
+        'seconds': seconds,
+        'n_paths': len(store.paths),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _benchmark_into(queue, config, workers):
+    try:
+        queue.put(run_benchmark(config, workers))
+    except Exception:
+        queue.put({'config': config, 'error': traceback.format_exc()})
+
+
+def run_isolated(config, workers=1, timeout=None):
+    """
+    run_benchmark() in a new process, so peak memory doesn't carry over from
+    one config to the next. Not a Pool process, since those can't start the
+    path workers.
+
+    If the process fails, dies (say, killed for running out of memory) or
+    takes longer than `timeout` seconds, the result is just the config and
+    an 'error' message.
+    """
+    queue = Queue()
+    process = Process(target=_benchmark_into, args=(queue, config, workers))
+    process.start()
+    start = time()
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            if not process.is_alive():
+                # it may have put its result just before exiting
+                try:
+                    result = queue.get(timeout=1)
+                except Empty:
+                    result = {'config': config, 'error': "benchmark process exited with code %s" % process.exitcode}
+            elif timeout is not None and time() - start > timeout:
+                process.terminate()
+                result = {'config': config, 'error': "benchmark took more than %ds" % timeout}
+    process.join()
+    return result
+
+
+def write_csv(results, out_filepath):
+    with open(out_filepath, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['servers', 'switches', 'ports', 'algo', 'k', 'seed', 'n_paths'] +
+                        [stage + '_s' for stage in STAGES] + ['peak_rss_mb'])
+        for r in results:
+            if 'error' in r:
+                continue
+            c = r['config']
+            writer.writerow([c['topology']['servers'], c['topology']['switches'], c['topology']['ports'],
+                             c['algo'], c['k'], c['seed'], r['n_paths']] +
+                            ['%.4f' % r['seconds'][stage] for stage in STAGES] +
+                            ['%.1f' % r['peak_rss_mb']])
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints every stage's time against the baseline run of the same config and
+    returns the number of stages that got slower by more than `tolerance`,
+    counting a failed config as one.
+    """
+    previous = dict((config_key(r['config']), r) for r in baseline if 'error' not in r)
+    regressions = 0
+    for r in results:
+        before = previous.get(config_key(r['config']))
+        c = r['config']
+        name = "%(servers)d:%(switches)d:%(ports)d" % c['topology'] + " %s k=%d" % (c['algo'], c['k'])
+        if 'error' in r:
+            sys.stdout.write("%s: failed\n" % name)
+            regressions += 1
+            continue
+        if before is None:
+            sys.stdout.write("%s: not in baseline\n" % name)
+            continue
+
+        for stage in STAGES + ['peak_rss_mb']:
+            if stage == 'peak_rss_mb':
+                old, new, unit = before['peak_rss_mb'], r['peak_rss_mb'], 'MB'
+                significant = True
+            else:
+                old, new, unit = before['seconds'][stage], r['seconds'][stage], 's'
+                significant = abs(new - old) >= MIN_DIFF_SECONDS
+            ratio = new / old if old > 0 else float('inf')
+            verdict = ''
+            if not significant:
+                pass
+            elif ratio > 1 + tolerance:
+                verdict = '  REGRESSION'
+                regressions += 1
+            elif ratio < 1 / (1 + tolerance):
+                verdict = '  faster'
+            sys.stdout.write("%s %-12s %10.3f%s -> %10.3f%s  (x%.2f)%s\n" % (name, stage, old, unit, new, unit, ratio, verdict))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Time the Figure 9 / Table 1 pipeline stages across topology sizes.")
+    parser.add_argument('--sizes', help='Topologies as servers:switches:ports', nargs='+',
+                        default=['80:32:6', '240:96:8', '686:245:14'])
+    parser.add_argument('--algos', help='Path algorithms', nargs='+', default=['kshort', 'ecmp'], choices=['kshort', 'ecmp'])
+    parser.add_argument('--k', help='Numbers of paths per switch pair', nargs='+', default=[8], type=int)
+    parser.add_argument('--seed', help='Topology and permutation seed', default=0, type=int)
+    parser.add_argument('--workers', help='Number of processes used to compute paths', default=1, type=int)
+    parser.add_argument('--timeout', help='Seconds after which a config is given up on', default=None, type=float)
+    parser.add_argument('--output', help='JSON results path', default='benchmark.json')
+    parser.add_argument('--csv', help='Also write the results as CSV to this path', default=None)
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against', default=None)
+    parser.add_argument('--tolerance', help='Relative slowdown reported as a regression', default=0.2, type=float)
+    args = parser.parse_args()
+
+    configs = experiment_matrix('benchmark', topology=[parse_size(s) for s in args.sizes], algo=args.algos,
+                                k=args.k, seed=[args.seed])
+
+    results = []
+    for config in configs:
+        results.append(run_isolated(config, args.workers, args.timeout))
+        if 'error' in results[-1]:
+            sys.stdout.write("  %s k=%d: failed: %s\n" % (config['algo'], config['k'], results[-1]['error'].strip()))
+            sys.stdout.flush()
+            continue
+        s = results[-1]['seconds']
+        sys.stdout.write("  %s k=%d: %s, peak %.0f MB\n" % (
+            config['algo'], config['k'], ", ".join("%s %.2fs" % (stage, s[stage]) for stage in STAGES),
+            results[-1]['peak_rss_mb']))
+        sys.stdout.flush()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    sys.stdout.write("Saved results to %s\n" % args.output)
+    if args.csv:
+        write_csv(results, args.csv)
+        sys.stdout.write("Saved results to %s\n" % args.csv)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        sys.stdout.write("\nCompared to %s:\n" % args.baseline)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
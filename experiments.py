@@ -0,0 +1,106 @@
+import hashlib
+import itertools
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+
+# experiment kinds cheap enough to run several at once, unlike the Mininet
+# runs which need the whole machine (and root) to themselves
+LIGHTWEIGHT_KINDS = ('paths', 'flowsim')
+
+
+def experiment_matrix(kind, **axes):
+    """
+    One config per combination of the given axes, e.g.
+    experiment_matrix('table1', algo=['ecmp', 'kshort'], nflows=[1, 8], ...).
+    """
+    names = sorted(axes)
+    configs = []
+    for values in itertools.product(*[axes[name] for name in names]):
+        config = dict(zip(names, values))
+        config['kind'] = kind
+        configs.append(config)
+    return configs
+
+
+def config_key(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """
+    One JSON file per completed config, named by the config's hash, so an
+    interrupted sweep picks up where it stopped.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, config):
+        return os.path.join(self.directory, "%s-%s.json" % (config['kind'], config_key(config)[:16]))
+
+    def get(self, config):
+        path = self.path(config)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            entry = json.load(f)
+        return entry['result'] if entry['config'] == config else None
+
+    def put(self, config, result):
+        path = self.path(config)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'config': config, 'result': result}, f, indent=2, sort_keys=True)
+        os.rename(tmp, path)
+
+
+def _run_config(runner, config):
+    return config, runner(config)
+
+
+def run_sweep(configs, runners, cache, jobs=1):
+    """
+    Runs every config not already in `cache` with runners[config['kind']]
+    and returns the results in config order.
+
+    With jobs > 1 the lightweight configs run concurrently in a process pool.
+    They all finish before the first Mininet config starts, so they never
+    compete with a throughput measurement for CPU.
+    """
+    pending = [c for c in configs if cache.get(c) is None]
+    if len(pending) < len(configs):
+        sys.stdout.write("Reusing %d cached results from %s\n" % (len(configs) - len(pending), cache.directory))
+        sys.stdout.flush()
+
+    light = [c for c in pending if c['kind'] in LIGHTWEIGHT_KINDS]
+    heavy = [c for c in pending if c['kind'] not in LIGHTWEIGHT_KINDS]
+
+    if jobs > 1 and len(light) > 1:
+        pool = Pool(min(jobs, len(light)))
+        try:
+            # results are cached as each config finishes, not at the end
+            running = [pool.apply_async(_run_config, (runners[config['kind']], config),
+                                        callback=lambda done: cache.put(*done))
+                       for config in light]
+        finally:
+            pool.close()
+            pool.join()
+        # re-raises the exception of the first config that failed, as the
+        # serial path would
+        for result in running:
+            result.get()
+        light = []
+
+    for config in light + heavy:
+        cache.put(config, runners[config['kind']](config))
+
+    results = [cache.get(c) for c in configs]
+    failed = [c for c, r in zip(configs, results) if r is None]
+    if failed:
+        raise RuntimeError("%d experiment configs did not complete, e.g. %r" % (len(failed), failed[0]))
+    return results
@@ -1,38 +1,28 @@
 import argparse
 import networkx as nx
+import numpy as np
 import os
 import pickle
 import random
-import re
 import subprocess
 import sys
 from collections import defaultdict, OrderedDict
-from itertools import islice
+from functools import partial
 from time import sleep, time
 
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt 
+import matplotlib.pyplot as plt
+from matplotlib.ticker import MaxNLocator
 
-from topology import generate_topology
+from experiments import ResultCache, config_key, experiment_matrix, run_sweep
+from topology import RNG_SEED, generate_topology
 
 sys.path.append("./pox/")
-from pox.ext.build_topology import build_and_run
-
-
-def k_shortest_paths(G, start, end, k):
-    return list(islice(nx.shortest_simple_paths(G, start, end), k))
-
-
-def ecmp(G, start, end, k):
-    paths = []
-    for p in nx.shortest_simple_paths(G, start, end):
-        if len(paths) < k and (len(paths) == 0 or len(p) == len(paths[0])):
-            paths.append(p)
-        else:
-            break
-
-    return paths
+from pox.ext.jelly_flowsim import simulate_permutation
+from pox.ext.jelly_paths import (LinkIncidence, PathWorkers, SwitchGraph, get_path_store,
+                                 path_store_file, switch_id)
+from pox.ext.jelly_topology import load_topology, save_topology
 
 
 def host_to_switch(topo, h_idx):
@@ -42,9 +32,9 @@ def host_to_switch(topo, h_idx):
     return h_idx
 
 
-def random_permutation(topo):
+def random_permutation(topo, rng):
     hosts = list(range(topo["n_hosts"])) 
-    random.shuffle(hosts)
+    rng.shuffle(hosts)
 
     pairings = []
     while len(hosts) > 1:
@@ -55,7 +45,10 @@ def random_permutation(topo):
 
         # if x and y are at the same switch, reshuffle remaining hosts and retry
         if x_switch == y_switch:
-            random.shuffle(hosts)
+            if len(set(host_to_switch(topo, h) for h in hosts)) == 1:
+                # the hosts left all share a switch; no reshuffle can pair them
+                break
+            rng.shuffle(hosts)
             continue
 
         pairings.append((
@@ -67,62 +60,105 @@ def random_permutation(topo):
     return pairings
 
 
-def is_switch_node(node_name):
-    return node_name[0] == 's'
-
-
-def generate_path_counts(topo, algorithm, k, target_paths_on_link):
-    sys.stdout.write("Generating paths using %s (k=%d).." % (algorithm, k))
-    sys.stdout.flush()
+def permutation_traffic(topo, rng):
+    """
+    Both directions of every pair of a random permutation, as switch ids.
+    """
+    switch_pairs = random_permutation(topo, rng)
+    src = [switch_id(s1) for s1, s2 in switch_pairs]
+    dst = [switch_id(s2) for s1, s2 in switch_pairs]
+    return src + dst, dst + src
 
-    while True:
-        sys.stdout.write(".")
-        sys.stdout.flush()
 
-        switch_pairs = random_permutation(topo)
-        paths = []
-        for switch1, switch2 in switch_pairs:
-            if algorithm == 'k-shortest':
-                fn = k_shortest_paths
-            else: # algorithm == 'ecmp':
-                fn = ecmp
+# permutations evaluated per bincount when path sets are precomputed
+PERMUTATION_BATCH = 64
 
-            paths += fn(topo["graph"], switch1, switch2, k)
-            paths += fn(topo["graph"], switch2, switch1, k)
-
-        link_paths = {}
-        for (u, v) in topo["graph"].edges():
-            if is_switch_node(u) and is_switch_node(v):
-                link_paths[(u,v)] = 0
-                link_paths[(v,u)] = 0
+def generate_path_counts(topo, algorithm, k, target_paths_on_link, store=None, workers=1,
+                         seed=0, max_permutations=10000, max_seconds=120.0):
+    """
+    Draws seeded random permutations until one puts exactly
+    `target_paths_on_link` paths on its busiest link, or the permutation or
+    wall-clock budget runs out, in which case the closest one is used.
+    """
+    sys.stdout.write("Counting paths using %s (k=%d).." % (algorithm, k))
+    sys.stdout.flush()
 
-        for p in paths:
-            for i in range(len(p)-1):
-                link_paths[(p[i], p[i+1])] += 1
+    rng = random.Random(seed)
+    graph = SwitchGraph.from_topo(topo)
+    pool = None
+    if store is not None:
+        # candidates are scored against the per-pair link incidence, a batch
+        # at a time
+        evaluate = LinkIncidence(store, graph).batch_link_counts
+        batch_size = PERMUTATION_BATCH
+    else:
+        pool = PathWorkers(graph, algorithm, k, workers)
+        evaluate = lambda traffic: [pool.count_pair_paths(src, dst) for src, dst in traffic]
+        batch_size = 1
+
+    distribution = defaultdict(int)
+    best = None
+    tried = 0
+    deadline = time() + max_seconds
+    try:
+        while best is None or (best.max() != target_paths_on_link and
+                               tried < max_permutations and time() < deadline):
+            sys.stdout.write(".")
+            sys.stdout.flush()
+
+            traffic = [permutation_traffic(topo, rng)
+                       for _ in range(max(1, min(batch_size, max_permutations - tried)))]
+            for counts in evaluate(traffic):
+                tried += 1
+                max_paths = counts.max()
+                distribution[max_paths] += 1
+                if best is None or abs(max_paths - target_paths_on_link) < abs(best.max() - target_paths_on_link):
+                    best = counts
+    finally:
+        if pool is not None:
+            pool.close()
+
+    if best.max() == target_paths_on_link:
+        sys.stdout.write(" done\n")
+    else:
+        sys.stdout.write(" budget exhausted, using closest (max %d paths on a link)\n" % best.max())
+    sys.stdout.write("  max paths on a link over %d permutations: %s\n" % (
+        tried, ", ".join("%d (x%d)" % (m, distribution[m]) for m in sorted(distribution))))
+    sys.stdout.flush()
+    return graph.link_paths(best)
 
-        if max(link_paths.values()) == target_paths_on_link:
-            break
 
+def load_path_store(topo, topo_path, algorithm, k, workers):
+    sys.stdout.write("Loading %s (k=%d) path sets for all switch pairs..." % (algorithm, k))
+    sys.stdout.flush()
+    store = get_path_store(topo, algorithm, k, path_store_file(topo_path, algorithm, k), workers)
     sys.stdout.write(" done\n")
     sys.stdout.flush()
-    return link_paths
+    return store
 
 
 def summarize(link_paths):
-    max_paths = max(link_paths.values())
+    # Summarize data for graph: entry i is the number of links on at most i
+    # distinct paths
+    counts = np.fromiter(link_paths.values(), dtype=np.int64, count=len(link_paths))
+    return np.cumsum(np.bincount(counts)).tolist()
 
-    # Summarize data for graph
-    link_counts = [0] * (max_paths + 1)
-    for path_count in link_paths.values():
-        link_counts[path_count] += 1
 
-    current_sum = link_counts[0]
-    cumulative_link_counts = [current_sum]
-    for i in range(1, len(link_counts)):
-        current_sum += link_counts[i]
-        cumulative_link_counts.append(current_sum)
+def step_change_points(cumulative):
+    """
+    The (x, y) points of a Figure 9 curve that change its shape. Path counts
+    no link has repeat the previous rank and only extend a vertical segment,
+    so dropping them draws the same step curve.
+    """
+    x = np.asarray(cumulative, dtype=np.int64)
+    y = np.arange(len(x))
+    keep = np.ones(len(x), dtype=bool)
+    keep[1:-1] = x[1:-1] != x[:-2]
+    return x[keep], y[keep]
 
-    return cumulative_link_counts
+
+# resolution of raster figure formats; vector formats ignore it
+RASTER_DPI = 200
 
 
 def generate_figure(cumulative_counts, format_options, out_filepath):
@@ -133,24 +169,23 @@ def generate_figure(cumulative_counts, format_options, out_filepath):
     fig = plt.figure()
     ax = fig.add_subplot(111)
 
-    max_length = max([len(c) for c in cumulative_counts])
-    
-    x = cumulative_counts
-    y = [range(len(cc)) for cc in cumulative_counts]
-
-    for i in range(len(cumulative_counts)):
-        ax.step(x[i], y[i], **format_options[i])
-
-    plt.title("Jellyfish - Figure 9")
-    plt.xlabel("Rank of Link")
-    plt.ylabel("# Distinct Paths Link is on")
-    plt.xticks(range(0, 3000+1, 500))
-    plt.yticks(range(0, max_length+1, 2))
-    plt.axis([0, 3003, 0, max_length])
-    plt.legend(loc=2)
+    max_rank = max([cc[-1] for cc in cumulative_counts])
+    max_length = max([len(cc) for cc in cumulative_counts])
+
+    for cc, options in zip(cumulative_counts, format_options):
+        x, y = step_change_points(cc)
+        ax.step(x, y, **options)
+
+    ax.set_title("Jellyfish - Figure 9")
+    ax.set_xlabel("Rank of Link")
+    ax.set_ylabel("# Distinct Paths Link is on")
+    ax.xaxis.set_major_locator(MaxNLocator(nbins=6, steps=[1, 2, 5, 10]))
+    ax.yaxis.set_major_locator(MaxNLocator(nbins=12, integer=True))
+    ax.axis([0, max_rank * 1.001, 0, max_length])
+    ax.legend(loc=2)
     ax.spines['right'].set_visible(False)
     ax.spines['top'].set_visible(False)
-    plt.grid(linestyle='dotted')
+    ax.grid(linestyle='dotted')
 
     sys.stdout.write(" done\n")
     sys.stdout.flush()
@@ -158,7 +193,10 @@ def generate_figure(cumulative_counts, format_options, out_filepath):
     sys.stdout.write("Saving figure to %s..." % out_filepath)
     sys.stdout.flush()
 
-    plt.savefig(out_filepath, format="eps", dpi=1000)
+    # the format follows the file extension (eps, pdf, svg, png, ...)
+    fmt = os.path.splitext(out_filepath)[1].lstrip('.').lower() or 'eps'
+    fig.savefig(out_filepath, format=fmt, dpi=RASTER_DPI)
+    plt.close(fig)
 
     sys.stdout.write(" done\n")
     sys.stdout.flush()
@@ -173,7 +211,7 @@ def cleanmn():
     sys.stdout.flush()
 
 
-def run_table_test(cwd, topology, algo, flows):
+def run_table_test(cwd, topology, algo, flows, seed):
 
     cleanmn()
 
@@ -181,7 +219,8 @@ def run_table_test(cwd, topology, algo, flows):
     sys.stdout.flush()
 
     os.chdir(os.path.join(cwd, 'pox/pox/ext'))
-    subprocess.call(["sudo", "python", "build_topology.py", "--pickle", topology, "--algo", algo, "--nflows", str(flows), "--output", "test_output.pickle"])
+    subprocess.call(["sudo", "python", "build_topology.py", "--topo", topology, "--algo", algo, "--nflows", str(flows),
+                     "--seed", str(seed), "--output", "test_output.pickle"])
     with open("test_output.pickle", 'rb') as f:
         output = pickle.load(f)
     os.chdir(cwd)
@@ -194,29 +233,114 @@ def run_table_test(cwd, topology, algo, flows):
 
 HOST_LINK_BW = 5.0
 
-def parse_one_flow_output(result):
-    out = result["output"]
+# an interval within this fraction of a pair's overall rate counts as
+# converged
+CONVERGED_WITHIN = 0.1
+
+def jain_fairness(values):
+    if not values or not any(values):
+        return 0.0
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+def coefficient_of_variation(values):
+    if len(values) < 2:
+        return 0.0
+    mean = sum(values) / len(values)
+    if mean == 0:
+        return 0.0
+    return (sum((v - mean) ** 2 for v in values) / len(values)) ** 0.5 / mean
+
+
+def convergence_time(series, bps):
+    """
+    End of the first interval whose rate is within CONVERGED_WITHIN of the
+    overall rate `bps`, or None if no interval is.
+    """
+    for start, end, rate in series:
+        if abs(rate - bps) <= CONVERGED_WITHIN * bps:
+            return end
+    return None
+
+
+def parse_flow_output(result):
+    """
+    Table 1 metrics from the per-pair iperf records build_topology.py saves:
+    the average pair throughput as a percentage of HOST_LINK_BW, Jain's
+    fairness across pairs (and across the -P streams of a pair), the
+    coefficient of variation of a pair's interval rates and how long pairs
+    took to reach their overall rate. Pairs whose iperf didn't report count
+    as 0 throughput.
+    """
+    flows = result["flows"]
+    pair_bw = [(f['bps'] or 0.0) / 1e6 for f in flows]
+    reported = [f for f in flows if f['bps']]
+
+    stream_fairness = [jain_fairness([s['bps'] or 0.0 for s in f['streams'].values()])
+                       for f in reported if len(f['streams']) > 1]
+    variation = [coefficient_of_variation([rate for (start, end, rate) in f['series']]) for f in reported]
+    convergence = [convergence_time(f['series'], f['bps']) for f in reported]
+    convergence = [t for t in convergence if t is not None]
+
+    mean = lambda values: sum(values) / len(values) if values else None
+    return {
+        'line_rate_pct': (sum(pair_bw) / len(pair_bw) / HOST_LINK_BW) * 100,
+        'pair_fairness': jain_fairness(pair_bw),
+        'stream_fairness': mean(stream_fairness),
+        'interval_cv': mean(variation),
+        'convergence_s': mean(convergence),
+        'failed_pairs': len(flows) - len(reported),
+    }
+
+
+def prepare_topology(results_dir, spec, seed):
+    """
+    Generates the topology for (spec, seed) the first time it is needed and
+    saves it in results_dir; later calls just return its path.
+    """
+    topo_path = os.path.join(results_dir, "topo-%s.topo" % config_key({'topology': spec, 'seed': seed})[:16])
+    if not os.path.exists(topo_path):
+        topo = generate_topology(n_servers=spec['servers'], n_switches=spec['switches'], n_ports=spec['ports'],
+                                 seed=seed)
+        save_topology(topo, topo_path)
+    return topo_path
+
+
+def run_paths_config(results_dir, workers, config):
+    topo_path = prepare_topology(results_dir, config['topology'], config['seed'])
+    topo = load_topology(topo_path)
+
+    store = None
+    if config['path_store']:
+        store = load_path_store(topo, topo_path, config['algo'], config['k'], workers)
+    link_paths = generate_path_counts(topo, config['algo'], config['k'], config['target'], store, workers,
+                                      config['seed'], config['max_permutations'], config['max_seconds'])
+    return {'cumulative_counts': summarize(link_paths), 'seed': config['seed']}
+
+
+def run_table_config(cwd, results_dir, workers, config):
+    topo_path = prepare_topology(results_dir, config['topology'], config['seed'])
 
-    bandwidth_values = []
-    for hostpair_out in out:
-        summary = hostpair_out[-2] 
-        # assume Mbits/sec
-        bandwidth_values.append(float(re.search('(\d+.\d+) .bits\/sec$', summary).group(1))) 
+    # the controller picks these up next to the topology instead of running
+    # Yen's algorithm at startup
+    load_path_store(load_topology(topo_path), topo_path, config['algo'], 8, workers)
 
-    avg_bw = sum(bandwidth_values) / len(bandwidth_values) 
-    return (avg_bw / HOST_LINK_BW) * 100
+    output = run_table_test(cwd, topo_path, config['algo'], config['nflows'], config['seed'])
+    result = parse_flow_output(output)
+    result['seed'] = output['seed']
+    return result
 
-def parse_multi_flow_output(result):
-    out = result["output"]
 
-    summed_bandwidth_values = []
-    for hostpair_out in out:
-        summary = hostpair_out[-2] 
-        # assume Mbits/sec
-        summed_bandwidth_values.append(float(re.search('(\d+.\d+) .bits\/sec$', summary).group(1))) 
+def run_flowsim_config(results_dir, config):
+    topo = load_topology(prepare_topology(results_dir, config['topology'], config['seed']))
+    result = simulate_permutation(topo, config['algo'], config['nflows'], k=8, link_bw=HOST_LINK_BW,
+                                  seed=config['seed'])
+    result['seed'] = config['seed']
+    return result
 
-    avg_bw = sum(summed_bandwidth_values) / len(summed_bandwidth_values) 
-    return (avg_bw / HOST_LINK_BW) * 100
+
+FIGURE9_TOPOLOGY = {'servers': 686, 'switches': 245, 'ports': 14}
+FIGURE9_CURVES = [('k-shortest', 8, 18), ('ecmp', 64, 13), ('ecmp', 8, 10)]
 
 
 if __name__ == "__main__":
@@ -224,30 +348,60 @@ if __name__ == "__main__":
     cwd = os.path.dirname(os.path.realpath(sys.argv[0]))
 
     parser = argparse.ArgumentParser(description="Generate Jellyfish Figure 9.")
-    parser.add_argument('--debug', help='pins RNG and allows debug output', action='store_true')
+    parser.add_argument('--debug', help='pins RNG to the fixed debug seed (overrides --seed)', action='store_true')
     parser.add_argument('--servers', help='Number of servers', default=20, type=int)
     parser.add_argument('--switches', help='Number of switches', default=32, type=int)
     parser.add_argument('--ports', help='Number of ports per switch', default=6, type=int)
-    parser.add_argument('--pickle', help='Topology pickle output path (should be relative to top-level repo dir)', default='pox/pox/ext/test_topo.pickle')
-    parser.add_argument('--figure9', help='Output path for Figure 9 (.eps file), defaults to `figure9.eps`', default='figure9.eps')
+    parser.add_argument('--figure9', help='Output path for Figure 9, in the format of its extension (.eps, .pdf, .png, ...), defaults to `figure9.eps`', default='figure9.eps')
+    parser.add_argument('--results', help='Directory for generated topologies, path sets and cached experiment results', default='results')
+    parser.add_argument('--workers', help='Number of processes used to compute paths', default=1, type=int)
+    parser.add_argument('--jobs', help='Number of path-count analyses run concurrently', default=1, type=int)
+    parser.add_argument('--seed', help='Seed for the Figure 9 topology and permutation search', default=0, type=int)
+    parser.add_argument('--table-seeds', help='Topology seeds Table 1 is averaged over (defaults to --seed)', nargs='+', type=int)
+    parser.add_argument('--search-permutations', help='Maximum permutations tried per Figure 9 curve', default=10000, type=int)
+    parser.add_argument('--search-seconds', help='Maximum seconds spent searching permutations per Figure 9 curve', default=120.0, type=float)
+    parser.add_argument('--simulate', help='estimate Table 1 with the flow-level simulator instead of Mininet (no root needed)', action='store_true')
+    parser.add_argument('--no-path-store', help='compute Figure 9 paths per sampled permutation instead of for all switch pairs (for large topologies)', action='store_true')
     args = parser.parse_args()
 
-    cleanmn()
+    if args.debug:
+        args.seed = RNG_SEED
+    table_seeds = args.table_seeds or [args.seed]
+
+    results_dir = os.path.join(cwd, args.results)
+    cache = ResultCache(results_dir)
+    # pool processes cannot start pools of their own
+    workers = args.workers if args.jobs <= 1 else 1
+    runners = {
+        'paths': partial(run_paths_config, results_dir, workers),
+        'table1': partial(run_table_config, cwd, results_dir, workers),
+        'flowsim': partial(run_flowsim_config, results_dir),
+    }
+
+    if not args.simulate:
+        cleanmn()
 
     ##### FIGURE 9 #####
 
-    # Generate full graph of randomly connected switches
+    # Calculate the random permutation traffic paths across a full graph of
+    # randomly connected switches, one independent analysis per curve
     print "\nGenerating Figure 9\n===================\n"
-    full_topo = generate_topology(n_servers=686, n_switches=245, n_ports=14, debug=args.debug)
-
-    # Calculate the random permutation traffic paths across the graph
-    link_paths = []
-    link_paths.append(generate_path_counts(full_topo, 'k-shortest', 8, 18))
-    link_paths.append(generate_path_counts(full_topo, 'ecmp', 64, 13))
-    link_paths.append(generate_path_counts(full_topo, 'ecmp', 8, 10))
+    prepare_topology(results_dir, FIGURE9_TOPOLOGY, args.seed)
+    figure9_configs = [{
+        'kind': 'paths',
+        'topology': FIGURE9_TOPOLOGY,
+        'seed': args.seed,
+        'algo': algorithm,
+        'k': k,
+        'target': target_paths_on_link,
+        'path_store': not args.no_path_store,
+        'max_permutations': args.search_permutations,
+        'max_seconds': args.search_seconds,
+    } for algorithm, k, target_paths_on_link in FIGURE9_CURVES]
+    figure9_results = run_sweep(figure9_configs, runners, cache, args.jobs)
 
     # Summarize measurements and define display options
-    cumulative_count_list = [summarize(lps) for lps in link_paths]
+    cumulative_count_list = [r['cumulative_counts'] for r in figure9_results]
     format_options = [
         {
             'label': '8 Shortest Paths',
@@ -278,19 +432,20 @@ if __name__ == "__main__":
     ##### TABLE 1 #####
 
     print "\nGenerating Table 1\n=================="
-    print "will take quite a while; using %d Mb links\n" % (HOST_LINK_BW)
-    test_topo = generate_topology(n_servers=args.servers, n_switches=args.switches, n_ports=args.ports, debug=args.debug)
-    topo_path = os.path.join(cwd, args.pickle)
-    if args.pickle:
-        with open(topo_path, 'wb') as f:
-            pickle.dump(test_topo, f)
-
-    values = {
-        ("ecmp", 1): parse_one_flow_output(run_table_test(cwd, topo_path, "ecmp", 1)),
-        ("ecmp", 8): parse_multi_flow_output(run_table_test(cwd, topo_path, "ecmp", 8)),
-        ("kshort", 1): parse_one_flow_output(run_table_test(cwd, topo_path, "kshort", 1)),
-        ("kshort", 8): parse_multi_flow_output(run_table_test(cwd, topo_path, "kshort", 8)),
-    }
+    if args.simulate:
+        print "simulating max-min fair flows on %d Mb links\n" % (HOST_LINK_BW)
+    else:
+        print "will take quite a while; using %d Mb links\n" % (HOST_LINK_BW)
+    table_topology = {'servers': args.servers, 'switches': args.switches, 'ports': args.ports}
+    table_configs = experiment_matrix('flowsim' if args.simulate else 'table1', topology=[table_topology],
+                                      seed=table_seeds, algo=['ecmp', 'kshort'], nflows=[1, 8])
+    table_results = run_sweep(table_configs, runners, cache, args.jobs)
+
+    values = defaultdict(list)
+    for config, result in zip(table_configs, table_results):
+        values[(config['algo'], config['nflows'])].append(result['line_rate_pct'])
+    for key in values:
+        values[key] = sum(values[key]) / len(values[key])
 
     # Print table
     print
@@ -300,6 +455,22 @@ if __name__ == "__main__":
     print "TCP 1 Flow | " + str(values[("ecmp", 1)])[:4] + "% \t " + str(values[("kshort", 1)])[:4] + "%"
     print "TCP 8 Flow | " + str(values[("ecmp", 8)])[:4] + "% \t " + str(values[("kshort", 8)])[:4] + "%"
 
+    # fairness and stability of the Mininet runs (the simulator doesn't
+    # measure these)
+    details = defaultdict(list)
+    for config, result in zip(table_configs, table_results):
+        if result.get('pair_fairness') is not None:
+            details[(config['algo'], config['nflows'])].append(result)
+    if details:
+        print
+        print "                     pair fairness   interval CV   converged after"
+        for (algo, nflows) in sorted(details):
+            averages = []
+            for metric in ['pair_fairness', 'interval_cv', 'convergence_s']:
+                measured = [r[metric] for r in details[(algo, nflows)] if r.get(metric) is not None]
+                averages.append(sum(measured) / len(measured) if measured else float('nan'))
+            print "%-6s TCP %d Flow |     %.3f          %.3f          %.1fs" % ((algo, nflows) + tuple(averages))
+
     print
     print "Reproduction script completed successfully"
 
@@ -2,7 +2,10 @@ import argparse
 import os
 import pickle
 import random
+import select
+import shutil
 import sys
+import tempfile
 from time import sleep, time
 
 from collections import defaultdict
@@ -17,7 +20,10 @@ from mininet.cli import CLI
 # from mininet.util import dumpNodeConnections, dumpNetConnections
 
 sys.path.append("../../")
+from pox.ext.jelly_flows import FLOW_HASHES, SELECTION_MODES
+from pox.ext.jelly_iperf import IperfParser
 from pox.ext.jelly_pox import JELLYPOX
+from pox.ext.jelly_topology import load_topology, topology_arrays
 
 
 def mac_from_value(v):
@@ -26,50 +32,26 @@ def mac_from_value(v):
 
 class JellyFishTop(Topo):
 
-    def build(self, pkl):
-        topo = pickle.load(open(pkl, 'r'))
-        outport_mappings = topo['outport_mappings']
-        self.mn_hosts = []
-        for h in range(topo['n_hosts']):
-            hosts_from_graph = topo['graph'].nodes(data='ip')
-            for host in hosts_from_graph:
-                if host[0] == 'h' + str(h):
-                    break
-            self.mn_hosts.append(self.addHost('h' + str(h), ip=host[1]))
-
-        self.mn_switches = []
-        for s in range(topo['n_switches']):
-            self.mn_switches.append(self.addSwitch('s' + str(s + 1), mac="00:00:00:00:00:" + str("{:02x}".format(s + 1))))
-
-        for e in topo['graph'].edges():
-            if e[0][0] == 'h':
-                f1 = self.mn_hosts[int(e[0][1:])]
-                f1_graph = f1
-                switch1 = False
-            else:
-                f1 = self.mn_switches[int(e[0][1:])]
-                f1_graph = 's' + str(int(f1[1:]) - 1)
-                switch1 = True 
-
-            if e[1][0] == 'h':
-                f2 = self.mn_hosts[int(e[1][1:])]
-                f2_graph = f2
-                switch2 = False
-            else:
-                f2 = self.mn_switches[int(e[1][1:])]
-                f2_graph = 's' + str(int(f2[1:]) - 1)
-                switch2 = True 
-
-            port1 = outport_mappings[(f1_graph, f2_graph)]
-            port2 = outport_mappings[(f2_graph, f1_graph)]
-            self.addLink(f1, f2, bw=5, port1=port1, port2=port2, use_htb=True)
+    def build(self, topo_path):
+        topo = load_topology(topo_path)
+        switch_links, host_links, host_ips = topology_arrays(topo)
+
+        self.host_ips = [ip.decode('ascii') for ip in host_ips]
+        self.mn_hosts = [self.addHost('h' + str(h), ip=ip) for h, ip in enumerate(self.host_ips)]
+        self.mn_switches = [self.addSwitch('s' + str(s + 1), mac="00:00:00:00:00:" + str("{:02x}".format(s + 1)))
+                            for s in range(topo['n_switches'])]
+
+        for (h, sw, h_port, sw_port) in host_links.tolist():
+            self.addLink(self.mn_hosts[h], self.mn_switches[sw], bw=5, port1=h_port, port2=sw_port, use_htb=True)
+        for (u, v, u_port, v_port) in switch_links.tolist():
+            self.addLink(self.mn_switches[u], self.mn_switches[v], bw=5, port1=u_port, port2=v_port, use_htb=True)
 
         self.topo = topo
 
 
-def random_permutation(topo):
-    hosts = list(range(topo.topo["n_hosts"])) 
-    random.shuffle(hosts)
+def random_permutation(topo, rng):
+    hosts = list(range(topo.topo["n_hosts"]))
+    rng.shuffle(hosts)
 
     pairings = []
     while len(hosts) > 1:
@@ -84,49 +66,97 @@ def random_permutation(topo):
     return pairings
 
 
-def experiment(net, topo, nflows):
+IPERF_SECONDS = 10
+IPERF_INTERVAL = 1
+
+def experiment(net, topo, nflows, rng):
     # dumpNetConnections(net)
     net.start()
     sleep(3)
     # net.pingAll()
 
-    experiment_output = []
-    perm = random_permutation(topo)
-    for pair in perm:
-        host_a = net.getNodeByName(pair[0])
-        host_b = net.getNodeByName(pair[1])
+    perm = random_permutation(topo, rng)
+    pairs = [(net.getNodeByName(a), net.getNodeByName(b)) for (a, b) in perm]
 
-
-        host_a.sendCmd("iperf", "-s", "-t", "10")
+    # start every server, then every client, so all pairs share the network
+    # for the same IPERF_SECONDS; servers get some slack to outlive clients
+    for (host_a, host_b) in pairs:
+        host_a.sendCmd("iperf", "-s", "-t", str(IPERF_SECONDS + 5))
+    sleep(1)
+    for (host_a, host_b) in pairs:
+        cmd = ["iperf", "-c", host_a.IP(), "-t", str(IPERF_SECONDS), "-y", "C", "-i", str(IPERF_INTERVAL)]
         if nflows > 1:
-            host_b.sendCmd("iperf", "-c", "10.0."+ pair[0][1:] +".1", "-t", "10", "-P", str(nflows))
-        else:
-            host_b.sendCmd("iperf", "-c", "10.0."+ pair[0][1:] +".1", "-t", "10")
-
-        output = host_b.waitOutput()
-        experiment_output.append(output)
-
-    return experiment_output
-
-
-def build_and_run(pkl, algo, nflows, out=None):
-
-    topo = JellyFishTop(pkl)
-    net = Mininet(topo=topo, host=CPULimitedHost, link = TCLink, controller=JELLYPOX("jelly", cargs2=("--p=%s --algo=%s" % (pkl, algo))))
-
+            cmd += ["-P", str(nflows)]
+        host_b.sendCmd(*cmd)
+
+    # parse the clients' reports as they arrive, polling all of them at once
+    # rather than blocking on one at a time
+    outputs = dict((host_b, IperfParser(IPERF_INTERVAL)) for (host_a, host_b) in pairs)
+    clients = dict((host_b.stdout.fileno(), host_b) for (host_a, host_b) in pairs)
+    poller = select.poll()
+    for fd in clients:
+        poller.register(fd, select.POLLIN)
+    while clients:
+        for fd, event in poller.poll(1000):
+            client = clients[fd]
+            outputs[client].feed(client.monitor(timeoutms=0))
+            if not client.waiting:
+                poller.unregister(fd)
+                del clients[fd]
+
+    for (host_a, host_b) in pairs:
+        host_a.waitOutput()
+
+    flows = []
+    for (host_a, host_b) in pairs:
+        flow = outputs[host_b].result()
+        flow['client'] = host_b.name
+        flow['server'] = host_a.name
+        flows.append(flow)
+    return flows
+
+
+def set_static_arp(net, topo):
+    """
+    Gives every host its MAC and a permanent ARP entry for every other host,
+    with one `ip -batch` per host rather than one command per entry.
+    """
     host_mac_base = len(topo.mn_switches)
-    for i, h in enumerate(topo.mn_hosts):
-        mn_host = net.getNodeByName(h)
-        mn_host.setMAC(mac_from_value(host_mac_base + i + 1))
-        for j, h2 in enumerate(topo.mn_hosts):
-            if i == j: continue
-            mn_host2 = net.getNodeByName(h2)
-            mn_host.setARP('10.0.' + str(j) + '.1', mac_from_value(host_mac_base + j + 1))
-
-    output = experiment(net, topo, nflows)
-    parsed = { "output": [], "algo": algo, "nflows": nflows }
-    for cmd in output:
-        parsed["output"].append(cmd.split("\r\n"))
+    macs = [mac_from_value(host_mac_base + i + 1) for i in range(len(topo.mn_hosts))]
+    batch_dir = tempfile.mkdtemp(prefix='jelly-arp-')
+    try:
+        for i, h in enumerate(topo.mn_hosts):
+            mn_host = net.getNodeByName(h)
+            mn_host.setMAC(macs[i])
+            intf = mn_host.defaultIntf().name
+            batch = os.path.join(batch_dir, h)
+            with open(batch, 'w') as f:
+                for j, ip in enumerate(topo.host_ips):
+                    if i != j:
+                        f.write("neigh replace %s lladdr %s dev %s nud permanent\n" % (ip, macs[j], intf))
+            mn_host.cmd("ip -force -batch " + batch)
+    finally:
+        shutil.rmtree(batch_dir)
+
+
+def build_and_run(topo_path, algo, nflows, out=None, proactive=False, flow_hash='crc', path_select='hash',
+                  seed=None):
+
+    # the permutation is drawn from its own seeded RNG, and the seed saved
+    # with the results, so a run can be repeated pair for pair
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    rng = random.Random(seed)
+
+    topo = JellyFishTop(topo_path)
+    cargs2 = "--p=%s --algo=%s --flow_hash=%s --path_select=%s" % (topo_path, algo, flow_hash, path_select)
+    if proactive:
+        cargs2 += " --proactive"
+    net = Mininet(topo=topo, host=CPULimitedHost, link = TCLink, controller=JELLYPOX("jelly", cargs2=cargs2))
+
+    set_static_arp(net, topo)
+
+    parsed = { "flows": experiment(net, topo, nflows, rng), "algo": algo, "nflows": nflows, "seed": seed }
 
     if out:
         with open(out, 'wb') as f:
@@ -138,11 +168,16 @@ def build_and_run(pkl, algo, nflows, out=None):
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Run Jellyfish topology.")
-    parser.add_argument('--pickle', help='Topology pickle input path', default=None)
+    parser.add_argument('--topo', help='Topology input path', default=None)
     parser.add_argument('--algo', help='Path algorithm', default='kshort', choices=['kshort', 'ecmp'])
-    parser.add_argument('--nflows', help='Number of flows between two servers', choices=['1', '8'], default='1')
+    parser.add_argument('--nflows', help='Number of flows between two servers', choices=[1, 8], default=1, type=int)
     parser.add_argument('--output', help='Output data pickle path', default=None)
+    parser.add_argument('--proactive', help='Install all paths when the switches connect instead of per flow', action='store_true')
+    parser.add_argument('--flow-hash', help='Hash used to spread flows over paths', default='crc', choices=sorted(FLOW_HASHES))
+    parser.add_argument('--path-select', help='How a flow hash picks a path', default='hash', choices=SELECTION_MODES)
+    parser.add_argument('--seed', help='Seed for the host permutation (random if not given)', default=None, type=int)
     args = parser.parse_args()
 
-    build_and_run(args.pickle, args.algo, args.nflows, args.output)
+    build_and_run(args.topo, args.algo, args.nflows, args.output, args.proactive, args.flow_hash, args.path_select,
+                  args.seed)
 
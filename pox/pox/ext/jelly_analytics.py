@@ -0,0 +1,261 @@
+"""
+Whole-topology statistics of the Jellyfish switch graph: path lengths, path
+diversity, bisection bandwidth and per-link load under a routing scheme.
+
+Everything runs on the CSR SwitchGraph. Distances and shortest path counts
+come from a batched BFS that expands the frontiers of many sources at once
+with a gather over the CSR per level, so the cost is O(sources * links) with
+no per-pair Python work. On graphs too large for all sources, a random sample
+of sources (or of pairs, for link loads) gives unbiased estimates.
+"""
+
+import heapq
+
+import numpy as np
+
+from pox.ext.jelly_paths import PathWorkers, concat_ranges
+
+
+# memory the BFS frontier of one batch of sources may take, roughly
+BFS_BATCH_BYTES = 64 * 1024 * 1024
+
+
+def _sample(n, count, rng):
+    """
+    `count` sorted, distinct ids below n, or all of them if count is None.
+    Small samples are drawn with replacement and their duplicates redrawn,
+    so they cost O(count) rather than O(n).
+    """
+    if count is None or count >= n:
+        return np.arange(n, dtype=np.int64)
+    if 2 * count >= n:
+        return np.sort(rng.permutation(n)[:count]).astype(np.int64)
+    ids = np.unique(rng.randint(0, n, size=count, dtype=np.int64))
+    while len(ids) < count:
+        more = rng.randint(0, n, size=count - len(ids), dtype=np.int64)
+        ids = np.unique(np.concatenate([ids, more]))
+    return ids
+
+
+def bfs_batches(graph, sources):
+    """
+    Yields (batch, dist, sigma) for consecutive batches of `sources`: dist is
+    the (len(batch), n) hop distance from every source to every switch (-1
+    where unreachable) and sigma the number of shortest paths.
+    """
+    n = graph.n
+    indptr, indices = graph.indptr, graph.indices
+    degree = np.diff(indptr)
+    batch_size = max(1, min(len(sources), BFS_BATCH_BYTES // max(1, 24 * graph.n_edges)))
+
+    for i in range(0, len(sources), batch_size):
+        batch = np.asarray(sources[i:i + batch_size], dtype=np.int64)
+        rows = np.arange(len(batch), dtype=np.int64)
+        dist = np.full((len(batch), n), -1, dtype=np.int32)
+        sigma = np.zeros((len(batch), n))
+        dist[rows, batch] = 0
+        sigma[rows, batch] = 1
+
+        # the frontier as flat (source row, switch, paths reaching it) arrays
+        level = 0
+        f_row, f_node, f_sigma = rows, batch, np.ones(len(batch))
+        while len(f_node):
+            level += 1
+            counts = degree[f_node]
+            edges = concat_ranges(indptr[f_node], indptr[f_node + 1])
+            row = np.repeat(f_row, counts)
+            node = indices[edges]
+            paths = np.repeat(f_sigma, counts)
+
+            new = dist[row, node] < 0
+            keys, inverse = np.unique(row[new] * n + node[new], return_inverse=True)
+            f_row, f_node = keys // n, keys % n
+            f_sigma = np.bincount(inverse, weights=paths[new], minlength=len(keys))
+            dist[f_row, f_node] = level
+            sigma[f_row, f_node] = f_sigma
+
+        yield batch, dist, sigma
+
+
+def path_length_distribution(graph, sources=None, seed=0):
+    """
+    {hops: switch pairs} over ordered pairs of distinct, connected switches,
+    from `sources` randomly chosen sources (all of them if None), and the
+    number of source-destination pairs found unreachable.
+    """
+    rng = np.random.RandomState(seed)
+    histogram = np.zeros(graph.n + 1, dtype=np.int64)
+    unreachable = 0
+    for batch, dist, sigma in bfs_batches(graph, _sample(graph.n, sources, rng)):
+        histogram += np.bincount(dist[dist > 0], minlength=graph.n + 1)
+        unreachable += int((dist < 0).sum())
+    lengths = dict((h, int(c)) for h, c in enumerate(histogram.tolist()) if c)
+    return lengths, unreachable
+
+
+def path_diversity(graph, sources=None, cap=64, seed=0):
+    """
+    {number of shortest paths: switch pairs}, counts above `cap` lumped into
+    `cap`, over the same pairs as path_length_distribution().
+    """
+    rng = np.random.RandomState(seed)
+    histogram = np.zeros(cap + 1, dtype=np.int64)
+    for batch, dist, sigma in bfs_batches(graph, _sample(graph.n, sources, rng)):
+        counts = np.minimum(sigma[dist > 0], cap).astype(np.int64)
+        histogram += np.bincount(counts, minlength=cap + 1)
+    return dict((c, int(p)) for c, p in enumerate(histogram.tolist()) if p)
+
+
+def _cut_size(graph, side):
+    return int(np.count_nonzero(side[graph.edge_src] != side[graph.indices])) // 2
+
+
+def _spectral_cut(graph, iterations=100, seed=0):
+    """
+    A balanced cut at the median of an approximate Fiedler vector, found by
+    power iteration on 2 * max_degree * I - L with the constant vector
+    projected out.
+    """
+    n = graph.n
+    degree = np.diff(graph.indptr).astype(np.float64)
+    shift = 2 * degree.max() if n else 0.0
+    x = np.random.RandomState(seed).standard_normal(n)
+    for _ in range(iterations):
+        x -= x.mean()
+        # (shift * I - L) x, with L x = degree * x - (sum over neighbors)
+        x = (shift - degree) * x + np.bincount(graph.edge_src, weights=x[graph.indices], minlength=n)
+        x /= np.linalg.norm(x) or 1.0
+    side = np.zeros(n, dtype=bool)
+    side[np.argsort(x, kind='mergesort')[:n // 2]] = True
+    return side
+
+
+def _refine_cut(graph, side, passes=8):
+    """
+    Improves a balanced cut with Fiduccia-Mattheyses passes: the unlocked
+    switch with the best gain is moved, alternating sides so the cut stays
+    balanced, and each pass keeps the best prefix of its moves.
+    """
+    n = graph.n
+    adj = graph.adjacency
+    degree = np.diff(graph.indptr)
+    side = side.copy()
+    for _ in range(passes):
+        # gain of moving a switch: its links across the cut minus its others
+        crossing = side[graph.edge_src] != side[graph.indices]
+        gain = (2 * np.bincount(graph.edge_src, weights=crossing, minlength=n) - degree).astype(np.int64).tolist()
+        on_side = side.tolist()
+        heaps = ([], [])
+        for sw in range(n):
+            heaps[on_side[sw]].append((-gain[sw], sw))
+        for heap in heaps:
+            heapq.heapify(heap)
+        locked = [False] * n
+
+        moved, change, best, best_moves = [], 0, 0, 0
+        turn = False
+        while True:
+            heap = heaps[turn]
+            while heap and (locked[heap[0][1]] or -heap[0][0] != gain[heap[0][1]]):
+                heapq.heappop(heap)
+            if not heap:
+                break
+            sw = heapq.heappop(heap)[1]
+            locked[sw] = True
+            change -= gain[sw]
+            moved.append(sw)
+            for u in adj[sw]:
+                if locked[u]:
+                    continue
+                # the link to sw crosses the cut now iff it didn't before
+                gain[u] += 2 if on_side[u] == turn else -2
+                heapq.heappush(heaps[on_side[u]], (-gain[u], u))
+            on_side[sw] = not turn
+            turn = not turn
+            if not turn and change < best:
+                best, best_moves = change, len(moved)
+
+        if best_moves == 0:
+            break
+        side[moved[:best_moves]] ^= True
+    return side
+
+
+def bisection_bandwidth(graph, n_hosts, trials=4, seed=0):
+    """
+    An estimate of the minimum bisection of the switch graph: the fewest
+    links crossing a balanced cut found by refining `trials` starting cuts,
+    the spectral cut and then random ones, with Fiduccia-Mattheyses. Any cut
+    bounds the minimum from above; for random regular graphs Bollobas also
+    bounds it from below by n * (r/4 - sqrt(r * ln 2) / 2) links, where r
+    is the switch degree, which is the bound the Jellyfish paper uses. Both
+    are also given per server on one side.
+    """
+    rng = np.random.RandomState(seed)
+    best = None
+    for t in range(max(1, trials)):
+        if t == 0:
+            side = _spectral_cut(graph, seed=seed)
+        else:
+            side = np.zeros(graph.n, dtype=bool)
+            side[rng.permutation(graph.n)[:graph.n // 2]] = True
+        links = _cut_size(graph, _refine_cut(graph, side))
+        best = links if best is None else min(best, links)
+
+    r = float(graph.n_edges) / max(1, graph.n)
+    lower_bound = max(0.0, graph.n * (r / 4 - np.sqrt(r * np.log(2)) / 2))
+    per_server = max(1, n_hosts // 2)
+    return {
+        'links': best,
+        'links_per_server': float(best) / per_server,
+        'lower_bound_links': lower_bound,
+        'lower_bound_links_per_server': lower_bound / per_server,
+    }
+
+
+def link_loads(graph, algorithm, k, pairs=None, store=None, workers=1, seed=0):
+    """
+    Per directed link (by edge id), the expected number of switch pairs whose
+    traffic crosses it when every ordered pair sends one unit split evenly
+    over its paths: link betweenness under `algorithm` routing.
+
+    With a PathStore every pair is counted; otherwise `pairs` random pairs
+    are routed and the loads scaled up to all n * (n - 1) pairs.
+    """
+    n = graph.n
+    if store is not None:
+        path_counts = np.diff(store.pair_offsets)
+        paths = store.paths
+        scale = 1.0
+    else:
+        rng = np.random.RandomState(seed)
+        total = n * (n - 1)
+        ids = _sample(total, pairs, rng)
+        # ids index the off-diagonal pairs; skip the diagonal
+        src = ids // (n - 1)
+        dst = ids % (n - 1)
+        dst = dst + (dst >= src)
+        pool = PathWorkers(graph, algorithm, k, workers)
+        try:
+            path_counts, paths = pool.pair_paths(list(zip(src.tolist(), dst.tolist())))
+        finally:
+            pool.close()
+        scale = float(total) / max(1, len(ids))
+
+    # a pair's unit of traffic is split evenly over its paths
+    path_weight = np.repeat(1.0 / np.maximum(path_counts, 1), path_counts)
+    hops = np.maximum(paths.lengths() - 1, 0)
+    u, v = paths.hops()
+    weights = np.repeat(path_weight, hops)
+    return np.bincount(graph.edge_ids(u, v), weights=weights, minlength=graph.n_edges) * scale
+
+
+def load_summary(loads):
+    loads = np.asarray(loads, dtype=np.float64)
+    mean = loads.mean() if len(loads) else 0.0
+    return {
+        'max': float(loads.max()) if len(loads) else 0.0,
+        'mean': float(mean),
+        'cv': float(loads.std() / mean) if mean else 0.0,
+        'unused_links': int(np.count_nonzero(loads == 0)),
+    }
@@ -1,17 +1,119 @@
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+import pox.openflow.nicira as nx_of
 import pox.proto.arp_responder as arp
-import pickle
+import os
 import time
+from collections import defaultdict
 import networkx as nx
-from itertools import islice
 import pox.openflow.spanning_tree as st
 from pox.lib.addresses import IPAddr
+from pox.ext.jelly_flows import FlowBalancer
+from pox.ext.jelly_paths import (PathStore, SwitchGraph, path_function,
+                                 path_store_file, switch_name)
+from pox.ext.jelly_topology import load_topology
 
 
 log = core.getLogger()
 paths = {}
 switches_by_dpid = {}
+NUM_PATHS = 8
+
+# CSR view of the switch graph, and the all-pairs switch paths precomputed by
+# main.py if available
+switch_graph = None
+path_store = None
+
+# IP -> host and (switch, src, dst, path) -> port lookups, built at launch
+forwarding = None
+
+# host -> the switch it hangs off, built at launch
+host_switch = {}
+
+# assigns new flows to paths
+balancer = None
+
+def host_switches (topo):
+  """
+  {host: the switch it hangs off}, from the topology arrays if loaded from
+  them, so the networkx graph is only built for a legacy pickle
+  """
+  if 'host_links' in topo:
+    return dict(('h' + str(h), 's' + str(sw))
+                for (h, sw) in topo['host_links'][:, :2].tolist())
+  G = topo['graph']
+  return dict((h, list(G.neighbors(h))[0]) for h in G if h[0] == 'h')
+
+def host_ips (topo):
+  """
+  {host: IP string}, likewise
+  """
+  if 'host_ips' in topo:
+    return dict(('h' + str(h), ip.decode('ascii'))
+                for h, ip in enumerate(topo['host_ips']))
+  return dict((h, ip) for (h, ip) in topo['graph'].nodes(data='ip')
+              if ip is not None)
+
+def get_host_paths (topo, algo, src, dst, num_paths=NUM_PATHS):
+  if (src, dst) in paths:
+    return paths[(src, dst)]
+
+  # hosts hang off a single switch, so host paths are switch paths with the
+  # hosts tacked on at either end
+  src_switch = host_switch[src]
+  dst_switch = host_switch[dst]
+  if src_switch == dst_switch:
+    switch_paths = [[src_switch]]
+  elif path_store is not None:
+    switch_paths = path_store.pair_paths(src_switch, dst_switch)
+  else:
+    fn = path_function(algo)
+    switch_paths = [[switch_name(s) for s in p] for p in
+                    fn(switch_graph, src_switch, dst_switch, num_paths)]
+
+  p_paths = [[src] + p + [dst] for p in switch_paths]
+  paths[(src, dst)] = p_paths
+  return p_paths
+
+class ForwardingIndex (object):
+  """
+  Answers the packet-in questions with dict lookups: which host owns an IP,
+  and which port a switch sends a host pair's packets out of on each path.
+
+  The IP index is built up front.  Out ports are indexed a host pair at a
+  time, for every switch on every path of the pair, the first time the pair
+  is seen; doing all pairs at launch would be quadratic in the hosts.
+  """
+
+  def __init__ (self, topo, algo):
+    self.TOPO = topo
+    self.algo = algo
+    self.host_by_ip = dict((IPAddr(ip), host)
+                           for (host, ip) in host_ips(topo).items())
+    self.indexed = set()
+    self.ports = {}
+
+  def host (self, ip):
+    return self.host_by_ip.get(ip)
+
+  def paths (self, src, dst):
+    p_paths = get_host_paths(self.TOPO, self.algo, src, dst)
+    if (src, dst) not in self.indexed:
+      outport_mappings = self.TOPO['outport_mappings']
+      for i, path in enumerate(p_paths):
+        for hop in range(1, len(path) - 1):
+          self.ports[(path[hop], src, dst, i)] = outport_mappings[(path[hop], path[hop + 1])]
+      self.indexed.add((src, dst))
+    return p_paths
+
+  def outport (self, switch, src, dst, path_index):
+    """
+    Out port of `switch` on path `path_index` between src and dst, or None
+    if the switch isn't on that path.
+    """
+    if (src, dst) not in self.indexed:
+      self.paths(src, dst)
+    return self.ports.get((switch, src, dst, path_index))
 
 def ipinfo (ip):
   parts = [int(x) for x in str(ip).split('.')]
@@ -20,21 +122,6 @@ def ipinfo (ip):
   num = parts[3]
   return switches_by_id.get(ID),port,num
 
-def k_shortest_paths(G, start, end, k):
-  return list(islice(nx.shortest_simple_paths(G, start, end), k))
-
-
-def ecmp(G, start, end, k):
-  paths = []
-  for p in nx.shortest_simple_paths(G, start, end):
-      if len(paths) < k and (len(paths) == 0 or len(p) == len(paths[0])):
-          paths.append(p)
-      else:
-          break
-
-  return paths
-
-
 class TopoSwitch (object):
 
   def __init__ (self, connection, dpid, t, algo):
@@ -44,24 +131,11 @@ class TopoSwitch (object):
 
     self.TOPO = t
     self.algo = algo
-    self.num_paths = 8
+    self.num_paths = NUM_PATHS
 
     connection.addListeners(self)
 
 
-  def _get_paths(self, src, dst):
-    if (src, dst) in paths:
-      return paths[(src, dst)]
-    if self.algo == 'ecmp':
-      fn = ecmp
-    else:
-      fn = k_shortest_paths
-
-    p_paths = fn(self.TOPO['graph'], src, dst, self.num_paths)
-    paths[(src, dst)] = p_paths
-    return p_paths
-
-
   def resend_packet (self, packet_in, out_port):
     """
     Instructs the switch to resend a packet that it had sent to us.
@@ -94,17 +168,18 @@ class TopoSwitch (object):
     # sending it (len(packet_in.data) should be == packet_in.total_len)).
 
 
-  def act_like_switch (self, packet, packet_in, event, srchost, dsthost, packet_id):
-    packet_paths = self._get_paths(srchost, dsthost)
-    path = packet_paths[packet_id % len(packet_paths)]
-    next_host_index = path.index(self.graph_name) + 1
-
-    outport = self.TOPO['outport_mappings'][(self.graph_name, path[next_host_index])]
-    log.info("Sending packet " + str(packet_id) + " from " + self.graph_name + " to " + str(path[next_host_index]) + " on port " + str(outport))
+  def act_like_switch (self, packet, packet_in, event, srchost, dsthost, flow_key):
+    path_index = balancer.path_index((srchost, dsthost),
+                                     forwarding.paths(srchost, dsthost), flow_key)
+    outport = forwarding.outport(self.graph_name, srchost, dsthost, path_index)
+    if outport is None:
+      log.warning("%s is on no path from %s to %s", self.graph_name, srchost, dsthost)
+      return None
+    log.debug("Sending flow %s from %s on path %d, port %s", flow_key,
+              self.graph_name, path_index, outport)
     self.resend_packet(packet_in, outport)
     return outport
 
-    
 
   def _handle_PacketIn (self, event):
     """
@@ -112,66 +187,161 @@ class TopoSwitch (object):
     """
 
     packet = event.parsed # This is the parsed packet data.
-    log.info("makin some moves big d")
     if not packet.parsed:
       log.warning("Ignoring incomplete packet")
       return
 
     packet_in = event.ofp # The actual ofp_packet_in message.
 
-    log.info("At switch " + str(hex(event.dpid)) + ". Src mac is " + str(packet.src) + ", dest mac is " + str(packet.dst))
-    log.info("Coming in at port " + str(event.port))
-    log.info("event ip " + str(packet.find('ipv4')))
-    log.info(self.TOPO['graph'].nodes(data='ip'))
+    ipv4 = packet.find('ipv4')
+    if ipv4 is None:
+      return
+    srchost = forwarding.host(ipv4.srcip)
+    dsthost = forwarding.host(ipv4.dstip)
+    if srchost is None or dsthost is None:
+      log.debug("Ignoring packet from %s to %s", ipv4.srcip, ipv4.dstip)
+      return
 
     tcpp = packet.find('tcp')
     if tcpp is not None:
-      log.info(tcpp)
-      log.info("ALRIGHT OKAY OKAY ALRIGHT")
+      flow_key = (ipv4.srcip.toUnsigned(), ipv4.dstip.toUnsigned(), ipv4.protocol,
+                  tcpp.srcport, tcpp.dstport)
+      outport = self.act_like_switch(packet, packet_in, event, srchost, dsthost, flow_key)
+      if outport is None:
+        return
       msg = of.ofp_flow_mod()
       msg.priority = 42
       msg.match.dl_type = 0x800
       msg.match.nw_proto = 6
-      msg.match.tp_src = tcpp.srcport #get src port
-      ipv4 = packet.find('ipv4')
-      if ipv4 is not None: #should not be none, cuz if its TCP, it has to be IP as well
-        srcip = ipv4.srcip
-        dstip = ipv4.dstip
-        msg.match.nw_src = IPAddr(ipv4.srcip)
-        msg.match.nw_dst = IPAddr(ipv4.dstip)
-        hosts = self.TOPO['graph'].nodes(data='ip')
-        for host in hosts:
-          if host[1] == srcip:
-            srchost = host[0]
-          if host[1] == dstip:
-            dsthost = host[0]
-        outport = self.act_like_switch(packet, packet_in, event, srchost, dsthost, tcpp.srcport)
-        msg.actions.append(of.ofp_action_output(port = outport))
-        self.connection.send(msg)
-      # 
+      msg.match.tp_src = tcpp.srcport
+      msg.match.tp_dst = tcpp.dstport
+      msg.match.nw_src = ipv4.srcip
+      msg.match.nw_dst = ipv4.dstip
+      msg.actions.append(of.ofp_action_output(port = outport))
+      self.connection.send(msg)
     else:
-      ipv4 = packet.find('ipv4')
-      if ipv4 is not None:
-        log.info("just the ping case")
-        srcip = ipv4.srcip
-        dstip = ipv4.dstip
-        hosts = self.TOPO['graph'].nodes(data='ip')
-        for host in hosts:
-          if host[1] == srcip:
-            srchost = host[0]
-          if host[1] == dstip:
-            dsthost = host[0]
-        log.info("src host: " + str(srchost) + ", dsthost: " + str(dsthost))
-        self.act_like_switch(packet, packet_in, event, srchost, dsthost, ipv4.id)
-
-
-def launch(p, algo):
-
-  log.info("pickle path: " + p)
-  t = pickle.load(open(p, 'r'))
+      # no ports to tell flows apart, so all other IP traffic between two
+      # hosts is one flow
+      flow_key = (ipv4.srcip.toUnsigned(), ipv4.dstip.toUnsigned(), ipv4.protocol, 0, 0)
+      self.act_like_switch(packet, packet_in, event, srchost, dsthost, flow_key)
+
+
+class ProactiveRouting (object):
+  """
+  Installs the paths of every host pair on all switches as soon as the last
+  switch connects, so the data plane never has to ask the controller.
+
+  TCP flows pick a path by the low bits of their source port, which is the
+  same choice the reactive handler makes with flow_hash=port when a pair
+  has a power of two paths; switches can't compute the other flow hashes,
+  so the path_select modes don't apply here either.  OpenFlow 1.0 can't
+  match port ranges, so the rules are Nicira flow_mods with a masked
+  tcp_src (Open vSwitch, as in Mininet).  All other IP traffic between a
+  pair takes its first path.
+  """
+  TCP_PRIORITY = 42
+  IP_PRIORITY = 41
+
+  def __init__ (self, topo, algo):
+    self.TOPO = topo
+    self.algo = algo
+    self.connections = {}
+    self.tables = None
+    core.openflow.addListeners(self)
+
+  def _handle_ConnectionUp (self, event):
+    name = 's' + str(int(event.dpid) - 1)
+    self.connections[name] = event.connection
+    if self.tables is not None:
+      # a switch came back after everything was installed
+      self._install(name, event.connection)
+    elif len(self.connections) == self.TOPO['n_switches']:
+      start = time.time()
+      self.tables = self.flow_tables()
+      log.info("computed %d proactive rules in %.2fs" %
+               (sum(len(t) for t in self.tables.values()), time.time() - start))
+      for name, connection in self.connections.items():
+        self._install(name, connection)
+
+  def _handle_ConnectionDown (self, event):
+    self.connections.pop('s' + str(int(event.dpid) - 1), None)
+
+  def _install (self, name, connection):
+    # one write per switch instead of one per rule
+    with connection.batch():
+      for rule in self.tables.get(name, []):
+        connection.send(rule)
+      connection.send(of.ofp_barrier_request())
+
+  def flow_tables (self):
+    """
+    Packed flow_mods for every switch, keyed by switch name.
+    """
+    outport_mappings = self.TOPO['outport_mappings']
+    ips = host_ips(self.TOPO)
+
+    tables = defaultdict(list)
+    for src in ips:
+      for dst in ips:
+        if src == dst: continue
+        p_paths = get_host_paths(self.TOPO, self.algo, src, dst)
+
+        # 2**bits source port buckets, bucket b taking path b % len(p_paths)
+        bits = (len(p_paths) - 1).bit_length()
+        mask = (1 << bits) - 1
+        for bucket in range(1 << bits):
+          path = p_paths[bucket % len(p_paths)]
+          for hop in range(1, len(path) - 1):
+            msg = self._rule(ips[src], ips[dst], self.TCP_PRIORITY,
+                             outport_mappings[(path[hop], path[hop + 1])])
+            msg.match.of_ip_proto = 6
+            if mask:
+              msg.match.of_tcp_src_with_mask = (bucket, mask)
+            tables[path[hop]].append(msg.pack())
+
+        path = p_paths[0]
+        for hop in range(1, len(path) - 1):
+          msg = self._rule(ips[src], ips[dst], self.IP_PRIORITY,
+                           outport_mappings[(path[hop], path[hop + 1])])
+          tables[path[hop]].append(msg.pack())
+    return tables
+
+  def _rule (self, srcip, dstip, priority, outport):
+    msg = nx_of.nx_flow_mod()
+    msg.priority = priority
+    msg.match.of_eth_type = 0x800
+    msg.match.of_ip_src = IPAddr(srcip)
+    msg.match.of_ip_dst = IPAddr(dstip)
+    msg.actions.append(of.ofp_action_output(port = outport))
+    return msg
+
+
+def launch(p, algo, proactive=False, flow_hash='crc', path_select='hash'):
+
+  log.info("topology path: " + p)
+  t = load_topology(p)
 
   log.info("routing algorithm used: " + algo)
 
+  global switch_graph, path_store, forwarding, balancer, host_switch
+  switch_graph = SwitchGraph.from_topo(t)
+  host_switch = host_switches(t)
+  store_file = path_store_file(p, algo, NUM_PATHS)
+  if os.path.exists(store_file):
+    store = PathStore.load(store_file)
+    if store.matches(switch_graph, algo, NUM_PATHS):
+      log.info("using precomputed paths from " + store_file)
+      path_store = store
+    else:
+      log.warning("ignoring stale path store " + store_file)
+  forwarding = ForwardingIndex(t, algo)
+  balancer = FlowBalancer(flow_hash, path_select)
+  log.info("flows hashed with %s, paths selected by %s" % (flow_hash, path_select))
+
+  def report_flows (event):
+    log.info("flows per path:\n" + balancer.report())
+  core.addListenerByName("GoingDownEvent", report_flows)
+
   def start_switch (event):
     log.info("Controlling %s" % (event.connection,))
     log.info("DPID is "  + str(event.dpid))
@@ -179,3 +349,7 @@ def launch(p, algo):
 
   core.openflow.addListenerByName("ConnectionUp", start_switch)
 
+  if proactive:
+    log.info("installing all paths proactively")
+    ProactiveRouting(t, algo)
+
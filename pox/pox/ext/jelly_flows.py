@@ -0,0 +1,164 @@
+"""
+Flow hashing and path selection for the Jellyfish controller.
+
+A flow is keyed by its 5-tuple (source IP, destination IP, IP protocol,
+source port, destination port), with IPs as unsigned ints and ports 0 for
+protocols without them. FlowBalancer hashes the key with one of
+FLOW_HASHES, picks one of the pair's paths with one of SELECTION_MODES and
+remembers the choice, so every switch on the way sends the flow along the
+same path and the number of flows per path can be reported.
+"""
+
+import struct
+import zlib
+from collections import Counter, defaultdict
+
+
+# the 40 byte RSS key from Microsoft's "Verifying the RSS Hash Calculation",
+# which is what most NICs ship with
+TOEPLITZ_KEY = (b'\x6d\x5a\x56\xda\x25\x5b\x0e\xc2\x41\x67\x25\x3d\x43\xa3\x8f\xb0'
+                b'\xd0\xca\x2b\xcb\xae\x7b\x30\xb4\x77\xcb\x2d\xa3\x80\x30\xf2\x0c'
+                b'\x6a\x42\xb7\x3b\xbe\xac\x01\xfa')
+
+
+def _pack_key(key):
+    return struct.pack('!IIBHH', *key)
+
+
+def crc_hash(key):
+    return zlib.crc32(_pack_key(key)) & 0xffffffff
+
+
+def port_hash(key):
+    """
+    The source port alone, which is how paths were picked originally.
+    """
+    return key[3]
+
+
+def _toeplitz_tables(secret, n_bytes):
+    key_int = 0
+    for b in bytearray(secret):
+        key_int = (key_int << 8) | b
+    key_bits = len(secret) * 8
+    tables = []
+    for i in range(n_bytes):
+        # 32 bit window of the key starting at each bit of input byte i
+        windows = [(key_int >> (key_bits - 32 - (i * 8 + bit))) & 0xffffffff for bit in range(8)]
+        table = [0] * 256
+        for value in range(1, 256):
+            low = value & -value
+            table[value] = table[value ^ low] ^ windows[7 - (low.bit_length() - 1)]
+        tables.append(table)
+    return tables
+
+
+# Toeplitz hash input is src ip, dst ip, src port, dst port (12 bytes), as
+# in RSS; the tables turn it into one lookup per input byte
+_TOEPLITZ_TABLES = _toeplitz_tables(TOEPLITZ_KEY, 12)
+
+
+def toeplitz_hash(key):
+    data = bytearray(struct.pack('!IIHH', key[0], key[1], key[3], key[4]))
+    h = 0
+    for i, b in enumerate(data):
+        h ^= _TOEPLITZ_TABLES[i][b]
+    return int(h)
+
+
+FLOW_HASHES = {
+    'crc': crc_hash,
+    'toeplitz': toeplitz_hash,
+    'port': port_hash,
+}
+
+SELECTION_MODES = ('hash', 'weighted', 'load')
+
+
+def switch_links(path):
+    """
+    The switch-to-switch links of a host path. Every path of a host pair
+    shares the pair's host links, so only these tell the paths apart.
+    """
+    return list(zip(path[1:-2], path[2:-1]))
+
+
+class FlowBalancer(object):
+    """
+    Picks a path for each new flow and keeps count of flows per path and link.
+
+      hash      the flow hash modulo the number of paths
+      weighted  the flow hash placed on the paths' cumulative weights, where
+                a path weighs the inverse of its hop count so that shorter
+                paths carry more flows
+      load      the path whose busiest link carries the fewest flows so far,
+                ties broken by the flow hash
+
+    Flows are never expired, which suits the fixed set of long-lived iperf
+    flows of an experiment.
+    """
+
+    def __init__(self, flow_hash='crc', mode='hash'):
+        if flow_hash not in FLOW_HASHES:
+            raise ValueError("unknown flow hash %r, expected one of %s" % (flow_hash, sorted(FLOW_HASHES)))
+        if mode not in SELECTION_MODES:
+            raise ValueError("unknown path selection %r, expected one of %s" % (mode, list(SELECTION_MODES)))
+        self.hash = FLOW_HASHES[flow_hash]
+        self.mode = mode
+        self.assigned = {}
+        self.pair_flows = defaultdict(Counter)
+        self.link_flows = Counter()
+
+    def path_index(self, pair, paths, key):
+        i = self.assigned.get(key)
+        if i is not None:
+            return i
+
+        h = self.hash(key)
+        if len(paths) == 1:
+            i = 0
+        elif self.mode == 'hash':
+            i = h % len(paths)
+        elif self.mode == 'weighted':
+            i = self._weighted_choice(paths, h)
+        else:
+            i = self._least_loaded(paths, h)
+
+        self.assigned[key] = i
+        self.pair_flows[pair][i] += 1
+        self.link_flows.update(switch_links(paths[i]))
+        return i
+
+    def _weighted_choice(self, paths, h):
+        weights = [1.0 / max(len(p) - 1, 1) for p in paths]
+        point = (h & 0xffff) / 65536.0 * sum(weights)
+        for i, w in enumerate(weights):
+            point -= w
+            if point < 0:
+                return i
+        return len(paths) - 1
+
+    def _least_loaded(self, paths, h):
+        n = len(paths)
+        loads = [max([self.link_flows[link] for link in switch_links(p)] or [0]) for p in paths]
+        # rotate the start by the hash so that ties don't all go to path 0
+        start = h % n
+        return min(((start + j) % n for j in range(n)), key=lambda i: loads[i])
+
+    def histogram(self):
+        """
+        Flows per path index, over all host pairs.
+        """
+        total = Counter()
+        for flows in self.pair_flows.values():
+            total.update(flows)
+        return dict(total)
+
+    def report(self):
+        lines = ["%d flows over %d host pairs" % (len(self.assigned), len(self.pair_flows))]
+        for i, flows in sorted(self.histogram().items()):
+            lines.append("  path %d: %d flows" % (i, flows))
+        if self.link_flows:
+            loads = list(self.link_flows.values())
+            lines.append("  flows per used switch link: max %d, mean %.2f" % (max(loads), float(sum(loads)) / len(loads)))
+        return "\n".join(lines)
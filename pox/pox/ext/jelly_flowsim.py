@@ -0,0 +1,175 @@
+"""
+Flow-level throughput simulation of the Table 1 experiment.
+
+Instead of running iperf in Mininet, the hosts of a random permutation each
+send `nflows` TCP flows to their partner, every flow is routed the way the
+controller would route it, and the flows get their max-min fair rates over
+the directed links of the topology. The rates come from progressive filling
+over a sparse flow-by-link incidence (flat COO arrays), so each round is a
+few bincounts no matter how many flows there are.
+
+This models TCP as perfectly fair and ignores protocol overhead, so it is an
+upper bound on what iperf measures, but it needs neither root nor Mininet and
+handles topologies with thousands of servers in seconds.
+"""
+
+import random
+
+import numpy as np
+
+from pox.ext.jelly_flows import FlowBalancer
+from pox.ext.jelly_paths import SwitchGraph, path_function, switch_id
+
+
+IPERF_PORT = 5001
+
+# simulated models of a host pair's `nflows` connections
+#   tcp    each flow takes the one path the controller hashes it onto
+#   mptcp  each flow is split into a subflow on every path of the pair
+FLOW_MODELS = ('tcp', 'mptcp')
+
+
+def host_switches(topo):
+    """
+    The switch every host hangs off, as an int array indexed by host.
+    """
+    if 'host_links' in topo:
+        switches = np.zeros(topo['n_hosts'], dtype=np.int64)
+        switches[topo['host_links'][:, 0]] = topo['host_links'][:, 1]
+        return switches
+
+    G = topo['graph']
+    return np.array([switch_id(list(G.neighbors('h'+str(h)))[0]) for h in range(topo['n_hosts'])],
+                    dtype=np.int64)
+
+
+def _ip_value(ip):
+    # generate_topology numbers hosts past 255 as '10.0.300.1', which isn't
+    # a valid address but still needs a 32 bit value to hash
+    value = 0
+    for part in ip.split('.'):
+        value = (value << 8) + int(part)
+    return value & 0xffffffff
+
+
+def host_ips(topo):
+    """
+    Every host's IP as an unsigned int, as used in flow keys.
+    """
+    if 'host_ips' in topo:
+        ips = [ip.decode('ascii') for ip in topo['host_ips']]
+    else:
+        ip_of = dict(topo['graph'].nodes(data='ip'))
+        ips = [ip_of['h'+str(h)] for h in range(topo['n_hosts'])]
+    return [_ip_value(ip) for ip in ips]
+
+
+def host_permutation(n_hosts, rng):
+    """
+    (client, server) host pairs of a random permutation, paired up the way
+    build_topology.random_permutation() pairs them.
+    """
+    hosts = list(range(n_hosts))
+    rng.shuffle(hosts)
+    return [(hosts[i + 1], hosts[i]) for i in range(0, len(hosts) - 1, 2)]
+
+
+def max_min_rates(flow_of_entry, link_of_entry, n_flows, capacity):
+    """
+    Max-min fair rates of n_flows flows by progressive filling. Entry i of
+    the incidence says flow flow_of_entry[i] crosses link link_of_entry[i].
+
+    Each round raises every unfrozen flow by the smallest fair share left on
+    any link, then freezes the flows crossing the links that just filled up.
+    """
+    capacity = np.asarray(capacity, dtype=np.float64)
+    remaining = capacity.copy()
+    rates = np.zeros(n_flows)
+    active = np.ones(n_flows, dtype=bool)
+    # flows that cross no link at all are unconstrained; leave them at 0
+    active[np.setdiff1d(np.arange(n_flows), flow_of_entry)] = False
+    eps = 1e-9 * capacity.max() if len(capacity) else 0.0
+
+    while active.any():
+        live = active[flow_of_entry]
+        counts = np.bincount(link_of_entry[live], minlength=len(capacity))
+        used = counts > 0
+        delta = (remaining[used] / counts[used]).min()
+
+        rates[active] += delta
+        remaining -= delta * counts
+        full = used & (remaining <= eps)
+        active[flow_of_entry[live & full[link_of_entry]]] = False
+    return rates
+
+
+def simulate_permutation(topo, algorithm, nflows, k=8, link_bw=5.0, seed=0,
+                         flow_hash='crc', path_select='hash', model='tcp', graph=None):
+    """
+    Simulates one random permutation of iperf pairs, each running `nflows`
+    flows, on links of `link_bw` (Mbit/s). Returns the throughput of every
+    pair and the average as a percentage of `link_bw`, the metric Table 1
+    reports.
+    """
+    if model not in FLOW_MODELS:
+        raise ValueError("unknown flow model %r, expected one of %s" % (model, list(FLOW_MODELS)))
+
+    rng = random.Random(seed)
+    if graph is None:
+        graph = SwitchGraph.from_topo(topo)
+    n_hosts = topo['n_hosts']
+    switch_of = host_switches(topo)
+    ips = host_ips(topo)
+    find_paths = path_function(algorithm)
+    balancer = FlowBalancer(flow_hash, path_select)
+
+    pairs = host_permutation(n_hosts, rng)
+    flow_pair = []
+    flow_paths = []
+    for p, (client, server) in enumerate(pairs):
+        src, dst = int(switch_of[client]), int(switch_of[server])
+        if src == dst:
+            switch_paths = [[src]]
+        else:
+            switch_paths = [list(path) for path in find_paths(graph, src, dst, k)]
+
+        if model == 'mptcp':
+            for _ in range(nflows):
+                flow_pair.extend([p] * len(switch_paths))
+                flow_paths.extend(switch_paths)
+            continue
+
+        # iperf -P opens consecutive ephemeral ports
+        host_paths = [['h'+str(client)] + path + ['h'+str(server)] for path in switch_paths]
+        first_port = rng.randint(32768, 60999 - nflows)
+        for port in range(first_port, first_port + nflows):
+            key = (ips[client], ips[server], 6, port, IPERF_PORT)
+            i = balancer.path_index((client, server), host_paths, key)
+            flow_pair.append(p)
+            flow_paths.append(switch_paths[i])
+
+    # directed links: switch edges by edge id, then host uplinks, then host
+    # downlinks
+    n_flows = len(flow_paths)
+    lengths = np.array([len(path) for path in flow_paths], dtype=np.int64)
+    nodes = np.fromiter((s for path in flow_paths for s in path), dtype=np.int64, count=lengths.sum())
+    ends = np.cumsum(lengths)
+    keep = np.ones(len(nodes), dtype=bool)
+    keep[ends - 1] = False
+    hop_flow = np.repeat(np.arange(n_flows, dtype=np.int64), lengths - 1)
+    hop_edges = graph.edge_ids(nodes[keep], nodes[1:][keep[:-1]]) if n_flows else np.zeros(0, dtype=np.int64)
+
+    flow_client = np.array([pairs[p][0] for p in flow_pair], dtype=np.int64)
+    flow_server = np.array([pairs[p][1] for p in flow_pair], dtype=np.int64)
+    flows = np.arange(n_flows, dtype=np.int64)
+    flow_of_entry = np.concatenate([flows, hop_flow, flows])
+    link_of_entry = np.concatenate([graph.n_edges + flow_client, hop_edges,
+                                    graph.n_edges + n_hosts + flow_server])
+    capacity = np.full(graph.n_edges + 2 * n_hosts, float(link_bw))
+
+    rates = max_min_rates(flow_of_entry, link_of_entry, n_flows, capacity)
+    pair_bw = np.bincount(np.asarray(flow_pair, dtype=np.int64), weights=rates, minlength=len(pairs))
+    return {
+        'pair_bw': pair_bw.tolist(),
+        'line_rate_pct': float(pair_bw.mean() / link_bw * 100) if len(pairs) else 0.0,
+    }
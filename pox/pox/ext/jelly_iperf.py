@@ -0,0 +1,93 @@
+"""
+Streaming parser for iperf (v2) CSV reports, as printed by `iperf -y C -i N`.
+
+Each report line is
+
+  timestamp,local ip,local port,remote ip,remote port,id,start-end,bytes,bits/s
+
+where id is the stream (-1 for the [SUM] lines of a -P run) and the
+rates are already in bits per second. IperfParser takes the client's output
+in whatever chunks it arrives and keeps, per stream, the per-interval rates
+and the final total, so no raw text has to be stored or rescanned.
+"""
+
+
+SUM_STREAM = -1
+
+
+def parse_report(line):
+    """
+    (stream id, start, end, bits/s) of a CSV report line, or None if the line
+    isn't one.
+    """
+    fields = line.strip().split(',')
+    if len(fields) < 9:
+        return None
+    try:
+        stream = int(fields[5])
+        start, end = [float(t) for t in fields[6].split('-')]
+        bps = float(fields[8])
+    except ValueError:
+        return None
+    return stream, start, end, bps
+
+
+class IperfParser(object):
+    """
+    Collects the reports of one iperf client run. A report starting at 0
+    that spans more than one interval is the final total of its stream.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.partial = ''
+        self.intervals = {}
+        self.totals = {}
+
+    def feed(self, text):
+        lines = (self.partial + text).replace('\r', '').split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self._add(line)
+
+    def close(self):
+        if self.partial:
+            self._add(self.partial)
+            self.partial = ''
+
+    def _add(self, line):
+        report = parse_report(line)
+        if report is None:
+            return
+        stream, start, end, bps = report
+        if start == 0 and end - start > 1.5 * self.interval:
+            self.totals[stream] = bps
+        else:
+            self.intervals.setdefault(stream, []).append((start, end, bps))
+
+    def result(self):
+        """
+        The run as a plain dict: per-stream interval series [[start, end,
+        bits/s], ...] and totals, plus the pair's total ('bps') and interval
+        series ('series'), which are the [SUM] stream's when there is one.
+        """
+        self.close()
+        streams = sorted(set(self.intervals) | set(self.totals))
+        flows = [s for s in streams if s != SUM_STREAM]
+        if SUM_STREAM in streams:
+            bps = self.totals.get(SUM_STREAM)
+            series = self.intervals.get(SUM_STREAM, [])
+        elif len(flows) == 1:
+            bps = self.totals.get(flows[0])
+            series = self.intervals.get(flows[0], [])
+        else:
+            bps = sum(self.totals.values()) if self.totals else None
+            series = []
+        return {
+            'bps': bps,
+            'series': [list(r) for r in series],
+            'streams': dict((str(s), {
+                'bps': self.totals.get(s),
+                'series': [list(r) for r in self.intervals.get(s, [])],
+            }) for s in flows),
+        }
@@ -0,0 +1,765 @@
+"""
+Array-backed path bookkeeping for the Jellyfish switch graph.
+
+Switches are referred to by integer id (the number in 's12'), the switch
+graph is held as a CSR adjacency and sets of paths are stored flat, so that
+per-link path counts can be computed with a single np.bincount. Path
+enumeration (Yen's k-shortest paths, ECMP) runs directly on the CSR
+adjacency rather than on a networkx graph.
+"""
+
+import hashlib
+import heapq
+import numbers
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+
+def algorithm_tag(algorithm):
+    """
+    main.py says 'k-shortest' where the controller says 'kshort'; both map to
+    the same path sets.
+    """
+    return 'ecmp' if algorithm == 'ecmp' else 'kshort'
+
+
+def path_function(algorithm):
+    return ecmp if algorithm_tag(algorithm) == 'ecmp' else k_shortest_paths
+
+
+def is_switch_node(node_name):
+    return node_name[0] == 's'
+
+
+def switch_id(node):
+    if isinstance(node, numbers.Integral):
+        return int(node)
+    return int(node[1:])
+
+
+def switch_name(sw):
+    return 's' + str(sw)
+
+
+class SwitchGraph(object):
+    """
+    CSR adjacency of the switch-to-switch links of a topology.
+
+    The neighbors of switch u are indices[indptr[u]:indptr[u+1]], sorted, so
+    every directed link (u, v) has a dense edge id equal to its position in
+    `indices`.
+    """
+
+    def __init__(self, n_switches, indptr, indices):
+        self.n = n_switches
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+        # the source switch of every directed edge, and a sorted key per edge
+        # used to turn (u, v) pairs back into edge ids
+        self.edge_src = np.repeat(np.arange(self.n, dtype=np.int64), np.diff(self.indptr))
+        self.edge_keys = self.edge_src * self.n + self.indices
+        self._adjacency = None
+
+    @classmethod
+    def from_edges(cls, n_switches, u, v):
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        src = np.concatenate([u, v])
+        dst = np.concatenate([v, u])
+        order = np.lexsort((dst, src))
+        src, dst = src[order], dst[order]
+
+        indptr = np.zeros(n_switches + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n_switches), out=indptr[1:])
+        return cls(n_switches, indptr, dst)
+
+    @classmethod
+    def from_topo(cls, topo):
+        if 'switch_links' in topo:
+            links = topo['switch_links']
+            return cls.from_edges(topo["n_switches"], links[:, 0], links[:, 1])
+
+        links = [(switch_id(u), switch_id(v)) for (u, v) in topo["graph"].edges()
+                 if is_switch_node(u) and is_switch_node(v)]
+        links = np.array(links, dtype=np.int64).reshape(-1, 2)
+        return cls.from_edges(topo["n_switches"], links[:, 0], links[:, 1])
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    def fingerprint(self):
+        """
+        Identifies the switch wiring, independent of how the graph was built.
+        """
+        h = hashlib.sha1()
+        h.update(str(self.n).encode('ascii'))
+        h.update(self.edge_keys.astype('<i8').tobytes())
+        return h.hexdigest()
+
+    @property
+    def adjacency(self):
+        """
+        Neighbor lists as plain Python lists, which the path search walks much
+        faster than numpy slices.
+        """
+        if self._adjacency is None:
+            indices = self.indices.tolist()
+            indptr = self.indptr.tolist()
+            self._adjacency = [indices[indptr[u]:indptr[u+1]] for u in range(self.n)]
+        return self._adjacency
+
+    def neighbors(self, u):
+        return self.indices[self.indptr[u]:self.indptr[u+1]]
+
+    def edge_ids(self, u, v):
+        keys = np.asarray(u, dtype=np.int64) * self.n + np.asarray(v, dtype=np.int64)
+        if len(keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        ids = np.searchsorted(self.edge_keys, keys)
+        ids = np.minimum(ids, max(self.n_edges - 1, 0))
+        if self.n_edges == 0 or not np.array_equal(self.edge_keys[ids], keys):
+            raise ValueError("path uses a link that is not in the switch graph")
+        return ids
+
+    def link_counts(self, path_set):
+        """
+        Number of paths in `path_set` traversing each directed link, indexed
+        by edge id.
+        """
+        u, v = path_set.hops()
+        return np.bincount(self.edge_ids(u, v), minlength=self.n_edges)
+
+    def link_paths(self, counts):
+        """
+        Converts per-edge counts back into the {(u_name, v_name): count} dict
+        used by summarize().
+        """
+        return dict(zip(
+            zip([switch_name(u) for u in self.edge_src.tolist()],
+                [switch_name(v) for v in self.indices.tolist()]),
+            np.asarray(counts).tolist()))
+
+
+class PathSet(object):
+    """
+    A list of switch paths stored as two flat arrays: path i visits
+    nodes[offsets[i]:offsets[i+1]].
+    """
+
+    def __init__(self, offsets, nodes):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nodes = np.asarray(nodes, dtype=np.int64)
+
+    @classmethod
+    def from_paths(cls, paths):
+        offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in paths], out=offsets[1:])
+        nodes = np.fromiter((switch_id(n) for p in paths for n in p),
+                            dtype=np.int64, count=offsets[-1])
+        return cls(offsets, nodes)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.nodes[self.offsets[i]:self.offsets[i+1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def hops(self):
+        """
+        Returns (u, v) arrays holding every link traversed by every path.
+        """
+        if len(self.nodes) < 2:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+
+        # drop the pseudo-hops joining the last node of one path to the first
+        # node of the next
+        keep = np.ones(len(self.nodes) - 1, dtype=bool)
+        boundaries = self.offsets[1:-1] - 1
+        keep[boundaries[(boundaries >= 0) & (boundaries < len(keep))]] = False
+        return self.nodes[:-1][keep], self.nodes[1:][keep]
+
+    def take(self, indices):
+        """
+        A new PathSet holding the paths at `indices`, in that order.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices]
+        ends = self.offsets[indices + 1]
+
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+        return PathSet(offsets, self.nodes[concat_ranges(starts, ends)])
+
+
+def concat_ranges(starts, ends):
+    """
+    The integers of every range [starts[i], ends[i]) laid end to end.
+    """
+    lengths = ends - starts
+    out_starts = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum(), dtype=np.int64) - np.repeat(out_starts - starts, lengths)
+
+
+class _Search(object):
+    """
+    Scratch state for repeated bidirectional BFS on one graph. A node has
+    been reached from the source side (or is blocked) in the current search
+    iff fwd[node] == stamp, likewise bwd for the destination side, so starting
+    a new search is O(1) instead of clearing arrays.
+    """
+
+    def __init__(self, graph):
+        self.adj = graph.adjacency
+        self.fwd = [0] * graph.n
+        self.bwd = [0] * graph.n
+        self.fwd_parent = [0] * graph.n
+        self.bwd_parent = [0] * graph.n
+        self.stamp = 0
+
+    def start(self, blocked=()):
+        self.stamp += 1
+        for node in blocked:
+            self.fwd[node] = self.stamp
+            self.bwd[node] = self.stamp
+
+    def path(self, src, dst, skip=()):
+        """
+        A shortest path from src to dst avoiding blocked nodes and the links
+        from src to any node in `skip`, or None.
+        """
+        adj, stamp = self.adj, self.stamp
+        fwd, bwd = self.fwd, self.bwd
+        fwd_parent, bwd_parent = self.fwd_parent, self.bwd_parent
+        if src == dst:
+            return [src]
+
+        fwd[src] = stamp
+        bwd[dst] = stamp
+        fwd_frontier, bwd_frontier = [src], [dst]
+        meet = None
+        # grow the smaller side one level at a time. Each side marks every
+        # node it reaches, so the sides can only first touch through the
+        # other side's newest level, and any link joining them then lies on
+        # a shortest path.
+        while fwd_frontier and bwd_frontier and meet is None:
+            next_frontier = []
+            if len(fwd_frontier) <= len(bwd_frontier):
+                for u in fwd_frontier:
+                    for v in adj[u]:
+                        if fwd[v] == stamp or (u == src and v in skip):
+                            continue
+                        if bwd[v] == stamp:
+                            meet = (u, v)
+                            break
+                        fwd[v] = stamp
+                        fwd_parent[v] = u
+                        next_frontier.append(v)
+                    if meet:
+                        break
+                fwd_frontier = next_frontier
+            else:
+                for u in bwd_frontier:
+                    for v in adj[u]:
+                        if bwd[v] == stamp or (v == src and u in skip):
+                            continue
+                        if fwd[v] == stamp:
+                            meet = (v, u)
+                            break
+                        bwd[v] = stamp
+                        bwd_parent[v] = u
+                        next_frontier.append(v)
+                    if meet:
+                        break
+                bwd_frontier = next_frontier
+
+        if meet is None:
+            return None
+
+        u, v = meet
+        path = [u]
+        while u != src:
+            u = fwd_parent[u]
+            path.append(u)
+        path.reverse()
+        path.append(v)
+        while v != dst:
+            v = bwd_parent[v]
+            path.append(v)
+        return path
+
+
+def k_shortest_paths(graph, start, end, k):
+    """
+    Yen's k shortest simple paths from switch `start` to `end`, shortest
+    first. Links have unit weight, so every spur path is a BFS.
+    """
+    src, dst = switch_id(start), switch_id(end)
+    search = _Search(graph)
+    search.start()
+    first = search.path(src, dst)
+    if first is None or k < 1:
+        return []
+
+    paths = [first]
+    seen = set([tuple(first)])
+    candidates = []
+    counter = 0
+    deviation = 0
+    while len(paths) < k:
+        last = paths[-1]
+        # accepted paths that share last[:i+1]; narrowed as the root grows,
+        # rather than re-comparing every path's prefix per spur node
+        sharing = paths
+        for i in range(len(last) - 1):
+            spur = last[i]
+            sharing = [p for p in sharing if len(p) > i + 1 and p[i] == spur]
+            # spurs before the node where `last` left its parent path were
+            # already tried from the parent (Lawler's refinement)
+            if i < deviation:
+                continue
+            skip = set(p[i+1] for p in sharing)
+
+            search.start(last[:i])
+            spur_path = search.path(spur, dst, skip)
+            if spur_path is None:
+                continue
+
+            candidate = last[:i] + spur_path
+            key = tuple(candidate)
+            if key not in seen:
+                seen.add(key)
+                heapq.heappush(candidates, (len(candidate), counter, i, candidate))
+                counter += 1
+
+        if not candidates:
+            break
+        _, _, deviation, path = heapq.heappop(candidates)
+        paths.append(path)
+
+    return paths
+
+
+def ecmp(graph, start, end, k):
+    """
+    Up to k equal-cost shortest paths from switch `start` to `end`.
+    """
+    src, dst = switch_id(start), switch_id(end)
+    adj = graph.adjacency
+    if src == dst:
+        return [[src]] if k > 0 else []
+
+    # BFS distances to dst; a shortest path only ever steps one closer
+    dist = [-1] * graph.n
+    dist[dst] = 0
+    frontier = [dst]
+    while frontier and dist[src] < 0:
+        next_frontier = []
+        for u in frontier:
+            for v in adj[u]:
+                if dist[v] < 0:
+                    dist[v] = dist[u] + 1
+                    next_frontier.append(v)
+        frontier = next_frontier
+    if dist[src] < 0:
+        return []
+
+    paths = []
+    stack = [[src]]
+    while stack and len(paths) < k:
+        path = stack.pop()
+        u = path[-1]
+        if u == dst:
+            paths.append(path)
+            continue
+        # reversed so that neighbors are expanded in ascending order
+        for v in reversed(adj[u]):
+            if dist[v] == dist[u] - 1:
+                stack.append(path + [v])
+    return paths
+
+
+def path_store_file(topo_path, algorithm, k):
+    """
+    Where the path store of a saved topology lives: right next to it.
+    """
+    return "%s.%s%d.paths.npz" % (os.path.splitext(topo_path)[0], algorithm_tag(algorithm), k)
+
+
+# per-process state of the path workers, set once by _init_worker
+_worker = {}
+
+def _init_worker(n_switches, indptr, indices, algorithm, k):
+    # workers are handed the bare CSR arrays and rebuild the graph themselves
+    _worker['graph'] = SwitchGraph(n_switches, indptr, indices)
+    _worker['fn'] = path_function(algorithm)
+    _worker['k'] = k
+
+
+class PathWorkers(object):
+    """
+    A pool of processes that each hold the switch graph, which is sent once,
+    as CSR arrays, when the pool starts. With workers <= 1 all work happens
+    in this process.
+    """
+
+    def __init__(self, graph, algorithm, k, workers=1):
+        self.graph = graph
+        initargs = (graph.n, graph.indptr, graph.indices, algorithm, k)
+        if workers > 1:
+            self.pool = Pool(workers, initializer=_init_worker, initargs=initargs)
+            self.n_shards = workers * 8
+        else:
+            self.pool = None
+            self.n_shards = 1
+            _init_worker(*initargs)
+
+    def map(self, fn, items):
+        if self.pool is None:
+            return [fn(item) for item in items]
+        return self.pool.map(fn, items, chunksize=1)
+
+    def count_pair_paths(self, src, dst):
+        """
+        Per-link counts of the paths between every (src[i], dst[i]) pair,
+        without keeping the paths themselves: each worker counts its shard of
+        the pairs and the shard counts are summed.
+        """
+        pairs = [(switch_id(s), switch_id(d)) for s, d in zip(src, dst)]
+        # several shards per worker, so one slow shard does not hold up the pool
+        n_shards = max(1, min(len(pairs), self.n_shards))
+        shards = [pairs[i::n_shards] for i in range(n_shards)]
+
+        counts = np.zeros(self.graph.n_edges, dtype=np.int64)
+        for shard_counts in self.map(_count_shard, shards):
+            counts += shard_counts
+        return counts
+
+    def pair_paths(self, pairs):
+        """
+        The paths of every (src, dst) pair of switch ids, as (per-pair path
+        counts, PathSet of the paths pair by pair).
+        """
+        n_shards = max(1, min(len(pairs), self.n_shards))
+        results = self.map(_pairs_shard, [pairs[i::n_shards] for i in range(n_shards)])
+        shard_counts = np.concatenate([r[0] for r in results])
+        lengths = np.concatenate([r[1] for r in results])
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        paths = PathSet(offsets, np.concatenate([r[2] for r in results]))
+
+        # shard i holds pairs i, i + n_shards, ...: put them back in order
+        shard_of = np.concatenate([np.arange(i, len(pairs), n_shards) for i in range(n_shards)])
+        counts = np.zeros(len(pairs), dtype=np.int64)
+        counts[shard_of] = shard_counts
+        order = np.argsort(np.repeat(shard_of, shard_counts), kind='mergesort')
+        return counts, paths.take(order)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def _paths_from(src):
+    """
+    Paths from switch `src` to every other switch, as (per-dst path counts,
+    path lengths, flat nodes) arrays so results cross the process boundary
+    compactly.
+    """
+    graph, fn, k = _worker['graph'], _worker['fn'], _worker['k']
+    counts = np.zeros(graph.n, dtype=np.int64)
+    paths = []
+    for dst in range(graph.n):
+        if dst == src:
+            continue
+        dst_paths = fn(graph, src, dst, k)
+        counts[dst] = len(dst_paths)
+        paths += dst_paths
+
+    path_set = PathSet.from_paths(paths)
+    return counts, path_set.lengths(), path_set.nodes
+
+
+def _pairs_shard(pairs):
+    """
+    The paths of each (src, dst) pair of one shard, in the same compact form
+    as _paths_from().
+    """
+    graph, fn, k = _worker['graph'], _worker['fn'], _worker['k']
+    counts = np.zeros(len(pairs), dtype=np.int64)
+    paths = []
+    for i, (src, dst) in enumerate(pairs):
+        pair_paths = fn(graph, src, dst, k)
+        counts[i] = len(pair_paths)
+        paths += pair_paths
+
+    path_set = PathSet.from_paths(paths)
+    return counts, path_set.lengths(), path_set.nodes
+
+
+def _bfs_distances(graph, src):
+    """
+    Hop distances from `src` to every switch, graph.n + 1 where unreachable.
+    """
+    adj = graph.adjacency
+    dist = [-1] * graph.n
+    dist[src] = 0
+    frontier = [src]
+    while frontier:
+        next_frontier = []
+        for u in frontier:
+            for v in adj[u]:
+                if dist[v] < 0:
+                    dist[v] = dist[u] + 1
+                    next_frontier.append(v)
+        frontier = next_frontier
+    dist = np.array(dist, dtype=np.int64)
+    dist[dist < 0] = graph.n + 1
+    return dist
+
+
+def _count_shard(pairs):
+    """
+    Per-link path counts over the (src, dst) pairs of one shard.
+    """
+    graph, fn, k = _worker['graph'], _worker['fn'], _worker['k']
+    paths = []
+    for src, dst in pairs:
+        paths += fn(graph, src, dst, k)
+    return graph.link_counts(PathSet.from_paths(paths))
+
+
+class PathStore(object):
+    """
+    Path sets between every ordered pair of switches of one topology.
+
+    The paths from src to dst are paths[pair_offsets[p]:pair_offsets[p+1]]
+    with p = src * n + dst. A store remembers the fingerprint of the switch
+    graph it was computed on, so a stale file is never reused.
+    """
+
+    def __init__(self, fingerprint, algorithm, k, n_switches, pair_offsets, paths):
+        self.fingerprint = fingerprint
+        self.algorithm = algorithm_tag(algorithm)
+        self.k = k
+        self.n = n_switches
+        self.pair_offsets = np.asarray(pair_offsets, dtype=np.int64)
+        self.paths = paths
+
+    @classmethod
+    def compute(cls, topo, algorithm, k, workers=1):
+        graph = SwitchGraph.from_topo(topo)
+        pool = PathWorkers(graph, algorithm, k, workers)
+        try:
+            rows = pool.map(_paths_from, range(graph.n))
+        finally:
+            pool.close()
+
+        pair_offsets = np.zeros(graph.n * graph.n + 1, dtype=np.int64)
+        if rows:
+            np.cumsum(np.concatenate([r[0] for r in rows]), out=pair_offsets[1:])
+            lengths = np.concatenate([r[1] for r in rows])
+            nodes = np.concatenate([r[2] for r in rows])
+        else:
+            lengths = nodes = np.zeros(0, dtype=np.int64)
+
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(graph.fingerprint(), algorithm, k, graph.n, pair_offsets, PathSet(offsets, nodes))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(str(data['fingerprint']), str(data['algorithm']), int(data['k']),
+                       int(data['n_switches']), data['pair_offsets'],
+                       PathSet(data['offsets'], data['nodes']))
+
+    def save(self, filename):
+        # write then rename, so a concurrent reader never sees half a file
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, fingerprint=np.array(self.fingerprint), algorithm=np.array(self.algorithm),
+                     k=self.k, n_switches=self.n, pair_offsets=self.pair_offsets,
+                     offsets=self.paths.offsets, nodes=self.paths.nodes)
+        os.rename(tmp, filename)
+
+    def stale_pairs(self, graph, added=(), removed=()):
+        """
+        Which pairs of switches of `graph` may have different paths than this
+        store holds, given the switch links `added` and `removed` since it was
+        computed, as a (graph.n, graph.n) boolean matrix.
+
+        A pair is stale if one of its paths used a removed link, if it
+        involves a switch this store doesn't know, or if an added link (a, b)
+        makes a path at most as long as the ones it has:
+        d(src, a) + 1 + d(b, dst) no more than its longest path (k-shortest
+        with k paths), or its shortest path (ECMP). Ties may make a recomputed
+        k-shortest set differ from the kept one; both are valid.
+        """
+        n, n_new = self.n, graph.n
+        stale = np.zeros((n_new, n_new), dtype=bool)
+        stale[n:, :] = True
+        stale[:, n:] = True
+
+        path_counts = np.diff(self.pair_offsets)
+        path_pair = np.repeat(np.arange(n * n, dtype=np.int64), path_counts)
+        old = np.zeros(n * n, dtype=bool)
+
+        if len(removed):
+            removed = np.asarray(removed, dtype=np.int64).reshape(-1, 2)
+            keys = np.concatenate([removed[:, 0] * n_new + removed[:, 1],
+                                   removed[:, 1] * n_new + removed[:, 0]])
+            u, v = self.paths.hops()
+            hop_path = np.repeat(np.arange(len(self.paths), dtype=np.int64),
+                                 np.maximum(self.paths.lengths() - 1, 0))
+            old[path_pair[hop_path[np.in1d(u * n_new + v, keys)]]] = True
+
+        if len(added):
+            hops = self.paths.lengths() - 1
+            if self.algorithm == 'ecmp':
+                limit = np.full(n * n, n_new + 1, dtype=np.int64)
+                np.minimum.at(limit, path_pair, hops)
+            else:
+                limit = np.full(n * n, -1, dtype=np.int64)
+                np.maximum.at(limit, path_pair, hops)
+                # a pair with fewer than k paths takes any new path
+                limit[path_counts < self.k] = n_new + 1
+            limit[path_counts == 0] = n_new + 1
+            limit = limit.reshape(n, n)
+
+            dist = {}
+            for (a, b) in added:
+                for sw in (a, b):
+                    if sw not in dist:
+                        dist[sw] = _bfs_distances(graph, sw)[:n]
+                for (x, y) in ((a, b), (b, a)):
+                    bound = dist[x][:, None] + 1 + dist[y][None, :]
+                    old |= ((bound <= limit) & (bound <= n_new)).ravel()
+
+        stale[:n, :n] |= old.reshape(n, n)
+        np.fill_diagonal(stale, False)
+        return stale
+
+    def update(self, graph, added=(), removed=(), workers=1):
+        """
+        The store for `graph`, a later version of this store's switch graph
+        with the links `added` and `removed` (and maybe new switches), which
+        recomputes only the stale_pairs() and keeps every other pair's paths.
+        """
+        n, n_new = self.n, graph.n
+        stale = self.stale_pairs(graph, added, removed).ravel()
+
+        fresh_ids = np.flatnonzero(stale)
+        pool = PathWorkers(graph, self.algorithm, self.k, workers)
+        try:
+            pairs = list(zip((fresh_ids // n_new).tolist(), (fresh_ids % n_new).tolist()))
+            fresh_counts, fresh = pool.pair_paths(pairs)
+        finally:
+            pool.close()
+
+        kept_ids = np.flatnonzero(~stale)
+        kept_src, kept_dst = kept_ids // n_new, kept_ids % n_new
+        # the only unstale pairs with a new switch are (sw, sw), with no paths
+        known = (kept_src < n) & (kept_dst < n)
+        kept_ids, kept_src, kept_dst = kept_ids[known], kept_src[known], kept_dst[known]
+        old_ids = kept_src * n + kept_dst
+        kept = self.paths.take(concat_ranges(self.pair_offsets[old_ids], self.pair_offsets[old_ids + 1]))
+        kept_counts = np.diff(self.pair_offsets)[old_ids]
+
+        counts = np.zeros(n_new * n_new, dtype=np.int64)
+        counts[kept_ids] = kept_counts
+        counts[fresh_ids] = fresh_counts
+        pair_offsets = np.zeros(n_new * n_new + 1, dtype=np.int64)
+        np.cumsum(counts, out=pair_offsets[1:])
+
+        # both sets are in pair order already; interleave them by pair
+        path_pair = np.concatenate([np.repeat(kept_ids, kept_counts), np.repeat(fresh_ids, fresh_counts)])
+        order = np.argsort(path_pair, kind='mergesort')
+        merged = PathSet(np.concatenate([kept.offsets[:-1], fresh.offsets + kept.offsets[-1]]),
+                         np.concatenate([kept.nodes, fresh.nodes]))
+        return PathStore(graph.fingerprint(), self.algorithm, self.k, n_new, pair_offsets,
+                         merged.take(order))
+
+    def matches(self, graph, algorithm, k):
+        return (self.fingerprint == graph.fingerprint() and
+                self.algorithm == algorithm_tag(algorithm) and self.k == k)
+
+    def select(self, src, dst):
+        """
+        PathSet holding the paths of every (src[i], dst[i]) pair, pair by pair.
+        """
+        pairs = np.asarray(src, dtype=np.int64) * self.n + np.asarray(dst, dtype=np.int64)
+        return self.paths.take(concat_ranges(self.pair_offsets[pairs], self.pair_offsets[pairs + 1]))
+
+    def pair_paths(self, src, dst):
+        """
+        The paths from switch `src` to switch `dst` as lists of switch names.
+        """
+        p = switch_id(src) * self.n + switch_id(dst)
+        return [[switch_name(s) for s in self.paths[i].tolist()]
+                for i in range(self.pair_offsets[p], self.pair_offsets[p+1])]
+
+
+class LinkIncidence(object):
+    """
+    The pair-by-link incidence matrix of a PathStore, in CSR form: the links
+    used by the paths of pair p = src * n + dst, with multiplicity, are the
+    edge ids edges[offsets[p]:offsets[p+1]].
+
+    Once built, the link counts of any traffic matrix over the store's pairs
+    are a gather and a bincount, with no per-path work.
+    """
+
+    def __init__(self, store, graph):
+        self.n = store.n
+        self.n_edges = graph.n_edges
+
+        u, v = store.paths.hops()
+        self.edges = graph.edge_ids(u, v)
+        path_hops = np.zeros(len(store.paths) + 1, dtype=np.int64)
+        np.cumsum(np.maximum(store.paths.lengths() - 1, 0), out=path_hops[1:])
+        self.offsets = path_hops[store.pair_offsets]
+
+    def _edges(self, src, dst):
+        pairs = np.asarray(src, dtype=np.int64) * self.n + np.asarray(dst, dtype=np.int64)
+        return self.edges[concat_ranges(self.offsets[pairs], self.offsets[pairs + 1])]
+
+    def link_counts(self, src, dst):
+        return np.bincount(self._edges(src, dst), minlength=self.n_edges)
+
+    def batch_link_counts(self, traffic):
+        """
+        Link counts of several traffic matrices at once, given as a list of
+        (src, dst) pair lists; row i of the result belongs to traffic[i].
+        """
+        edges = [self._edges(src, dst) for src, dst in traffic]
+        rows = np.repeat(np.arange(len(traffic), dtype=np.int64), [len(e) for e in edges])
+        flat = rows * self.n_edges + np.concatenate(edges) if edges else rows
+        counts = np.bincount(flat, minlength=len(traffic) * self.n_edges)
+        return counts.reshape(len(traffic), self.n_edges)
+
+
+def get_path_store(topo, algorithm, k, filename=None, workers=1):
+    """
+    Loads the path store saved in `filename` if it was computed for this
+    topology, otherwise computes it (and saves it, if `filename` is given).
+    """
+    if filename and os.path.exists(filename):
+        store = PathStore.load(filename)
+        if store.matches(SwitchGraph.from_topo(topo), algorithm, k):
+            return store
+
+    store = PathStore.compute(topo, algorithm, k, workers)
+    if filename:
+        store.save(filename)
+    return store
@@ -0,0 +1,145 @@
+"""
+On-disk format for Jellyfish topologies.
+
+A topology is saved as a directory holding a small JSON header and plain .npy
+arrays, so that it loads without unpickling networkx objects and the arrays
+can be memory-mapped:
+
+  topology.json      format name and version, n_hosts, n_switches, n_ports
+                     and the seed it was generated from (null if unknown)
+  switch_links.npy   int32 (m, 4): switch u, switch v, u's port, v's port
+  host_links.npy     int32 (n_hosts, 4): host, switch, host port, switch port
+  host_ips.npy       bytes (n_hosts,): IP address of every host, as text
+
+load_topology() returns the same dict shape generate_topology() builds. The
+'graph' and 'outport_mappings' entries are only built from the arrays the
+first time they are looked up.
+"""
+
+import json
+import os
+import pickle
+import shutil
+
+import networkx as nx
+import numpy as np
+
+
+TOPOLOGY_FORMAT = "jellyfish-topology"
+TOPOLOGY_FORMAT_VERSION = 1
+
+
+class TopologyView(dict):
+    """
+    A topo dict backed by topology arrays, which builds its networkx graph and
+    outport mappings lazily.
+    """
+
+    def __missing__(self, key):
+        if key == 'graph':
+            value = self._build_graph()
+        elif key == 'outport_mappings':
+            value = self._build_outport_mappings()
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+    def _build_graph(self):
+        G = nx.Graph()
+        ips = self['host_ips']
+        for h in range(self['n_hosts']):
+            G.add_node('h'+str(h), ip=str(ips[h].decode('ascii')))
+        G.add_nodes_from('s'+str(sw) for sw in range(self['n_switches']))
+        G.add_edges_from(('h'+str(h), 's'+str(sw)) for (h, sw) in self['host_links'][:, :2].tolist())
+        G.add_edges_from(('s'+str(u), 's'+str(v)) for (u, v) in self['switch_links'][:, :2].tolist())
+        return G
+
+    def _build_outport_mappings(self):
+        outport_mappings = {}
+        for (h, sw, h_port, sw_port) in self['host_links'].tolist():
+            outport_mappings[('s'+str(sw), 'h'+str(h))] = sw_port
+            outport_mappings[('h'+str(h), 's'+str(sw))] = h_port
+        for (u, v, u_port, v_port) in self['switch_links'].tolist():
+            outport_mappings[('s'+str(u), 's'+str(v))] = u_port
+            outport_mappings[('s'+str(v), 's'+str(u))] = v_port
+        return outport_mappings
+
+
+def topology_arrays(topo):
+    """
+    The arrays of the on-disk format, from a topo dict.
+    """
+    if 'switch_links' in topo:
+        return topo['switch_links'], topo['host_links'], topo['host_ips']
+
+    outport_mappings = topo['outport_mappings']
+    switch_links = []
+    host_links = []
+    for (u, v) in topo['graph'].edges():
+        if u[0] == 'h' or v[0] == 'h':
+            h, sw = (u, v) if u[0] == 'h' else (v, u)
+            host_links.append((int(h[1:]), int(sw[1:]), outport_mappings[(h, sw)], outport_mappings[(sw, h)]))
+        else:
+            switch_links.append((int(u[1:]), int(v[1:]), outport_mappings[(u, v)], outport_mappings[(v, u)]))
+
+    host_links.sort()
+    ips = dict(topo['graph'].nodes(data='ip'))
+    host_ips = [ips['h'+str(h)] for h in range(topo['n_hosts'])]
+    return (np.array(switch_links, dtype=np.int32).reshape(-1, 4),
+            np.array(host_links, dtype=np.int32).reshape(-1, 4),
+            np.array([ip.encode('ascii') for ip in host_ips], dtype=bytes))
+
+
+def save_topology(topo, path):
+    switch_links, host_links, host_ips = topology_arrays(topo)
+
+    # write into a scratch directory and move it into place, so a reader never
+    # sees a partially written topology
+    tmp = path.rstrip('/') + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    with open(os.path.join(tmp, 'topology.json'), 'w') as f:
+        json.dump({
+            'format': TOPOLOGY_FORMAT,
+            'version': TOPOLOGY_FORMAT_VERSION,
+            'n_hosts': topo['n_hosts'],
+            'n_switches': topo['n_switches'],
+            'n_ports': topo['n_ports'],
+            'seed': topo.get('seed'),
+        }, f, indent=2, sort_keys=True)
+    np.save(os.path.join(tmp, 'switch_links.npy'), switch_links)
+    np.save(os.path.join(tmp, 'host_links.npy'), host_links)
+    np.save(os.path.join(tmp, 'host_ips.npy'), host_ips)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp, path)
+
+
+def load_topology(path, mmap_mode='r'):
+    """
+    Loads a topology saved by save_topology(). Older pickled topo dicts are
+    still accepted.
+    """
+    if not os.path.isdir(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    with open(os.path.join(path, 'topology.json')) as f:
+        header = json.load(f)
+    if header.get('format') != TOPOLOGY_FORMAT:
+        raise ValueError("%s is not a Jellyfish topology" % path)
+    if header.get('version') != TOPOLOGY_FORMAT_VERSION:
+        raise ValueError("%s has topology format version %s, expected %d" %
+                         (path, header.get('version'), TOPOLOGY_FORMAT_VERSION))
+
+    topo = TopologyView()
+    topo['n_hosts'] = header['n_hosts']
+    topo['n_switches'] = header['n_switches']
+    topo['n_ports'] = header['n_ports']
+    topo['seed'] = header.get('seed')
+    for name in ['switch_links', 'host_links', 'host_ips']:
+        topo[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+    return topo
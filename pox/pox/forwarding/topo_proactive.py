@@ -188,6 +188,11 @@ class TopoSwitch (DHCPD):
       self.log.debug("Can't send table: disconnected")
       return
 
+    # Write the whole table at once rather than a message at a time
+    with self.connection.batch():
+      self._send_table()
+
+  def _send_table (self):
     clear = of.ofp_flow_mod(command=of.OFPFC_DELETE)
     self.connection.send(clear)
     self.connection.send(of.ofp_barrier_request())
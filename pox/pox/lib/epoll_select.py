@@ -114,3 +114,83 @@ class EpollSelect(object):
 
   def close(self):
     self.epoll.close()
+
+
+class EpollRegistry (object):
+  """ a long-lived set of objects watched by one epoll object.
+
+      Unlike EpollSelect, which rebuilds its interest set from the lists
+      passed to every select() call, objects are registered once (by default
+      edge-triggered) and poll() only ever looks at the fd's that are ready,
+      so the cost of a cycle doesn't grow with the number of idle objects.
+      With edge triggering, a reader has to drain an object (until EAGAIN)
+      before it will be reported again.
+
+      The registry has a fileno() itself, which is readable whenever some
+      registered object is ready, so it can be waited on with select() or a
+      recoco Select().
+  """
+
+  # (getattr, so that this module still imports where there is no epoll)
+  READ = getattr(select, "EPOLLIN", 0) | getattr(select, "EPOLLPRI", 0)
+  WRITE = getattr(select, "EPOLLOUT", 0)
+  ERROR = getattr(select, "EPOLLERR", 0) | getattr(select, "EPOLLHUP", 0)
+
+  def __init__(self, edge_triggered=True):
+    self.epoll = select.epoll()
+    self.trigger = select.EPOLLET if edge_triggered else 0
+    self.fd_to_obj = {}
+    self.obj_to_fd = {}
+
+  def fileno(self):
+    return self.epoll.fileno()
+
+  def __len__(self):
+    return len(self.fd_to_obj)
+
+  def __contains__(self, obj):
+    return obj in self.obj_to_fd
+
+  def register(self, obj, mask=None):
+    if mask is None: mask = self.READ
+    fd = obj.fileno() if hasattr(obj, "fileno") else obj
+    old = self.fd_to_obj.get(fd)
+    if old is not None:
+      # the fd was closed without being unregistered and has been reused
+      del self.obj_to_fd[old]
+      try:
+        self.epoll.unregister(fd)
+      except (IOError, OSError):
+        pass
+    self.epoll.register(fd, mask | self.trigger)
+    self.fd_to_obj[fd] = obj
+    self.obj_to_fd[obj] = fd
+
+  def modify(self, obj, mask):
+    self.epoll.modify(self.obj_to_fd[obj], mask | self.trigger)
+
+  def unregister(self, obj):
+    """ forgets obj; safe to call more than once, and after obj was closed. """
+    fd = self.obj_to_fd.pop(obj, None)
+    if fd is None:
+      return
+    del self.fd_to_obj[fd]
+    try:
+      self.epoll.unregister(fd)
+    except (IOError, OSError):
+      # closing an fd already removes it from the epoll set
+      pass
+
+  def poll(self, timeout=0, maxevents=-1):
+    """ the ready objects, as a list of (obj, epoll event mask) """
+    ready = []
+    for (fd, event) in self.epoll.poll(timeout, maxevents):
+      obj = self.fd_to_obj.get(fd)
+      if obj is not None:
+        ready.append((obj, event))
+    return ready
+
+  def close(self):
+    self.epoll.close()
+    self.fd_to_obj.clear()
+    self.obj_to_fd.clear()
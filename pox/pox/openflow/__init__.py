@@ -71,6 +71,22 @@ class ConnectionDown (Event):
     self.connection = connection
     self.dpid = connection.dpid
 
+class SendBackpressure (Event):
+  """
+  Event raised when the data waiting to be sent to a switch grows past the
+  connection's high-water mark (congested is True), and again once it has
+  drained below the low-water mark (congested is False).  Apps that send a
+  lot can hold off while a switch is congested.
+
+  queued (int) - bytes waiting to be sent
+  """
+  def __init__ (self, connection, congested, queued):
+    Event.__init__(self)
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.congested = congested
+    self.queued = queued
+
 class PortStatus (Event):
   """
   Fired in response to port status changes.
@@ -306,6 +322,7 @@ class OpenFlowNexus (EventMixin):
   _eventMixin_events = set([
     ConnectionUp,
     ConnectionDown,
+    SendBackpressure,
     FeaturesReceived,
     PortStatus,
     FlowRemoved,
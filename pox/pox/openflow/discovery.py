@@ -197,11 +197,14 @@ class LinkEvent (Event):
   """
   Link up/down event
   """
-  def __init__ (self, add, link):
+  def __init__ (self, add, link, remote = False):
     Event.__init__(self)
     self.link = link
     self.added = add
     self.removed = not add
+    # True if the link was found by another controller process (see
+    # openflow.shared)
+    self.remote = remote
 
   def port_for_dpid (self, dpid):
     if self.link.dpid1 == dpid:
@@ -302,10 +305,31 @@ class Discovery (EventMixin):
       self.install_flow(event.connection)
 
   def _handle_openflow_ConnectionDown (self, event):
-    # Delete all links on this switch
+    self.remove_switch_links(event.dpid)
+
+  def remove_switch_links (self, dpid):
+    """
+    Delete all links on a switch
+    """
     self._delete_links([link for link in self.adjacency
-                        if link.dpid1 == event.dpid
-                        or link.dpid2 == event.dpid])
+                        if link.dpid1 == dpid
+                        or link.dpid2 == dpid])
+
+  def add_remote_link (self, link):
+    """
+    Adds a link found by another controller process (see openflow.shared)
+
+    Remote links don't time out here; the process that found the link
+    takes it away again with remove_remote_link().
+    """
+    if link in self.adjacency: return
+    self.adjacency[link] = None
+    log.info('remote link detected: %s', link)
+    self.raiseEventNoErrors(LinkEvent, True, link, remote=True)
+
+  def remove_remote_link (self, link):
+    if link in self.adjacency and self.adjacency[link] is None:
+      self._delete_links([link])
 
   def _expire_links (self):
     """
@@ -314,7 +338,8 @@ class Discovery (EventMixin):
     now = time.time()
 
     expired = [link for link,timestamp in self.adjacency.iteritems()
-               if timestamp + self._link_timeout < now]
+               if timestamp is not None
+               and timestamp + self._link_timeout < now]
     if expired:
       for link in expired:
         log.info('link timeout: %s', link)
@@ -408,7 +433,9 @@ class Discovery (EventMixin):
       log.warning("Couldn't find a DPID in the LLDP packet")
       return EventHalt
 
-    if originatorDPID not in core.openflow.connections:
+    if (originatorDPID not in core.openflow.connections and not
+        (core.hasComponent('openflow_shared') and
+         originatorDPID in core.openflow_shared.switches)):
       log.info('Received LLDP packet from unknown switch')
       return EventHalt
 
@@ -450,7 +477,8 @@ class Discovery (EventMixin):
 
   def _delete_links (self, links):
     for link in links:
-      self.raiseEventNoErrors(LinkEvent, False, link)
+      remote = self.adjacency.get(link, 0) is None
+      self.raiseEventNoErrors(LinkEvent, False, link, remote=remote)
     for link in links:
       self.adjacency.pop(link, None)
 
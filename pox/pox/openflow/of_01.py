@@ -26,38 +26,40 @@ from pox.lib.revent.revent import EventMixin
 import datetime
 import time
 from pox.lib.socketcapture import CaptureSocket
+from pox.lib.epoll_select import EpollRegistry
+from pox.lib.util import dpid_to_str
 import pox.openflow.debug
 from pox.openflow.util import make_type_to_unpacker_table
 from pox.openflow import *
+from pox.openflow.shared import Channel, SharedState
 
 log = core.getLogger()
 
 import socket
 import select
+import struct
 
 # List where the index is an OpenFlow message type (OFPT_xxx), and
 # the values are unpack functions that unpack the wire format of that
 # type into a message object.
 unpackers = make_type_to_unpacker_table()
 
-try:
-  PIPE_BUF = select.PIPE_BUF
-except:
-  try:
-    # Try to get it from where PyPy (sometimes) has it
-    import IN
-    PIPE_BUF = IN.PIPE_BUF
-  except:
-    # (Hopefully) reasonable default
-    PIPE_BUF = 512
+# The start of the OpenFlow header: version, type and length
+_ofp_header = struct.Struct("!BBH")
 
 import pox.openflow.libopenflow_01 as of
 
 import threading
+import itertools
 import os
+import fcntl
+import subprocess
+from collections import deque
+from contextlib import contextmanager
+from thread import get_ident
 import sys
 import exceptions
-from errno import EAGAIN, ECONNRESET, EADDRINUSE, EADDRNOTAVAIL
+from errno import EAGAIN, EWOULDBLOCK, ECONNRESET, EADDRINUSE, EADDRNOTAVAIL
 
 
 import traceback
@@ -270,113 +272,6 @@ statsHandlerMap = {
   of.OFPST_QUEUE : handle_OFPST_QUEUE,
 }
 
-# Deferred sending should be unusual, so don't worry too much about
-# efficiency
-class DeferredSender (threading.Thread):
-  """
-  Class that handles sending when a socket write didn't complete
-  """
-  def __init__ (self):
-    threading.Thread.__init__(self)
-    core.addListeners(self)
-    self._dataForConnection = {}
-    self._lock = threading.RLock()
-    self._waker = pox.lib.util.makePinger()
-    self.sending = False
-
-    self.start()
-
-  def _handle_GoingDownEvent (self, event):
-    self._waker.ping()
-
-  def _sliceup (self, data):
-    """
-    Takes an array of data bytes, and slices into elements of
-    PIPE_BUF bytes each
-    """
-    out = []
-    while len(data) > PIPE_BUF:
-      out.append(data[0:PIPE_BUF])
-      data = data[PIPE_BUF:]
-    if len(data) > 0:
-      out.append(data)
-    return out
-
-  def send (self, con, data):
-    with self._lock:
-      self.sending = True
-
-      data = self._sliceup(data)
-
-      if con not in self._dataForConnection:
-        self._dataForConnection[con] = data
-      else:
-        self._dataForConnection[con].extend(data)
-
-      self._waker.ping()
-
-  def kill (self, con):
-    with self._lock:
-      try:
-        del self._dataForConnection[con]
-      except:
-        pass
-
-      self._waker.ping()
-
-  def run (self):
-    while core.running:
-
-      with self._lock:
-        cons = self._dataForConnection.keys()
-
-      rlist, wlist, elist = select.select([self._waker], cons, cons, 5)
-      if not core.running: break
-
-      with self._lock:
-        if len(rlist) > 0:
-          self._waker.pongAll()
-
-        for con in elist:
-          try:
-            del self._dataForConnection[con]
-          except:
-            pass
-
-        for con in wlist:
-          try:
-            alldata = self._dataForConnection[con]
-            while len(alldata):
-              data = alldata[0]
-              try:
-                l = con.sock.send(data)
-                if l != len(data):
-                  alldata[0] = data[l:]
-                  break
-                del alldata[0]
-              except socket.error as (errno, strerror):
-                if errno != EAGAIN:
-                  con.msg("DeferredSender/Socket error: " + strerror)
-                  con.disconnect()
-                  del self._dataForConnection[con]
-                break
-              except:
-                con.msg("Unknown error doing deferred sending")
-                break
-            if len(alldata) == 0:
-              try:
-                del self._dataForConnection[con]
-                if len(self._dataForConnection) == 0:
-                  self.sending = False
-                  break
-              except:
-                pass
-          except:
-            try:
-              del self._dataForConnection[con]
-            except:
-              pass
-
 class DummyOFNexus (object):
   def raiseEventNoErrors (self, event, *args, **kw):
     log.warning("%s raised on dummy OpenFlow nexus" % event)
@@ -571,6 +466,7 @@ class Connection (EventMixin):
   _eventMixin_events = set([
     ConnectionUp,
     ConnectionDown,
+    SendBackpressure,
     PortStatus,
     FlowRemoved,
     PacketIn,
@@ -589,6 +485,21 @@ class Connection (EventMixin):
   # Globally unique identifier for the Connection instance
   ID = 0
 
+  # The receive buffer starts out holding any OpenFlow message (they are at
+  # most 64 KiB) and doubles, up to the maximum, whenever a read fills it,
+  # so that a burst of messages is taken in with few recv() calls
+  RECV_BUFFER_MIN = 64 * 1024
+  RECV_BUFFER_MAX = 1024 * 1024
+
+  # Output that the socket won't take right away is queued on the
+  # connection and sent by the OpenFlow loop once the socket is writable,
+  # up to SEND_GATHER bytes of queued messages per send() call.  Queues
+  # longer than the high-water mark raise SendBackpressure, and so does
+  # draining back below the low-water mark.
+  SEND_GATHER = 64 * 1024
+  SEND_HIGH_WATER = 1024 * 1024
+  SEND_LOW_WATER = 256 * 1024
+
   def msg (self, m):
     #print str(self), m
     log.debug(str(self) + " " + str(m))
@@ -600,12 +511,35 @@ class Connection (EventMixin):
     #print str(self), m
     log.info(str(self) + " " + str(m))
 
-  def __init__ (self, sock):
+  def __init__ (self, sock, io_task = None, preamble = None):
+    """
+    preamble is set for a switch whose handshake began in another process
+    (see OpenFlow_01_Distributor): the HELLO has been exchanged already,
+    and preamble holds what was read from the features reply on.
+    """
     self._previous_stats = []
 
     self.ofnexus = _dummyOFNexus
     self.sock = sock
-    self.buf = ''
+    # Received bytes live in _rbuf[_rstart:_rend]; recv_into() writes
+    # straight into it through _rview
+    self._rbuf = bytearray(self.RECV_BUFFER_MIN)
+    self._rview = memoryview(self._rbuf)
+    self._rstart = 0
+    self._rend = 0
+    # Messages waiting to be sent; the first has been sent up to
+    # _out_offset.  The lock is for apps sending from other threads.
+    self._out = deque()
+    self._out_offset = 0
+    self._out_bytes = 0
+    self._out_lock = threading.Lock()
+    self.congested = False
+    # The OpenFlow task this connection is served by, if any
+    self._io_task = io_task
+    # Packed messages held back by batch() or until the end of the
+    # current I/O cycle, and how deeply batch() is nested
+    self._batch = []
+    self._batch_depth = 0
     Connection.ID += 1
     self.ID = Connection.ID
     # TODO: dpid and features don't belong here; they should be eventually
@@ -617,12 +551,21 @@ class Connection (EventMixin):
     self.connect_time = None
     self.idle_time = time.time()
 
-    self.send(of.ofp_hello())
+    if preamble is None:
+      self.send(of.ofp_hello())
 
     self.original_ports = PortCollection()
     self.ports = PortCollection()
     self.ports._chain = self.original_ports
 
+    if preamble:
+      while len(self._rbuf) < len(preamble):
+        self._make_room(grow = True)
+      self._rbuf[:len(preamble)] = preamble
+      self._rend = len(preamble)
+      if self._process_buffer() is False:
+        self.disconnect()
+
     #TODO: set a time that makes sure we actually establish a connection by
     #      some timeout
 
@@ -661,11 +604,11 @@ class Connection (EventMixin):
         self.ofnexus.raiseEventNoErrors(ConnectionDown, self)
         self.raiseEventNoErrors(ConnectionDown, self)
 
-    try:
-      #deferredSender.kill(self)
-      pass
-    except:
-      pass
+    self._batch = []
+    with self._out_lock:
+      self._out.clear()
+      self._out_offset = 0
+      self._out_bytes = 0
     try:
       self.sock.shutdown(socket.SHUT_RDWR)
     except:
@@ -682,6 +625,13 @@ class Connection (EventMixin):
 
     Data should probably either be raw bytes in OpenFlow wire format, or
     an OpenFlow controller-to-switch message object from libopenflow.
+
+    This never blocks.  Whatever the socket won't take now is queued and
+    sent, in order, when the socket becomes writable.
+
+    Inside batch(), or when called from an OpenFlow event handler, the
+    data is held back and written together with everything else sent to
+    this switch, at the end of the batch or of the event cycle.
     """
     if self.disconnected: return
     if type(data) is not bytes:
@@ -691,64 +641,255 @@ class Connection (EventMixin):
       assert isinstance(data, of.ofp_header)
       data = data.pack()
 
-    if deferredSender.sending:
-      log.debug("deferred sender is sending!")
-      deferredSender.send(self, data)
+    if self._batch_depth:
+      self._batch.append(data)
+      return
+    task = self._io_task
+    if task is not None and task._cycle_thread == get_ident():
+      if not self._batch:
+        task._batched.append(self)
+      self._batch.append(data)
       return
+    self._write(data)
+
+  @contextmanager
+  def batch (self):
+    """
+    Context manager which holds back everything sent to this connection
+    until the outermost batch ends and then writes it all at once, e.g.:
+
+      with connection.batch():
+        for msg in flow_mods:
+          connection.send(msg)
+
+    Messages sent from OpenFlow event handlers are already batched per
+    event cycle; this is for sends made elsewhere (e.g. from timers).
+    A batch should only be used from one thread.
+    """
+    self._batch_depth += 1
     try:
-      l = self.sock.send(data)
-      if l != len(data):
-        self.msg("Didn't send complete buffer.")
-        data = data[l:]
-        deferredSender.send(self, data)
-    except socket.error as (errno, strerror):
-      if errno == EAGAIN:
-        self.msg("Out of send buffer space.  " +
-                 "Consider increasing SO_SNDBUF.")
-        deferredSender.send(self, data)
+      yield self
+    finally:
+      self._batch_depth -= 1
+      if self._batch_depth == 0:
+        self.send_batch()
+
+  def send_batch (self):
+    """
+    Writes out whatever has been held back for this connection
+    """
+    batch = self._batch
+    if not batch: return
+    self._batch = []
+    if self.disconnected: return
+    if len(batch) == 1:
+      self._write(batch[0])
+    else:
+      self._write(b''.join(batch))
+
+  def _write (self, data):
+    error = None
+    with self._out_lock:
+      if self._out:
+        # Keep the order; this goes out after what is already queued
+        self._out.append(data)
+        self._out_bytes += len(data)
+        queued = False
       else:
-        self.msg("Socket error: " + strerror)
-        self.disconnect(defer_event=True)
+        try:
+          l = self.sock.send(data)
+        except socket.error as e:
+          if e.args[0] not in (EAGAIN, EWOULDBLOCK):
+            error = e
+          l = 0
+        if error is None and l != len(data):
+          self._out.append(data)
+          self._out_offset = l
+          self._out_bytes = len(data) - l
+        queued = error is None and l != len(data)
+      congested = (not self.congested and
+                   self._out_bytes > self.SEND_HIGH_WATER)
+      if congested:
+        self.congested = True
+      queued_bytes = self._out_bytes
+
+    if error is not None:
+      self.msg("Socket error: " + str(error.args[-1]))
+      self.disconnect(defer_event=True)
+      return
+    if queued:
+      self.msg("Out of send buffer space; queueing output")
+      if self._io_task is not None:
+        self._io_task._output_queued(self)
+    if congested:
+      self.raiseEventNoErrors(SendBackpressure, self, True, queued_bytes)
+      self.ofnexus.raiseEventNoErrors(SendBackpressure, self, True,
+                                      queued_bytes)
+
+  @property
+  def send_queued (self):
+    """
+    Number of bytes waiting to be sent
+    """
+    return self._out_bytes
+
+  def flush (self):
+    """
+    Sends queued output until there is none left or the socket would
+    block.  Generally this is just called by the main OpenFlow loop below
+    when the socket becomes writable.
+
+    Returns False if the connection failed.
+    """
+    error = None
+    relieved = False
+    with self._out_lock:
+      out = self._out
+      while out:
+        # Gather several queued messages into one send() where possible
+        first = out[0]
+        if len(out) == 1 or len(first) - self._out_offset >= self.SEND_GATHER:
+          data = buffer(first, self._out_offset)
+        else:
+          parts = [first[self._out_offset:]]
+          size = len(parts[0])
+          for msg in itertools.islice(out, 1, None):
+            if size + len(msg) > self.SEND_GATHER: break
+            parts.append(msg)
+            size += len(msg)
+          data = b''.join(parts)
+
+        try:
+          l = self.sock.send(data)
+        except socket.error as e:
+          if e.args[0] not in (EAGAIN, EWOULDBLOCK):
+            error = e
+          break
+
+        # Drop whatever went out from the front of the queue
+        self._out_bytes -= l
+        sent = l
+        while sent:
+          left = len(out[0]) - self._out_offset
+          if sent < left:
+            self._out_offset += sent
+            break
+          sent -= left
+          out.popleft()
+          self._out_offset = 0
+        if l != len(data):
+          # The socket buffer is full; wait until it's writable again
+          break
+
+      relieved = self.congested and self._out_bytes < self.SEND_LOW_WATER
+      if relieved:
+        self.congested = False
+      queued_bytes = self._out_bytes
+
+    if error is not None:
+      self.msg("Socket error: " + str(error.args[-1]))
+      self.disconnect(defer_event=True)
+      return False
+    if relieved:
+      self.raiseEventNoErrors(SendBackpressure, self, False, queued_bytes)
+      self.ofnexus.raiseEventNoErrors(SendBackpressure, self, False,
+                                      queued_bytes)
+    return True
 
   def read (self):
     """
     Read data from this connection.  Generally this is just called by the
     main OpenFlow loop below.
 
-    Note: This function will block if data is not available.
+    Reads until the socket would block (the epoll loop is edge-triggered,
+    so anything left unread, including the end of the stream, would not be
+    reported again), handling the complete messages after each read.
+    Returns False if the connection was closed or failed.
     """
-    try:
-      d = self.sock.recv(2048)
-    except:
-      return False
-    if len(d) == 0:
-      return False
-    self.buf += d
-    buf_len = len(self.buf)
+    grow = False
+    while True:
+      size = len(self._rbuf)
+      if self._rend == size and not self._rstart:
+        grow = True
+      if grow or (self._rstart and size - self._rend < size // 2):
+        self._make_room(grow)
+      free = len(self._rbuf) - self._rend
+      try:
+        n = self.sock.recv_into(self._rview[self._rend:], free)
+      except socket.error as e:
+        if e.args[0] in (EAGAIN, EWOULDBLOCK):
+          return True
+        return False
+      except:
+        return False
+      if n == 0:
+        return False
+      self._rend += n
 
+      if self._process_buffer() is False:
+        return False
 
-    offset = 0
-    while buf_len - offset >= 8: # 8 bytes is minimum OF message size
-      # We pull the first four bytes of the OpenFlow header off by hand
-      # (using ord) to find the version/length/type so that we can
-      # correctly call libopenflow to unpack it.
+      # A read that filled a mostly empty buffer means a burst is coming
+      # in; read into a bigger one from now on
+      grow = n == free and free >= size // 2
 
-      ofp_type = ord(self.buf[offset+1])
+  def _make_room (self, grow = False):
+    """
+    Moves the unprocessed bytes to the front of the receive buffer, which
+    is doubled first if grow is set (and it is below RECV_BUFFER_MAX).
+    """
+    pending = self._rend - self._rstart
+    size = len(self._rbuf)
+    if grow and size < self.RECV_BUFFER_MAX:
+      size = min(size * 2, self.RECV_BUFFER_MAX)
+    if size != len(self._rbuf):
+      # The memoryview pins the old buffer's size, so make a new one
+      rbuf = bytearray(size)
+      rbuf[:pending] = self._rview[self._rstart:self._rend]
+      self._rbuf = rbuf
+      self._rview = memoryview(rbuf)
+    elif pending and self._rstart:
+      self._rbuf[:pending] = self._rbuf[self._rstart:self._rend]
+    self._rstart = 0
+    self._rend = pending
+
+  def _process_buffer (self):
+    """
+    Unpacks and handles every complete message in the receive buffer.
+    Returns False if the connection should be thrown away.
+    """
+    rbuf = self._rbuf
+    end = self._rend
+    offset = self._rstart
+    # Unpackers get a read-only view of the buffer rather than a copy;
+    # slicing it gives them just the bytes they ask for
+    raw = None
+
+    while end - offset >= 8: # 8 bytes is minimum OF message size
+      # We pull the first four bytes of the OpenFlow header off with one
+      # precompiled struct to find the version/length/type so that we can
+      # correctly call libopenflow to unpack it.
+      version, ofp_type, msg_length = _ofp_header.unpack_from(rbuf, offset)
 
-      if ord(self.buf[offset]) != of.OFP_VERSION:
+      if version != of.OFP_VERSION:
         if ofp_type == of.OFPT_HELLO:
           # We let this through and hope the other side switches down.
           pass
         else:
           log.warning("Bad OpenFlow version (0x%02x) on connection %s"
-                      % (ord(self.buf[offset]), self))
+                      % (version, self))
           return False # Throw connection away
 
-      msg_length = ord(self.buf[offset+2]) << 8 | ord(self.buf[offset+3])
+      if msg_length < 8:
+        log.warning("Bad OpenFlow message length (%i) on connection %s"
+                    % (msg_length, self))
+        return False
 
-      if buf_len - offset < msg_length: break
+      if end - offset < msg_length: break
 
-      new_offset,msg = unpackers[ofp_type](self.buf, offset)
+      if raw is None:
+        raw = buffer(rbuf, 0, end)
+      new_offset,msg = unpackers[ofp_type](raw, offset)
       assert new_offset - offset == msg_length
       offset = new_offset
 
@@ -761,9 +902,11 @@ class Connection (EventMixin):
                       ("\n" + str(self) + " ").join(str(msg).split('\n')))
         continue
 
-    if offset != 0:
-      self.buf = self.buf[offset:]
-
+    if offset == end:
+      # Everything was handled; start over at the front
+      self._rstart = self._rend = 0
+    else:
+      self._rstart = offset
     return True
 
   def _incoming_stats_reply (self, ofp):
@@ -827,15 +970,79 @@ def wrap_socket (new_sock):
 
 from pox.lib.recoco.recoco import *
 
+class _ChannelClosed (Exception):
+  """
+  The parent process of a worker has gone away
+  """
+  pass
+
+
+def _listen (address, port):
+  """
+  Returns a non-blocking socket listening for switches, or None
+  """
+  listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  try:
+    listener.bind((address, port))
+  except socket.error as (errno, strerror):
+    log.error("Error %i while binding socket: %s", errno, strerror)
+    if errno == EADDRNOTAVAIL:
+      log.error(" You may be specifying a local address which is "
+                "not assigned to any interface.")
+    elif errno == EADDRINUSE:
+      log.error(" You may have another controller running.")
+      log.error(" Use openflow.of_01 --port=<port> to run POX on "
+                "another port.")
+    return None
+
+  listener.listen(16)
+  listener.setblocking(0)
+  log.debug("Listening on %s:%s" %
+            (address, port))
+  return listener
+
+
 class OpenFlow_01_Task (Task):
   """
   The main recoco thread for listening to openflow messages
+
+  With use_epoll (the default where epoll is available), connections are
+  registered once with an edge-triggered EpollRegistry and only the ones
+  that are ready get looked at, so a cycle costs the same however many
+  idle switches are connected.  Otherwise every connection is passed to
+  select() each cycle.
+
+  Either way, output a connection couldn't send right away is flushed
+  from here once its socket becomes writable.
+
+  In a worker process (see OpenFlow_01_Distributor), switches arrive over
+  the channel from the parent instead of from a listening socket.
   """
-  def __init__ (self, port = 6633, address = '0.0.0.0'):
+  def __init__ (self, port = 6633, address = '0.0.0.0', use_epoll = None,
+                channel = None):
     Task.__init__(self)
     self.port = int(port)
     self.address = address
+    self.channel = channel
+    if channel is not None:
+      channel.io_task = self
+    # Set between a switch being announced by the parent and its socket
+    # arriving
+    self._preamble = None
     self.started = False
+    if use_epoll is None:
+      use_epoll = hasattr(select, 'epoll')
+    self.use_epoll = use_epoll
+    # Connections with queued output (select() mode only)
+    self._writers = set()
+    self._pinger = None
+    self._loop_thread = None
+    # While the loop is handling ready connections, this is its thread's
+    # id, and sends made from that thread are batched per connection in
+    # _batched until _end_cycle()
+    self._cycle_thread = None
+    self._batched = []
 
     core.addListener(pox.core.GoingUpEvent, self._handle_GoingUpEvent)
 
@@ -848,73 +1055,262 @@ class OpenFlow_01_Task (Task):
     self.started = True
     return super(OpenFlow_01_Task,self).start()
 
-  def run (self):
-    # List of open sockets/connections to select on
-    sockets = []
+  def _listen (self):
+    if self.channel is not None:
+      return self.channel
+    return _listen(self.address, self.port)
 
-    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  def _accept (self, listener):
+    """
+    Returns a Connection for the next new switch, or None if there is none
+    """
+    if listener is self.channel:
+      return self._take_switch()
     try:
-      listener.bind((self.address, self.port))
-    except socket.error as (errno, strerror):
-      log.error("Error %i while binding socket: %s", errno, strerror)
-      if errno == EADDRNOTAVAIL:
-        log.error(" You may be specifying a local address which is "
-                  "not assigned to any interface.")
-      elif errno == EADDRINUSE:
-        log.error(" You may have another controller running.")
-        log.error(" Use openflow.of_01 --port=<port> to run POX on "
-                  "another port.")
+      new_sock = listener.accept()[0]
+    except socket.error as e:
+      if e.args[0] in (EAGAIN, EWOULDBLOCK):
+        return None
+      raise
+    return self._new_connection(new_sock)
+
+  def _new_connection (self, new_sock, preamble = None):
+    if pox.openflow.debug.pcap_traces:
+      new_sock = wrap_socket(new_sock)
+    new_sock.setblocking(0)
+    # Note that instantiating a Connection object fires a
+    # ConnectionUp event (after negotation has completed)
+    return Connection(new_sock, self, preamble)
+
+  def _take_switch (self):
+    """
+    Handles messages from the parent process until one hands over a
+    switch, returning its Connection, or until there are none left
+    """
+    while True:
+      try:
+        if self._preamble is not None:
+          # The switch's socket comes in a packet of its own
+          sock = self.channel.recv_socket()
+          if sock is None:
+            return None
+          preamble, self._preamble = self._preamble, None
+          return self._new_connection(sock, preamble)
+        msg = self.channel.recv()
+      except EOFError:
+        raise _ChannelClosed()
+      if msg is None:
+        return None
+      if msg[0] == "switch":
+        self._preamble = msg[1]
+      elif msg[0] == "shared":
+        core.openflow_shared._receive(*msg[1:])
+
+  def _begin_cycle (self):
+    self._cycle_thread = get_ident()
+
+  def _end_cycle (self):
+    """
+    Writes out everything sent during the cycle, one write per connection
+    """
+    self._cycle_thread = None
+    batched = self._batched
+    self._batched = []
+    for con in batched:
+      try:
+        con.send_batch()
+      except Exception:
+        log.exception("Exception sending to connection " + str(con))
+
+  def _output_queued (self, con):
+    """
+    Called by a connection when it has started queueing output
+    """
+    if self.use_epoll:
+      # Its socket is registered for writability already
       return
+    if get_ident() == self._loop_thread:
+      self._writers.add(con)
+    elif self._pinger is not None:
+      # Only the loop itself touches _writers; when pinged, it looks for
+      # connections with queued output
+      self._pinger.ping()
+
+  def run (self):
+    listener = self._listen()
+    if listener is None:
+      return
+
+    if self.use_epoll:
+      loop = self._run_epoll(listener)
+    else:
+      loop = self._run_select(listener)
 
-    listener.listen(16)
-    sockets.append(listener)
+    # Run the chosen loop, handing the result of each of its blocking
+    # operations back to it
+    rv = None
+    while True:
+      try:
+        op = loop.send(rv)
+      except StopIteration:
+        break
+      rv = yield op
+
+    log.debug("No longer listening for connections")
+    if self.channel is not None:
+      # Without the parent, no more switches are coming
+      core.quit()
+
+  def _run_epoll (self, listener):
+    registry = EpollRegistry()
+    con_events = EpollRegistry.READ | EpollRegistry.WRITE
+    # A worker's channel to its parent has output to flush too
+    if listener is self.channel:
+      registry.register(listener, con_events)
+    else:
+      registry.register(listener)
 
-    log.debug("Listening on %s:%s" %
-              (self.address, self.port))
+    def drop (con):
+      registry.unregister(con)
+      try:
+        con.close()
+      except:
+        pass
 
     con = None
     while core.running:
       try:
         while True:
           con = None
-          rlist, wlist, elist = yield Select(sockets, [], sockets, 5)
+          # The registry's own fd is readable whenever a connection is
+          rlist, wlist, elist = yield Select([registry], [], [], 5)
+          if len(rlist) == 0:
+            if not core.running: break
+            continue
+
+          timestamp = time.time()
+          self._begin_cycle()
+          for con, event in registry.poll(0):
+            if con is listener:
+              if event & EpollRegistry.ERROR and con is not self.channel:
+                raise RuntimeError("Error on listener socket")
+              if event & EpollRegistry.WRITE and con is self.channel:
+                con.flush()
+              # Edge-triggered, so accept everything that is pending
+              while True:
+                newcon = self._accept(listener)
+                if newcon is None: break
+                registry.register(newcon, con_events)
+            else:
+              if event & EpollRegistry.WRITE and con._out:
+                if not con.flush():
+                  drop(con)
+                  continue
+              if event & (EpollRegistry.READ | EpollRegistry.ERROR):
+                con.idle_time = timestamp
+                if con.read() is False:
+                  drop(con)
+          self._end_cycle()
+      except exceptions.KeyboardInterrupt:
+        break
+      except _ChannelClosed:
+        log.info("Listening process has gone away")
+        break
+      except:
+        # Don't hold back what the other connections were sent
+        self._end_cycle()
+        doTraceback = True
+        if sys.exc_info()[0] is socket.error:
+          if sys.exc_info()[1][0] == ECONNRESET:
+            con.info("Connection reset")
+            doTraceback = False
+
+        if doTraceback:
+          log.exception("Exception reading connection " + str(con))
+
+        if con is listener:
+          log.error("Exception on OpenFlow listener.  Aborting.")
+          break
+        if con is not None:
+          drop(con)
+
+    registry.close()
+
+  def _run_select (self, listener):
+    # List of open sockets/connections to select on
+    sockets = [listener]
+    writers = self._writers
+    pinger = self._pinger = pox.lib.util.make_pinger()
+    self._loop_thread = get_ident()
+
+    def drop (con):
+      try:
+        con.close()
+      except:
+        pass
+      try:
+        sockets.remove(con)
+      except:
+        pass
+      writers.discard(con)
+
+    con = None
+    while core.running:
+      try:
+        while True:
+          con = None
+          # Connections that closed since they queued output
+          for con in [c for c in writers if c not in sockets]:
+            writers.discard(con)
+          rlist, wlist, elist = yield Select(sockets + [pinger],
+                                             list(writers), sockets, 5)
           if len(rlist) == 0 and len(wlist) == 0 and len(elist) == 0:
             if not core.running: break
 
+          if pinger in rlist:
+            pinger.pongAll()
+            rlist.remove(pinger)
+            # Some other thread queued output
+            writers.update(c for c in sockets if getattr(c, '_out', None))
+
           for con in elist:
             if con is listener:
               raise RuntimeError("Error on listener socket")
             else:
-              try:
-                con.close()
-              except:
-                pass
-              try:
-                sockets.remove(con)
-              except:
-                pass
+              drop(con)
+
+          for con in wlist:
+            if con not in sockets:
+              continue
+            if not con.flush():
+              drop(con)
+            elif not con._out:
+              writers.discard(con)
 
           timestamp = time.time()
+          self._begin_cycle()
           for con in rlist:
             if con is listener:
-              new_sock = listener.accept()[0]
-              if pox.openflow.debug.pcap_traces:
-                new_sock = wrap_socket(new_sock)
-              new_sock.setblocking(0)
-              # Note that instantiating a Connection object fires a
-              # ConnectionUp event (after negotation has completed)
-              newcon = Connection(new_sock)
-              sockets.append( newcon )
-              #print str(newcon) + " connected"
+              while True:
+                newcon = self._accept(listener)
+                if newcon is None: break
+                sockets.append( newcon )
+                #print str(newcon) + " connected"
             else:
+              if con not in sockets:
+                continue
               con.idle_time = timestamp
               if con.read() is False:
-                con.close()
-                sockets.remove(con)
+                drop(con)
+          self._end_cycle()
       except exceptions.KeyboardInterrupt:
         break
+      except _ChannelClosed:
+        log.info("Listening process has gone away")
+        break
       except:
+        # Don't hold back what the other connections were sent
+        self._end_cycle()
         doTraceback = True
         if sys.exc_info()[0] is socket.error:
           if sys.exc_info()[1][0] == ECONNRESET:
@@ -927,18 +1323,216 @@ class OpenFlow_01_Task (Task):
         if con is listener:
           log.error("Exception on OpenFlow listener.  Aborting.")
           break
-        try:
-          con.close()
-        except:
-          pass
-        try:
-          sockets.remove(con)
-        except:
-          pass
+        if con is not None:
+          drop(con)
+
+    self._pinger = None
+    #pox.core.quit()
+
+
+def _worker_argv (worker, workers, channel_fd):
+  """
+  POX's own command line, rewritten to start the given worker
+  """
+  argv = list(sys.argv)
+  for i,arg in enumerate(argv):
+    if arg.split(":")[0] in ("openflow.of_01", "pox.openflow.of_01"):
+      break
+  else:
+    raise RuntimeError("openflow.of_01 is not on the command line")
+  end = i + 1
+  while end < len(argv) and argv[end].startswith("--"):
+    end += 1
+  options = [o for o in argv[i+1:end]
+             if o[2:].split("=")[0].replace("-", "_")
+             not in ("port", "address", "workers", "worker", "channel")]
+  options += ["--worker=%i" % (worker,), "--workers=%i" % (workers,),
+              "--channel=%i" % (channel_fd,)]
+  argv[i+1:end] = options
+  return [sys.executable] + argv
+
+
+class OpenFlow_01_Distributor (Task):
+  """
+  Listens for switches on behalf of worker processes
+
+  Started by openflow.of_01 --workers=N, which runs N more copies of POX
+  with the same command line, each with its own recoco loop and apps.
+  This process does the HELLO / features request exchange with every
+  switch to learn its DPID, and then hands the socket (and the bytes read
+  from the features reply on) to worker DPID % N, so a switch always ends
+  up with the same worker.  It also relays the messages the workers
+  publish for each other (see openflow.shared).
+  """
+  HANDSHAKE_TIMEOUT = 30
+
+  def __init__ (self, port = 6633, address = '0.0.0.0', workers = 2):
+    Task.__init__(self)
+    self.port = int(port)
+    self.address = address
+    self.workers = int(workers)
+    self.started = False
+    self.channels = []
+    self.processes = []
+    # socket -> [bytes read, time accepted] for switches mid-handshake
+    self._pending = {}
+
+    core.addListener(pox.core.GoingUpEvent, self._handle_GoingUpEvent)
+    core.addListener(pox.core.GoingDownEvent, self._handle_GoingDownEvent)
+
+  def _handle_GoingUpEvent (self, event):
+    self.start()
+
+  def _handle_GoingDownEvent (self, event):
+    for p in self.processes:
+      if p.poll() is None:
+        p.terminate()
+
+  def start (self):
+    if self.started:
+      return
+    self.started = True
+    self._spawn()
+    return super(OpenFlow_01_Distributor,self).start()
+
+  def _spawn (self):
+    devnull = open(os.devnull)
+    for worker in range(self.workers):
+      ours, theirs = Channel.pair()
+      # Only the worker's own end of its channel is inherited
+      flags = fcntl.fcntl(ours.fileno(), fcntl.F_GETFD)
+      fcntl.fcntl(ours.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+      argv = _worker_argv(worker, self.workers, theirs.fileno())
+      self.processes.append(subprocess.Popen(argv, stdin = devnull))
+      theirs.close()
+      self.channels.append(ours)
+    devnull.close()
+    log.info("Started %i OpenFlow worker processes", self.workers)
+
+  def run (self):
+    listener = _listen(self.address, self.port)
+    if listener is None:
+      return
+    flags = fcntl.fcntl(listener.fileno(), fcntl.F_GETFD)
+    fcntl.fcntl(listener.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+    while core.running:
+      channels = [c for c in self.channels if c is not None]
+      # Never wait on a worker; output for a busy one stays queued
+      rlist, wlist, elist = yield Select([listener] + channels +
+                                         list(self._pending),
+                                         [c for c in channels if c._out],
+                                         [], 5)
+      for channel in wlist:
+        channel.flush()
+      if len(rlist) == 0:
+        self._expire_handshakes()
+        continue
+
+      for sock in rlist:
+        if sock is listener:
+          self._accept(listener)
+        elif sock in self._pending:
+          self._handshake(sock)
+        else:
+          self._relay(self.channels.index(sock))
 
+    listener.close()
     log.debug("No longer listening for connections")
 
-    #pox.core.quit()
+  def _accept (self, listener):
+    while True:
+      try:
+        sock = listener.accept()[0]
+      except socket.error as e:
+        if e.args[0] in (EAGAIN, EWOULDBLOCK):
+          return
+        raise
+      self._pending[sock] = [b'', time.time()]
+      try:
+        sock.sendall(of.ofp_hello().pack() +
+                     of.ofp_features_request().pack())
+      except socket.error:
+        self._drop(sock)
+
+  def _drop (self, sock):
+    self._pending.pop(sock, None)
+    try:
+      sock.close()
+    except:
+      pass
+
+  def _expire_handshakes (self):
+    now = time.time()
+    for sock,(data,started) in self._pending.items():
+      if now - started > self.HANDSHAKE_TIMEOUT:
+        log.info("Switch didn't send its features in time")
+        self._drop(sock)
+
+  def _handshake (self, sock):
+    try:
+      d = sock.recv(65536)
+    except socket.error:
+      d = b''
+    if not d:
+      self._drop(sock)
+      return
+    state = self._pending[sock]
+    data = state[0] = state[0] + d
+
+    offset = 0
+    while len(data) - offset >= 8:
+      version, ofp_type, length = _ofp_header.unpack_from(data, offset)
+      if length < 8 or (version != of.OFP_VERSION and
+                        ofp_type != of.OFPT_HELLO):
+        log.warning("Bad OpenFlow message from switch; dropping it")
+        self._drop(sock)
+        return
+      if len(data) - offset < length: break
+      if ofp_type == of.OFPT_FEATURES_REPLY:
+        dpid = struct.unpack_from("!Q", data, offset + 8)[0]
+        self._hand_over(sock, dpid, data[offset:])
+        return
+      if ofp_type == of.OFPT_ECHO_REQUEST:
+        reply = bytearray(data[offset:offset+length])
+        reply[1] = of.OFPT_ECHO_REPLY
+        sock.sendall(bytes(reply))
+      offset += length
+    state[0] = data[offset:]
+
+  def _hand_over (self, sock, dpid, preamble):
+    worker = dpid % self.workers
+    channel = self.channels[worker]
+    del self._pending[sock]
+    if channel is None:
+      log.warning("Worker %i for switch %s has exited", worker,
+                  dpid_to_str(dpid))
+    else:
+      log.debug("Switch %s goes to worker %i", dpid_to_str(dpid), worker)
+      # The channel closes our copy of the socket once it's gone over
+      channel.send_socket(sock, "switch", preamble)
+      return
+    sock.close()
+
+  def _relay (self, worker):
+    """
+    Passes on everything a worker published to all the other workers
+    """
+    channel = self.channels[worker]
+    while True:
+      try:
+        msg = channel.recv()
+      except EOFError:
+        log.error("OpenFlow worker %i has exited", worker)
+        channel.close()
+        self.channels[worker] = None
+        return
+      if msg is None:
+        return
+      if msg[0] != "shared": continue
+      for other in self.channels:
+        if other is not None and other is not channel:
+          other.send("shared", worker, msg[1], msg[2])
 
 
 def _set_handlers ():
@@ -949,19 +1543,38 @@ def _set_handlers ():
 _set_handlers()
 
 
-# Used by the Connection class
-deferredSender = None
-
-def launch (port = 6633, address = "0.0.0.0"):
+def launch (port = 6633, address = "0.0.0.0", use_epoll = None,
+            workers = None, worker = None, channel = None):
+  """
+  Listens for OpenFlow 1.0 switches.  --use_epoll=False falls back to
+  select() over every connection.
+
+  --workers=N spreads the switches over N worker processes, each running
+  the rest of the command line too, so apps that handle each switch on
+  its own (like forwarding.l2_learning) can use more than one core.  Apps
+  in a worker only have the connections of that worker's switches; what
+  they need to know about the others has to go through openflow.shared,
+  which already carries switch and discovery link events.  (--worker and
+  --channel are set by the parent process for the workers.)
+  """
   if core.hasComponent('of_01'):
     return None
-
-  global deferredSender
-  deferredSender = DeferredSender()
+  if use_epoll is not None:
+    use_epoll = pox.lib.util.str_to_bool(use_epoll)
 
   if of._logger is None:
     of._logger = core.getLogger('libopenflow_01')
 
-  l = OpenFlow_01_Task(port = int(port), address = address)
+  if worker is not None:
+    channel = Channel.from_fd(int(channel))
+    core.register("openflow_shared",
+                  SharedState(channel, int(worker), int(workers)))
+    l = OpenFlow_01_Task(use_epoll = use_epoll, channel = channel)
+  elif workers is not None and int(workers) > 1:
+    l = OpenFlow_01_Distributor(port = int(port), address = address,
+                                workers = int(workers))
+  else:
+    l = OpenFlow_01_Task(port = int(port), address = address,
+                         use_epoll = use_epoll)
   core.register("of_01", l)
   return l
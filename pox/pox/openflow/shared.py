@@ -0,0 +1,262 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+State shared between the processes of a multi-process OpenFlow controller.
+
+With openflow.of_01 --workers=N, switches are spread over N worker
+processes, each running its own POX with its own copy of the apps.  The
+parent process relays whatever one worker publishes to all the others,
+and in each worker the openflow_shared component raises a SharedMessage
+event for everything it receives, e.g.:
+
+  core.openflow_shared.publish("host_moved", (mac, dpid, port))
+
+Some things are shared without any help from the apps:
+ - which switches are connected to other workers (.switches)
+ - links found by openflow.discovery, so that every worker sees the
+   whole topology and not just the links between its own switches
+
+Messages are pickled and each has to fit in one packet on a Unix socket
+(a bit over 200 KB on Linux by default).
+"""
+
+from pox.core import core
+from pox.lib.revent import EventMixin, Event
+import socket
+import os
+import threading
+import cPickle as pickle
+import _multiprocessing
+from collections import deque
+from errno import EAGAIN, EWOULDBLOCK, EMSGSIZE
+
+log = core.getLogger()
+
+
+class Channel (object):
+  """
+  One end of the SOCK_SEQPACKET socket pair between the parent and a
+  worker
+
+  Every message is a tuple, pickled into one packet.  A socket handed over
+  to the worker follows the message announcing it, as a packet of its own.
+
+  Sending never blocks, so neither end can get stuck waiting on the other:
+  packets the socket won't take are queued until flush() is called when
+  it is writable.  In a worker, io_task is the OpenFlow task, which is told
+  when output starts queueing, as for a switch connection.
+  """
+  MAX_MESSAGE = 256 * 1024
+
+  def __init__ (self, sock):
+    self.sock = sock
+    sock.setblocking(0)
+    # Packets waiting to be sent: strings, or sockets to pass over
+    self._out = deque()
+    self._out_lock = threading.Lock()
+    self.io_task = None
+
+  @classmethod
+  def pair (cls):
+    a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    return cls(a), cls(b)
+
+  @classmethod
+  def from_fd (cls, fd):
+    sock = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    os.close(fd)
+    return cls(sock)
+
+  def fileno (self):
+    return self.sock.fileno()
+
+  def send (self, *msg):
+    self._queue(pickle.dumps(msg, pickle.HIGHEST_PROTOCOL))
+
+  def send_socket (self, sock, *msg):
+    """
+    Sends msg, followed by sock, which is closed here once it's been sent
+    """
+    self._queue(pickle.dumps(msg, pickle.HIGHEST_PROTOCOL), sock)
+
+  def _queue (self, *packets):
+    with self._out_lock:
+      was_empty = not self._out
+      self._out.extend(packets)
+      if was_empty:
+        self._flush()
+      queued = was_empty and self._out
+    if queued and self.io_task is not None:
+      self.io_task._output_queued(self)
+
+  def flush (self):
+    """
+    Sends queued packets until there are none left or the socket is full
+
+    Always returns True; if the other end has gone away, the queue is just
+    thrown away and recv() reports it.
+    """
+    with self._out_lock:
+      self._flush()
+    return True
+
+  def _flush (self):
+    out = self._out
+    while out:
+      packet = out[0]
+      try:
+        if isinstance(packet, bytes):
+          self.sock.send(packet)
+        else:
+          _multiprocessing.sendfd(self.sock.fileno(), packet.fileno())
+      except (socket.error, OSError) as e:
+        if e.args[0] in (EAGAIN, EWOULDBLOCK):
+          return
+        if e.args[0] == EMSGSIZE:
+          log.error("Message of %i bytes is too big for the channel",
+                    len(packet))
+          out.popleft()
+          if out and not isinstance(out[0], bytes):
+            # It was announcing this socket
+            out.popleft().close()
+          continue
+        self._clear()
+        return
+      out.popleft()
+      if not isinstance(packet, bytes):
+        # The other process has its own copy now
+        packet.close()
+
+  def _clear (self):
+    for packet in self._out:
+      if not isinstance(packet, bytes):
+        packet.close()
+    self._out.clear()
+
+  def recv (self):
+    """
+    The next message, or None if there isn't one waiting
+
+    Raises EOFError once the other end has been closed.
+    """
+    try:
+      data = self.sock.recv(self.MAX_MESSAGE, socket.MSG_DONTWAIT)
+    except socket.error as e:
+      if e.args[0] in (EAGAIN, EWOULDBLOCK):
+        return None
+      raise EOFError(str(e))
+    if not data:
+      raise EOFError("channel closed")
+    return pickle.loads(data)
+
+  def recv_socket (self):
+    """
+    The TCP socket sent after the message just received, or None if it
+    hasn't arrived yet
+    """
+    try:
+      fd = _multiprocessing.recvfd(self.sock.fileno())
+    except OSError as e:
+      if e.args[0] in (EAGAIN, EWOULDBLOCK):
+        return None
+      raise EOFError(str(e))
+    sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+    os.close(fd)
+    return sock
+
+  def close (self):
+    with self._out_lock:
+      self._clear()
+    try:
+      self.sock.close()
+    except:
+      pass
+
+
+class SharedMessage (Event):
+  """
+  Raised for every message published by another worker
+
+  worker (int) - the worker which published it
+  topic (str) - what the message is about
+  data - whatever was published
+  """
+  def __init__ (self, worker, topic, data):
+    Event.__init__(self)
+    self.worker = worker
+    self.topic = topic
+    self.data = data
+
+
+class SharedState (EventMixin):
+  """
+  A worker's end of the shared-state channel
+
+  Registered as core.openflow_shared in worker processes.
+  """
+  _eventMixin_events = set([
+    SharedMessage,
+  ])
+
+  def __init__ (self, channel, worker, workers):
+    self.channel = channel
+    self.worker = worker
+    self.workers = workers
+    # DPID -> worker, for the switches connected to other workers
+    self.switches = {}
+    core.addListeners(self)
+
+  def _handle_GoingUpEvent (self, event):
+    # Every component has been launched by now
+    core.openflow.addListeners(self, prefix="openflow")
+    if core.hasComponent("openflow_discovery"):
+      core.openflow_discovery.addListeners(self, prefix="openflow_discovery")
+
+  def publish (self, topic, data = None):
+    """
+    Sends a message to every other worker
+    """
+    self.channel.send("shared", topic, data)
+
+  def _handle_openflow_ConnectionUp (self, event):
+    self.publish("switch_up", event.dpid)
+
+  def _handle_openflow_ConnectionDown (self, event):
+    self.publish("switch_down", event.dpid)
+
+  def _handle_openflow_discovery_LinkEvent (self, event):
+    # Only pass on links found here; the rest came from other workers
+    if event.remote: return
+    self.publish("link", (event.added, tuple(event.link)))
+
+  def _receive (self, worker, topic, data):
+    """
+    Handles a message relayed from another worker
+    """
+    discovery = core.components.get("openflow_discovery")
+    if topic == "switch_up":
+      self.switches[data] = worker
+    elif topic == "switch_down":
+      # Ignore a late switch_down from a worker the switch has since left
+      if self.switches.get(data) == worker:
+        del self.switches[data]
+        if discovery is not None:
+          discovery.remove_switch_links(data)
+    elif topic == "link" and discovery is not None:
+      added, link = data
+      link = discovery.Link(*link)
+      if added:
+        discovery.add_remote_link(link)
+      else:
+        discovery.remove_remote_link(link)
+    self.raiseEventNoErrors(SharedMessage, worker, topic, data)
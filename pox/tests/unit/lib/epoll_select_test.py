@@ -26,7 +26,7 @@ from copy import copy
 
 sys.path.append(os.path.dirname(__file__) + "/../../..")
 
-from pox.lib.epoll_select import EpollSelect
+from pox.lib.epoll_select import EpollSelect, EpollRegistry
 
 class TCPEcho(SocketServer.StreamRequestHandler):
   def handle(self):
@@ -100,5 +100,70 @@ class EpollSelectTest(unittest.TestCase):
       check( ([],[],[]), self.es.select(sockets, [], sockets, 0))
       check( ([],sockets,[]), self.es.select(sockets, sockets, sockets, 0))
 
+@unittest.skipUnless(sys.platform.startswith("linux"), "requires Linux")
+class EpollRegistryTest(unittest.TestCase):
+  def setUp(self):
+    self.registry = EpollRegistry()
+    self.pairs = [socket.socketpair() for _ in range(3)]
+    for (a, b) in self.pairs:
+      self.registry.register(a)
+
+  def tearDown(self):
+    self.registry.close()
+    for (a, b) in self.pairs:
+      a.close()
+      b.close()
+
+  def test_only_ready_reported(self):
+    self.assertEqual([], self.registry.poll(0))
+    a, b = self.pairs[1]
+    b.send("x")
+    ready = self.registry.poll(0.1)
+    self.assertEqual([a], [obj for (obj, event) in ready])
+    self.assertTrue(ready[0][1] & EpollRegistry.READ)
+
+  def test_edge_triggered(self):
+    a, b = self.pairs[0]
+    b.send("x")
+    self.assertEqual(1, len(self.registry.poll(0.1)))
+    # not drained, but no new edge either
+    self.assertEqual([], self.registry.poll(0))
+    b.send("y")
+    self.assertEqual(1, len(self.registry.poll(0.1)))
+
+  def test_registry_fd_readable(self):
+    import select
+    self.assertEqual([], select.select([self.registry], [], [], 0)[0])
+    self.pairs[2][1].send("x")
+    self.assertEqual([self.registry], select.select([self.registry], [], [], 0.1)[0])
+
+  def test_unregister(self):
+    a, b = self.pairs[0]
+    self.registry.unregister(a)
+    self.registry.unregister(a)
+    self.assertEqual(2, len(self.registry))
+    self.assertFalse(a in self.registry)
+    b.send("x")
+    self.assertEqual([], self.registry.poll(0.1))
+
+  def test_unregister_after_close(self):
+    a, b = self.pairs[0]
+    a.close()
+    self.registry.unregister(a)
+    self.assertEqual(2, len(self.registry))
+
+  def test_reused_fd(self):
+    a, b = self.pairs[0]
+    fd = a.fileno()
+    a.close()
+    c, d = socket.socketpair()
+    self.pairs.append((c, d))
+    if c.fileno() != fd:
+      return
+    self.registry.register(c)
+    self.assertFalse(a in self.registry)
+    d.send("x")
+    self.assertEqual([c], [obj for (obj, event) in self.registry.poll(0.1)])
+
 if __name__ == '__main__':
   unittest.main()
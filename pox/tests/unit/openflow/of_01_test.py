@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import socket
+import random
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.of_01 as of_01
+
+class connection_read_test (unittest.TestCase):
+  """
+  Message framing of Connection.read() over a real socket pair
+  """
+  def setUp (self):
+    self._old_handlers = list(of_01.handlers)
+    self.received = []
+    handler = lambda con, msg: self.received.append(msg.pack())
+    of_01.handlers[:] = [handler] * len(of_01.handlers)
+
+    self.sock, self.peer = socket.socketpair()
+    self.sock.setblocking(0)
+    self.con = of_01.Connection(self.sock)
+    hello = self.peer.recv(100)
+    self.assertEqual(of.OFPT_HELLO, ord(hello[1]))
+
+  def tearDown (self):
+    of_01.handlers[:] = self._old_handlers
+    self.sock.close()
+    self.peer.close()
+
+  def test_split_and_coalesced (self):
+    msgs = [of.ofp_echo_request(xid=1).pack(),
+            of.ofp_packet_in(in_port=2, data='x' * 100).pack(),
+            of.ofp_echo_reply(xid=3, body='y' * 5000).pack(),
+            of.ofp_barrier_reply(xid=4).pack()]
+    rng = random.Random(0)
+    stream = [rng.choice(msgs) for _ in range(500)]
+    data = ''.join(stream)
+    pos = 0
+    while pos < len(data):
+      n = rng.choice([1, 3, 8, 100, 4000, 20000])
+      self.peer.sendall(data[pos:pos+n])
+      pos += n
+      self.assertTrue(self.con.read())
+    self.assertEqual(stream, self.received)
+
+  def test_burst_grows_buffer (self):
+    msg = of.ofp_echo_reply(body='z' * 60000).pack()
+    self.peer.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+    for _ in range(3):
+      self.peer.sendall(msg)
+    while len(self.received) < 3:
+      self.assertTrue(self.con.read())
+    self.assertEqual([msg] * 3, self.received)
+    self.assertTrue(len(self.con._rbuf) > of_01.Connection.RECV_BUFFER_MIN)
+
+  def test_nothing_to_read (self):
+    self.assertTrue(self.con.read())
+    self.assertEqual([], self.received)
+
+  def test_closed (self):
+    self.peer.sendall(of.ofp_echo_request().pack())
+    self.peer.close()
+    self.assertFalse(self.con.read())
+    self.assertEqual(1, len(self.received))
+
+  def test_bad_version (self):
+    msg = bytearray(of.ofp_echo_request().pack())
+    msg[0] = 0x04
+    self.peer.sendall(str(msg))
+    self.assertFalse(self.con.read())
+
+
+class connection_send_test (unittest.TestCase):
+  """
+  Output queueing of Connection.send() when the socket is full
+  """
+  def setUp (self):
+    self.sock, self.peer = socket.socketpair()
+    self.sock.setblocking(0)
+    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    self.con = of_01.Connection(self.sock)
+    self.pressure = []
+    self.con.addListener(of_01.SendBackpressure,
+                         lambda e: self.pressure.append(e.congested))
+    self.peer.recv(100)
+
+  def tearDown (self):
+    self.sock.close()
+    self.peer.close()
+
+  def _receive (self, size):
+    self.peer.settimeout(1)
+    data = []
+    while size > 0:
+      self.con.flush()
+      chunk = self.peer.recv(min(size, 65536))
+      data.append(chunk)
+      size -= len(chunk)
+    return ''.join(data)
+
+  def test_queued_in_order (self):
+    msgs = [of.ofp_echo_request(xid=i, body='x' * 1000).pack()
+            for i in range(200)]
+    for msg in msgs:
+      self.con.send(msg)
+    self.assertTrue(self.con.send_queued > 0)
+    data = self._receive(sum(len(m) for m in msgs))
+    self.assertEqual(''.join(msgs), data)
+    self.assertEqual(0, self.con.send_queued)
+
+  def test_backpressure (self):
+    msg = of.ofp_echo_request(body='x' * 60000).pack()
+    count = of_01.Connection.SEND_HIGH_WATER // len(msg) + 2
+    for _ in range(count):
+      self.con.send(msg)
+    self.assertEqual([True], self.pressure)
+    self.assertTrue(self.con.congested)
+    self._receive(len(msg) * count)
+    self.assertEqual([True, False], self.pressure)
+    self.assertFalse(self.con.congested)
+
+  def test_closed_peer (self):
+    self.peer.close()
+    self.con.send(of.ofp_echo_request().pack())
+    self.con.send(of.ofp_echo_request().pack())
+    self.assertTrue(self.con.disconnected)
+    self.assertEqual(0, self.con.send_queued)
+
+
+class CountingSocket (object):
+  """
+  Wraps a socket, counting send() calls
+  """
+  def __init__ (self, sock):
+    self.sock = sock
+    self.sends = 0
+  def send (self, data):
+    self.sends += 1
+    return self.sock.send(data)
+  def __getattr__ (self, name):
+    return getattr(self.sock, name)
+
+
+class connection_batch_test (unittest.TestCase):
+  """
+  Coalescing of sends by Connection.batch() and per event cycle
+  """
+  def setUp (self):
+    self.sock, self.peer = socket.socketpair()
+    self.sock.setblocking(0)
+    self.peer.settimeout(1)
+    self.counter = CountingSocket(self.sock)
+    self.task = of_01.OpenFlow_01_Task(port = 0)
+    self.con = of_01.Connection(self.counter, self.task)
+    self.peer.recv(100)
+    self.counter.sends = 0
+    self.msgs = [of.ofp_flow_mod(xid=i).pack() for i in range(50)]
+
+  def tearDown (self):
+    self.sock.close()
+    self.peer.close()
+
+  def _receive (self, size):
+    data = ''
+    while len(data) < size:
+      data += self.peer.recv(size - len(data))
+    return data
+
+  def test_batch (self):
+    with self.con.batch():
+      with self.con.batch():
+        for msg in self.msgs[:10]:
+          self.con.send(msg)
+      for msg in self.msgs[10:]:
+        self.con.send(msg)
+      self.assertEqual(0, self.counter.sends)
+    self.assertEqual(1, self.counter.sends)
+    data = ''.join(self.msgs)
+    self.assertEqual(data, self._receive(len(data)))
+
+  def test_cycle (self):
+    self.task._begin_cycle()
+    for msg in self.msgs:
+      self.con.send(msg)
+    self.assertEqual(0, self.counter.sends)
+    self.task._end_cycle()
+    self.assertEqual(1, self.counter.sends)
+    data = ''.join(self.msgs)
+    self.assertEqual(data, self._receive(len(data)))
+
+  def test_unbatched (self):
+    for msg in self.msgs[:3]:
+      self.con.send(msg)
+    self.assertEqual(3, self.counter.sends)
+
+
+class connection_preamble_test (unittest.TestCase):
+  """
+  A Connection taking over a switch whose handshake began elsewhere
+  """
+  def test_features_reply (self):
+    # Connections need an OpenFlow nexus to join
+    import pox.openflow
+    pox.openflow.launch()
+    sock, peer = socket.socketpair()
+    sock.setblocking(0)
+    peer.settimeout(2)
+    features = of.ofp_features_reply(datapath_id=42, xid=0).pack()
+    con = of_01.Connection(sock, preamble = features)
+    self.assertEqual(42, con.dpid)
+    self.assertFalse(con.disconnected)
+    # No HELLO this time; the set_config/barrier exchange starts right away
+    types = []
+    data = peer.recv(4096)
+    while data:
+      types.append(ord(data[1]))
+      data = data[ord(data[2]) * 256 + ord(data[3]):]
+    self.assertFalse(of.OFPT_HELLO in types)
+    self.assertTrue(of.OFPT_BARRIER_REQUEST in types)
+    con.close()
+    peer.close()
+
+
+class worker_argv_test (unittest.TestCase):
+  def setUp (self):
+    self._argv = sys.argv
+
+  def tearDown (self):
+    sys.argv = self._argv
+
+  def test_rewrite (self):
+    sys.argv = ["pox.py", "log.level", "--DEBUG", "openflow.of_01",
+                "--port=6634", "--workers=4", "--use-epoll=False",
+                "forwarding.l2_learning"]
+    argv = of_01._worker_argv(2, 4, 9)
+    self.assertEqual([sys.executable, "pox.py", "log.level", "--DEBUG",
+                      "openflow.of_01", "--use-epoll=False", "--worker=2",
+                      "--workers=4", "--channel=9", "forwarding.l2_learning"],
+                     argv)
+
+
+class output_queued_test (unittest.TestCase):
+  """
+  Where the select() loop learns about connections with queued output
+  """
+  def setUp (self):
+    import pox.lib.util
+    self.task = of_01.OpenFlow_01_Task(port = 0, use_epoll = False)
+    self.task._pinger = pox.lib.util.make_pinger()
+
+  def test_loop_thread (self):
+    self.task._loop_thread = of_01.get_ident()
+    self.task._output_queued("con")
+    self.assertEqual(set(["con"]), self.task._writers)
+
+  def test_other_thread (self):
+    import select
+    self.task._loop_thread = -1
+    self.task._output_queued("con")
+    # Left to the loop, which gets pinged
+    self.assertEqual(set(), self.task._writers)
+    self.assertTrue(select.select([self.task._pinger], [], [], 0)[0])
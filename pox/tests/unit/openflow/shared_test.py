@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import socket
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+from pox.core import core
+from pox.openflow.shared import Channel, SharedState, SharedMessage
+from pox.openflow.discovery import Link
+
+class channel_test (unittest.TestCase):
+  def setUp (self):
+    self.a, self.b = Channel.pair()
+
+  def tearDown (self):
+    self.a.close()
+    self.b.close()
+
+  def test_messages (self):
+    self.assertEqual(None, self.b.recv())
+    self.a.send("shared", "topic", {"x": [1, 2]})
+    self.a.send("switch", "x" * 100000)
+    self.assertEqual(("shared", "topic", {"x": [1, 2]}), self.b.recv())
+    self.assertEqual(("switch", "x" * 100000), self.b.recv())
+    self.assertEqual(None, self.b.recv())
+
+  def test_socket (self):
+    s1, s2 = socket.socketpair()
+    self.a.send_socket(s1, "switch", "preamble")
+    s1.close()
+    self.assertEqual(("switch", "preamble"), self.b.recv())
+    s3 = self.b.recv_socket()
+    s3.sendall("ping")
+    self.assertEqual("ping", s2.recv(4))
+    s2.close()
+    s3.close()
+
+  def test_closed (self):
+    self.a.close()
+    self.assertRaises(EOFError, self.b.recv)
+
+  def test_queued (self):
+    # Far more than the socket holds; sending mustn't block
+    for i in range(2000):
+      self.a.send("shared", i)
+    self.assertTrue(self.a._out)
+    got = []
+    while len(got) < 2000:
+      self.a.flush()
+      msg = self.b.recv()
+      while msg is not None:
+        got.append(msg[1])
+        msg = self.b.recv()
+    self.assertEqual(range(2000), got)
+    self.assertFalse(self.a._out)
+
+  def test_socket_queued (self):
+    for i in range(500):
+      self.a.send("shared", i)
+    s1, s2 = socket.socketpair()
+    self.a.send_socket(s1, "switch", "preamble")
+    msgs = []
+    sock = None
+    while sock is None:
+      self.a.flush()
+      if msgs and msgs[-1][0] == "switch":
+        # The socket follows its message
+        sock = self.b.recv_socket()
+        continue
+      msg = self.b.recv()
+      if msg is not None:
+        msgs.append(msg)
+    self.assertEqual(501, len(msgs))
+    sock.sendall("ping")
+    self.assertEqual("ping", s2.recv(4))
+    sock.close()
+    s2.close()
+
+
+class relay_test (unittest.TestCase):
+  """
+  The parent relaying bursts between workers which aren't reading
+  """
+  def test_burst (self):
+    import pox.openflow.of_01 as of_01
+    dist = of_01.OpenFlow_01_Distributor(workers = 2)
+    pairs = [Channel.pair() for _ in range(2)]
+    dist.channels = [p[0] for p in pairs]
+    workers = [p[1] for p in pairs]
+    for w in workers:
+      for i in range(1000):
+        w.send("shared", "topic", i)
+
+    got = [[], []]
+    while len(got[0]) < 1000 or len(got[1]) < 1000:
+      for i,w in enumerate(workers):
+        dist._relay(i)
+        dist.channels[i].flush()
+        w.flush()
+        msg = w.recv()
+        while msg is not None:
+          got[i].append(msg[3])
+          msg = w.recv()
+    self.assertEqual([range(1000), range(1000)], got)
+    for a,b in pairs:
+      a.close()
+      b.close()
+
+
+class FakeDiscovery (object):
+  Link = Link
+  def __init__ (self):
+    self.calls = []
+  def add_remote_link (self, link):
+    self.calls.append(("add", link))
+  def remove_remote_link (self, link):
+    self.calls.append(("remove", link))
+  def remove_switch_links (self, dpid):
+    self.calls.append(("switch", dpid))
+
+
+class shared_state_test (unittest.TestCase):
+  def setUp (self):
+    self.parent, self.child = Channel.pair()
+    self.shared = SharedState(self.child, 1, 3)
+    self.events = []
+    self.shared.addListener(SharedMessage, self.events.append)
+    self.discovery = FakeDiscovery()
+    core.components["openflow_discovery"] = self.discovery
+
+  def tearDown (self):
+    del core.components["openflow_discovery"]
+    self.parent.close()
+    self.child.close()
+
+  def test_publish (self):
+    self.shared.publish("hosts", [1, 2])
+    self.assertEqual(("shared", "hosts", [1, 2]), self.parent.recv())
+
+  def test_switches (self):
+    self.shared._receive(2, "switch_up", 7)
+    self.assertEqual({7: 2}, self.shared.switches)
+    self.shared._receive(0, "switch_down", 7)
+    self.assertEqual({7: 2}, self.shared.switches)
+    self.shared._receive(2, "switch_down", 7)
+    self.assertEqual({}, self.shared.switches)
+    # Only the switch's own worker takes its links away
+    self.assertEqual([("switch", 7)], self.discovery.calls)
+    self.assertEqual(["switch_up", "switch_down", "switch_down"],
+                     [e.topic for e in self.events])
+
+  def test_links (self):
+    self.shared._receive(0, "link", (True, (1, 2, 3, 4)))
+    self.shared._receive(0, "link", (False, (1, 2, 3, 4)))
+    self.assertEqual([("add", Link(1, 2, 3, 4)), ("remove", Link(1, 2, 3, 4))],
+                     self.discovery.calls)
@@ -6,5 +6,6 @@ util/install.sh -a
 cd ../fellyjish
 sudo apt install python-pip
 sudo pip install networkx
+sudo pip install numpy
 sudo pip install matplotlib
 
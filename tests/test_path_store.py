@@ -0,0 +1,59 @@
+import os
+import random
+import sys
+import unittest
+
+from topology import generate_topology, TopologyEditor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pox'))
+from pox.ext.jelly_paths import PathStore, SwitchGraph
+
+
+def path_lengths(store):
+    """
+    The sorted path lengths of every pair; ties may give a recomputed pair
+    other paths of the same lengths.
+    """
+    lengths = store.paths.lengths().tolist()
+    offsets = store.pair_offsets.tolist()
+    return [sorted(lengths[offsets[p]:offsets[p + 1]]) for p in range(store.n * store.n)]
+
+
+class UpdateTest(unittest.TestCase):
+
+    def check_updates(self, algorithm, k=4, steps=48):
+        topo = generate_topology(24, 12, 5, seed=2)
+        store = PathStore.compute(topo, algorithm, k)
+        editor = TopologyEditor(topo, seed=5)
+        rng = random.Random(1)
+        for step in range(steps):
+            edit = rng.choice(['add_switch', 'add_server', 'fail_link', 'fail_switch'])
+            try:
+                if edit == 'add_switch':
+                    editor.add_switch(n_servers=1)
+                elif edit == 'add_server':
+                    editor.add_server(rng.randrange(topo['n_switches']))
+                elif edit == 'fail_link' and editor.wiring.links:
+                    editor.fail_link(*rng.choice(editor.wiring.links))
+                elif edit == 'fail_switch' and step % 12 == 0:
+                    editor.fail_switch(rng.randrange(topo['n_switches']))
+            except ValueError:
+                # no port left on that switch for a server
+                pass
+
+            added, removed = editor.take_changes()
+            graph = SwitchGraph.from_topo(topo)
+            store = store.update(graph, added, removed)
+            full = PathStore.compute(topo, algorithm, k)
+            self.assertTrue(store.matches(graph, algorithm, k))
+            self.assertEqual(path_lengths(store), path_lengths(full), "%s after step %d" % (edit, step))
+
+    def test_ecmp(self):
+        self.check_updates('ecmp')
+
+    def test_kshort(self):
+        self.check_updates('kshort')
+
+
+if __name__ == '__main__':
+    unittest.main()
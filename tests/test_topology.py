@@ -0,0 +1,49 @@
+import unittest
+
+from topology import generate_topology, TopologyEditor
+
+
+class FailLinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.topo = generate_topology(20, 10, 6, seed=1)
+
+    def failed_link(self, editor):
+        x, y = sorted(editor.wiring.links)[0]
+        editor.fail_link(x, y)
+        return 's'+str(x), 's'+str(y)
+
+    def other_switch(self, editor, x, y):
+        # a new server there breaks one of its links, leaving four open ports
+        return max(sw for sw in range(self.topo['n_switches'])
+                   if 's'+str(sw) not in (x, y) and editor.wiring.adj[sw])
+
+    def test_stays_down(self):
+        for seed in range(50):
+            self.setUp()
+            editor = TopologyEditor(self.topo, seed=seed)
+            x, y = self.failed_link(editor)
+            editor.add_server(self.other_switch(editor, x, y))
+            self.assertFalse(self.topo['graph'].has_edge(x, y))
+            editor.add_switch(n_servers=1)
+            self.assertFalse(self.topo['graph'].has_edge(x, y))
+            self.assertNotIn((x, y), self.topo['outport_mappings'])
+
+    def test_stays_down_for_new_editor(self):
+        x, y = self.failed_link(TopologyEditor(self.topo, seed=0))
+        for seed in range(20):
+            editor = TopologyEditor(self.topo, seed=seed)
+            editor.add_server(self.other_switch(editor, x, y))
+            self.assertFalse(self.topo['graph'].has_edge(x, y))
+
+    def test_failed_switch_for_new_editor(self):
+        editor = TopologyEditor(self.topo, seed=0)
+        editor.fail_switch(3)
+        for seed in range(10):
+            TopologyEditor(self.topo, seed=seed).add_switch(n_servers=1)
+        self.assertEqual(list(self.topo['graph'].neighbors('s3')),
+                         [h for h in self.topo['graph'].neighbors('s3') if h[0] == 'h'])
+
+
+if __name__ == '__main__':
+    unittest.main()
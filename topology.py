@@ -1,5 +1,4 @@
 import argparse
-import copy
 import networkx as nx
 import os
 import pickle
@@ -13,14 +12,22 @@ from subprocess import Popen
 RNG_SEED = 0xBAEF
 
 
-def generate_topology(n_servers, n_switches, n_ports, debug=False):
-
+def generate_topology(n_servers, n_switches, n_ports, debug=False, seed=None):
+    """
+    A random Jellyfish topology. The wiring is drawn from its own
+    random.Random(seed), so a seed always gives the same topology whatever
+    else uses the global random state. Without a seed one is drawn, and
+    either way it is kept in topo['seed'].
+    """
     if debug:
-        random.seed(RNG_SEED)
+        seed = RNG_SEED
+    elif seed is None:
+        seed = random.randrange(2 ** 32)
+    rng = random.Random(seed)
 
     sys.stdout.write("Generating Fellyjish topology: %d servers, %d switches, %d ports per switch..." % (n_servers, n_switches, n_ports))
 
-    topo = {}
+    topo = {'seed': seed}
 
     G = nx.Graph()
     topo["graph"] = G
@@ -46,60 +53,336 @@ def generate_topology(n_servers, n_switches, n_ports, debug=False):
             i += n_switches
             open_ports[sw] -= 1
 
-    start_open_ports = copy.deepcopy(open_ports)
-    
     topo['outport_mappings'] = outport_mappings
+
     # randomly link the remaining open ports
-    links = defaultdict(list)
-    while sum(open_ports) > 1:
-        open_switches = [x for x in range(n_switches) if open_ports[x] > 0]
-        if len(open_switches) == 1: # special case with two ports remaining on same switch
-            curr = open_switches[0]
-            if open_ports[curr] >= 2:
-                other_switches = [s for s in range(n_switches) if s != curr]
-                x = 's'+str(random.choice(other_switches))
-                y = random.choice(list(nx.all_neighbors(G, x)))
-                G.remove_edge(x, y)
-                x_port = outport_mappings.pop((x, y))
-                y_port = outport_mappings.pop((y, x))
-                G.add_edge(x, 's'+str(curr))
-                G.add_edge(y, 's'+str(curr))
-                outport_mappings[(x, 's'+str(curr))] = x_port
-                outport_mappings[('s'+str(curr), x)] = open_ports[curr]
-                outport_mappings[(y, 's'+str(curr))] = y_port
-                outport_mappings[('s'+str(curr), y)] = open_ports[curr] - 1
-                open_ports[curr] -= 2
-                continue
-
-        start_over = False
-        while True:
-            x = random.choice(open_switches)
-            x_name = 's'+str(x)
-            unconnected_switches = [s for s in open_switches if ('s'+str(s) not in list(G.neighbors(x_name)) and s != x)]
-            if len(unconnected_switches) == 0:
-                no_new_links = True
-                for os in open_switches:
-                    for os2 in open_switches:
-                        if os != os2:
-                            no_new_links = no_new_links and 's'+str(os2) in list(G.neighbors('s'+str(os)))
-                if no_new_links:
-                    start_over = True
-                    break
-            else:
-                break
-        
-        if start_over:
-            open_ports = copy.deepcopy(start_open_ports)
-            G = nx.create_empty_copy(G)
-            continue
-
-        y = random.choice(unconnected_switches)
-        open_ports[x] -= 1
-        open_ports[y] -= 1
-        G.add_edge('s'+str(x), 's'+str(y))
-        outport_mappings[('s'+str(x), 's'+str(y))] = open_ports[x] + 1
-        outport_mappings[('s'+str(y), 's'+str(x))] = open_ports[y] + 1
+    wiring = _SwitchWiring([list(range(1, n + 1)) for n in open_ports], outport_mappings, rng)
+    wiring.link_open_ports()
+
+    G.add_edges_from(('s'+str(x), 's'+str(y)) for (x, y) in wiring.links)
 
     sys.stdout.write(" done\n")
     return topo
 
+
+class _SwitchWiring(object):
+    """
+    Switch-to-switch links under construction. Adjacency is kept in sets, and
+    both the links and the switches with open ports are kept in lists with a
+    position index, so random choice and removal are O(1).
+
+    free_ports[sw] lists the port numbers still open on switch sw; ports are
+    taken from the end of the list. Every random choice is drawn from rng.
+    """
+
+    def __init__(self, free_ports, outport_mappings, rng):
+        self.rng = rng
+        self.free_ports = free_ports
+        self.n_open_ports = sum(len(ports) for ports in free_ports)
+        self.outport_mappings = outport_mappings
+        self.adj = [set() for _ in free_ports]
+
+        self.links = []
+        self.link_index = {}
+        self.open_switches = [sw for sw in range(len(free_ports)) if free_ports[sw]]
+        self.open_index = dict((sw, i) for i, sw in enumerate(self.open_switches))
+
+    def linkable(self, x, y):
+        return x != y and y not in self.adj[x]
+
+    @staticmethod
+    def _remove(items, index, item):
+        i = index.pop(item)
+        last = items.pop()
+        if i < len(items):
+            items[i] = last
+            index[last] = i
+
+    def take_port(self, sw):
+        port = self.free_ports[sw].pop()
+        self.n_open_ports -= 1
+        if not self.free_ports[sw]:
+            self._remove(self.open_switches, self.open_index, sw)
+        return port
+
+    def release_port(self, sw, port):
+        if not self.free_ports[sw]:
+            self.open_index[sw] = len(self.open_switches)
+            self.open_switches.append(sw)
+        self.free_ports[sw].append(port)
+        self.n_open_ports += 1
+
+    def connect(self, x, y, x_port, y_port):
+        self.adj[x].add(y)
+        self.adj[y].add(x)
+        self.link_index[(min(x, y), max(x, y))] = len(self.links)
+        self.links.append((min(x, y), max(x, y)))
+        self.outport_mappings[('s'+str(x), 's'+str(y))] = x_port
+        self.outport_mappings[('s'+str(y), 's'+str(x))] = y_port
+
+    def disconnect(self, x, y):
+        """
+        Removes the link and returns the ports it freed on x and y.
+        """
+        self.adj[x].discard(y)
+        self.adj[y].discard(x)
+        self._remove(self.links, self.link_index, (min(x, y), max(x, y)))
+        return (self.outport_mappings.pop(('s'+str(x), 's'+str(y))),
+                self.outport_mappings.pop(('s'+str(y), 's'+str(x))))
+
+    def random_open_pair(self):
+        """
+        Two distinct, not yet linked switches with open ports, or None if
+        there are none.
+        """
+        open_switches = self.open_switches
+        if len(open_switches) < 2:
+            return None
+
+        for _ in range(8):
+            x, y = self.rng.choice(open_switches), self.rng.choice(open_switches)
+            if self.linkable(x, y):
+                return x, y
+
+        # sampling keeps failing once few open switches are left, so look at
+        # every remaining pair
+        candidates = [(x, y) for i, x in enumerate(open_switches) for y in open_switches[i+1:]
+                      if self.linkable(x, y)]
+        return self.rng.choice(candidates) if candidates else None
+
+    def _random_link(self, fits):
+        """
+        A random link (x, y) for which fits(x, y) holds, in either orientation.
+        """
+        for _ in range(64):
+            x, y = self.rng.choice(self.links)
+            if self.rng.random() < 0.5:
+                x, y = y, x
+            if fits(x, y):
+                return x, y
+
+        candidates = [(x, y) for (a, b) in self.links for (x, y) in ((a, b), (b, a)) if fits(x, y)]
+        return self.rng.choice(candidates) if candidates else None
+
+    def swap_in_open_ports(self):
+        """
+        Used once the open switches are all linked to each other: breaks a
+        random link (x, y) and relinks both ends to open switches instead.
+        Returns False if no link can be broken that way.
+        """
+        if not self.links:
+            return False
+
+        multi = [sw for sw in self.open_switches if len(self.free_ports[sw]) >= 2]
+        if multi:
+            s = self.rng.choice(multi)
+            s1, s2 = s, s
+        else:
+            s1, s2 = self.rng.sample(self.open_switches, 2)
+
+        link = self._random_link(lambda x, y: self.linkable(s1, x) and self.linkable(s2, y))
+        if link is None:
+            return False
+
+        x, y = link
+        x_port, y_port = self.disconnect(x, y)
+        self.connect(x, s1, x_port, self.take_port(s1))
+        self.connect(y, s2, y_port, self.take_port(s2))
+        return True
+
+    def link_open_ports(self):
+        """
+        Randomly links open ports to each other until at most one is left or
+        no link can be rewired to absorb the rest.
+        """
+        while self.n_open_ports > 1:
+            pair = self.random_open_pair()
+            if pair is not None:
+                x, y = pair
+                self.connect(x, y, self.take_port(x), self.take_port(y))
+            elif not self.swap_in_open_ports():
+                break
+
+
+class _EditedWiring(_SwitchWiring):
+    """
+    The wiring of an existing topology, which keeps its graph in step and
+    records every switch link that is added or removed.
+
+    Failed links and switches are kept in the topo dict, so that no later
+    editor wires them back in: a failed link's two switches are never
+    linked again, and a failed switch has no free ports.
+    """
+
+    def __init__(self, topo, rng):
+        n_ports = topo['n_ports']
+        self.failed_links = topo.setdefault('failed_links', set())
+        self.failed_switches = topo.setdefault('failed_switches', set())
+        used = defaultdict(set)
+        for (a, b), port in topo['outport_mappings'].items():
+            if a[0] == 's':
+                used[int(a[1:])].add(port)
+        free_ports = [[] if sw in self.failed_switches else
+                      sorted(set(range(1, n_ports + 1)) - used[sw], reverse=True)
+                      for sw in range(topo['n_switches'])]
+        _SwitchWiring.__init__(self, free_ports, topo['outport_mappings'], rng)
+
+        self.graph = topo['graph']
+        self.added = set()
+        self.removed = set()
+        for (u, v) in self.graph.edges():
+            if u[0] == 's' and v[0] == 's':
+                x, y = int(u[1:]), int(v[1:])
+                self.adj[x].add(y)
+                self.adj[y].add(x)
+                self.link_index[(min(x, y), max(x, y))] = len(self.links)
+                self.links.append((min(x, y), max(x, y)))
+
+    def linkable(self, x, y):
+        return (_SwitchWiring.linkable(self, x, y) and
+                (min(x, y), max(x, y)) not in self.failed_links)
+
+    def add_switch(self, free_ports):
+        self.free_ports.append(free_ports)
+        self.adj.append(set())
+        sw = len(self.adj) - 1
+        if free_ports:
+            self.open_index[sw] = len(self.open_switches)
+            self.open_switches.append(sw)
+        self.n_open_ports += len(free_ports)
+        return sw
+
+    def connect(self, x, y, x_port, y_port):
+        _SwitchWiring.connect(self, x, y, x_port, y_port)
+        self.graph.add_edge('s'+str(x), 's'+str(y))
+        link = (min(x, y), max(x, y))
+        if link in self.removed:
+            self.removed.discard(link)
+        else:
+            self.added.add(link)
+
+    def disconnect(self, x, y):
+        ports = _SwitchWiring.disconnect(self, x, y)
+        self.graph.remove_edge('s'+str(x), 's'+str(y))
+        link = (min(x, y), max(x, y))
+        if link in self.added:
+            self.added.discard(link)
+        else:
+            self.removed.add(link)
+        return ports
+
+
+class TopologyEditor(object):
+    """
+    Grows or breaks a topo dict in place, the way a Jellyfish is expanded:
+    a new switch is wired in by repeatedly removing a random link (x, y) and
+    linking both x and y to it instead, and a new server takes a free port,
+    freeing one by breaking a link if there is none.
+
+    The switch links added and removed since the last take_changes() are
+    what PathStore.update() needs to recompute only the affected paths.
+    Failed switches keep their id (and their servers), they just lose all
+    their links and are never wired back in.
+
+    Random choices come from `rng` (a random.Random), by default one seeded
+    with `seed`, so a sequence of edits can be replayed.
+    """
+
+    def __init__(self, topo, seed=None, rng=None):
+        self.topo = topo
+        self.rng = rng if rng is not None else random.Random(seed)
+        self.wiring = _EditedWiring(topo, self.rng)
+        self.failed = self.wiring.failed_switches
+        # edits go to the graph and outport mappings; drop the arrays of a
+        # loaded topology so nothing reads the stale wiring from them
+        for name in ['switch_links', 'host_links', 'host_ips']:
+            topo.pop(name, None)
+
+    def add_switch(self, n_servers=0):
+        """
+        Wires in a new switch with topo['n_ports'] ports, `n_servers` of them
+        going to new servers, and returns its id.
+        """
+        n_ports = self.topo['n_ports']
+        if n_servers > n_ports:
+            raise ValueError("a switch with %d ports can't take %d servers" % (n_ports, n_servers))
+
+        sw = self.wiring.add_switch(list(range(1, n_ports + 1)))
+        self.topo['n_switches'] += 1
+        self.topo['graph'].add_node('s'+str(sw))
+        for _ in range(n_servers):
+            self.add_server(sw)
+
+        wiring = self.wiring
+        while len(wiring.free_ports[sw]) >= 2:
+            link = wiring._random_link(lambda x, y: wiring.linkable(sw, x) and wiring.linkable(sw, y))
+            if link is None:
+                break
+            x, y = link
+            x_port, y_port = wiring.disconnect(x, y)
+            wiring.connect(x, sw, x_port, wiring.take_port(sw))
+            wiring.connect(y, sw, y_port, wiring.take_port(sw))
+
+        wiring.link_open_ports()
+        return sw
+
+    def add_server(self, sw):
+        """
+        Attaches a new server to switch `sw` and returns its host id.
+        """
+        if sw in self.failed:
+            raise ValueError("switch %d has failed" % sw)
+
+        wiring = self.wiring
+        if not wiring.free_ports[sw]:
+            if not wiring.adj[sw]:
+                raise ValueError("switch %d has no port left for a server" % sw)
+            # give up one of sw's links; the other end gets wired back in below
+            x = self.rng.choice(sorted(wiring.adj[sw]))
+            sw_port, x_port = wiring.disconnect(sw, x)
+            wiring.release_port(sw, sw_port)
+            wiring.release_port(x, x_port)
+
+        h = self.topo['n_hosts']
+        self.topo['n_hosts'] += 1
+        host, switch = 'h'+str(h), 's'+str(sw)
+        self.topo['graph'].add_node(host, ip='10.0.' + str(h) + '.1')
+        self.topo['graph'].add_edge(host, switch)
+        self.topo['outport_mappings'][(switch, host)] = wiring.take_port(sw)
+        self.topo['outport_mappings'][(host, switch)] = 1
+
+        wiring.link_open_ports()
+        return h
+
+    def fail_link(self, x, y):
+        """
+        Removes the link between switches x and y; their ports stay open,
+        but x and y are never linked again.
+        """
+        x_port, y_port = self.wiring.disconnect(x, y)
+        self.wiring.failed_links.add((min(x, y), max(x, y)))
+        self.wiring.release_port(x, x_port)
+        self.wiring.release_port(y, y_port)
+
+    def fail_switch(self, sw):
+        """
+        Removes every link of switch `sw`. Its neighbors' ports stay open.
+        """
+        wiring = self.wiring
+        for x in list(wiring.adj[sw]):
+            sw_port, x_port = wiring.disconnect(sw, x)
+            wiring.release_port(x, x_port)
+        # keep the failed switch's ports out of any later rewiring
+        while wiring.free_ports[sw]:
+            wiring.take_port(sw)
+        self.failed.add(sw)
+
+    def take_changes(self):
+        """
+        The (added, removed) switch links since the last call, as sorted
+        lists of (x, y) switch id pairs.
+        """
+        added, removed = sorted(self.wiring.added), sorted(self.wiring.removed)
+        self.wiring.added.clear()
+        self.wiring.removed.clear()
+        return added, removed